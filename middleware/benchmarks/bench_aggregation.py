@@ -0,0 +1,69 @@
+"""
+Compares packets and bytes on the wire (including UDP/IP headers) and send rate for bursts of small datagrams sent
+by MiddlewareUnreliable with and without aggregation. Packets are captured with a plain UDP socket over loopback, and
+unpacked with a Reassembler to check that every datagram arrives.
+
+Run from the middleware directory with: python -m benchmarks.bench_aggregation
+"""
+from middleware.middlewareAPI import *
+import middleware.fragmentation.fragmentation as fragmentation
+import time
+
+MESSAGE_COUNT = 20000
+BURST = 50
+PORT = 7102
+
+
+def run(message_size: int, aggregation: bool) -> None:
+    sender = MiddlewareUnreliable(aggregation=aggregation, aggregation_hold_time=0.005)
+    capture = socket(AF_INET, SOCK_DGRAM)
+    capture.setsockopt(SOL_SOCKET, SO_RCVBUF, 2**22)
+    capture.bind(("", PORT))
+    capture.settimeout(0.5)
+    reassembler = fragmentation.Reassembler()
+
+    payload = bytes(message_size)
+    packets = 0
+    wire_bytes = 0
+    delivered = 0
+    send_time = 0.0
+    for _ in range(MESSAGE_COUNT // BURST):
+        start = time.perf_counter()
+        for _ in range(BURST):
+            sender.sendto(payload, ("127.0.0.1", PORT))
+        sender.flush()
+        send_time += time.perf_counter() - start
+
+        target = delivered + BURST
+        try:
+            while delivered < target:
+                frag, addr = capture.recvfrom(65535)
+                packets += 1
+                wire_bytes += len(frag) + fragmentation.UDP_IP_HEADER_SIZE
+                reassembler.add_fragment_to_datagram(frag, addr)
+                while reassembler.check_for_completed_datagrams() != None:
+                    delivered += 1
+        except TimeoutError:
+            pass
+
+    print(
+        "{:>5} byte messages, {:>14}: {:>6} packets, {:>8} bytes on the wire ({:>5.1f} per message), sent {:>7.0f} messages/s, delivered {}/{}".format(
+            message_size,
+            "aggregation" if aggregation else "no aggregation",
+            packets,
+            wire_bytes,
+            wire_bytes / MESSAGE_COUNT,
+            MESSAGE_COUNT / send_time,
+            delivered,
+            MESSAGE_COUNT,
+        )
+    )
+
+    sender.close()
+    capture.close()
+
+
+if __name__ == "__main__":
+    for message_size in [8, 32, 128]:
+        run(message_size, aggregation=False)
+        run(message_size, aggregation=True)
@@ -0,0 +1,66 @@
+"""
+Drives many AsyncMiddlewareUnreliable endpoint pairs from a single asyncio event loop, and reports the number of
+echoed datagrams per second. Each echo is a round trip of a multi-fragment datagram.
+
+Run from the middleware directory with: python -m benchmarks.bench_async
+"""
+from middleware.middlewareAsyncAPI import *
+import asyncio
+import resource
+import time
+
+ROUNDS = 10
+PAYLOAD_SIZE = 2000
+
+
+async def echo(endpoint: AsyncMiddlewareUnreliable) -> None:
+    while True:
+        data, address = await endpoint.recvfrom()
+        endpoint.sendto(data, address)
+
+
+async def ping(client: AsyncMiddlewareUnreliable, address: tuple[str, int]) -> None:
+    for _ in range(ROUNDS):
+        client.sendto(bytes(PAYLOAD_SIZE), address)
+        await client.recvfrom()
+
+
+async def run(pair_count: int) -> None:
+    servers = [
+        await open_unreliable_endpoint(("127.0.0.1", 0)) for _ in range(pair_count)
+    ]
+    clients = [await open_unreliable_endpoint() for _ in range(pair_count)]
+    echoes = [asyncio.create_task(echo(server)) for server in servers]
+
+    start = time.perf_counter()
+    await asyncio.wait_for(
+        asyncio.gather(
+            *(
+                ping(client, server.getsockname())
+                for client, server in zip(clients, servers)
+            )
+        ),
+        60,
+    )
+    elapsed = time.perf_counter() - start
+
+    print(
+        "{:>6} endpoint pairs: {:>8.0f} echoed datagrams/s".format(
+            pair_count, pair_count * ROUNDS / elapsed
+        )
+    )
+
+    for task in echoes:
+        task.cancel()
+    for endpoint in servers + clients:
+        endpoint.close()
+
+
+if __name__ == "__main__":
+    # NOTE: Two sockets per pair, raise the soft limit on open files as far as allowed
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    limit = 2**20 if hard == resource.RLIM_INFINITY else hard
+    for pair_count in [10, 100, 1000, 2000]:
+        if pair_count * 2 + 16 <= limit:
+            asyncio.run(run(pair_count))
@@ -0,0 +1,60 @@
+"""
+Compares fragments/sec for MiddlewareUnreliable with and without batched I/O (sendmmsg/recvmmsg) over loopback.
+
+Run from the middleware directory with: python -m benchmarks.bench_batched_io
+"""
+from middleware.middlewareAPI import *
+import threading
+import time
+
+DATAGRAM_COUNT = 500
+PORT = 7100
+
+
+def run(batched_io: bool) -> None:
+    sender = MiddlewareUnreliable(batched_io=batched_io)
+    receiver = MiddlewareUnreliable(batched_io=batched_io)
+    receiver._socko.setsockopt(SOL_SOCKET, SO_RCVBUF, 2**22)
+    receiver.bind(("", PORT))
+    receiver.settimeout(1)
+
+    payload = bytes(60000)
+    frag_count = len(sender._fragmenter.fragment(payload))
+    received = 0
+
+    def receive():
+        nonlocal received
+        try:
+            while received < DATAGRAM_COUNT:
+                receiver.recvfrom()
+                received += 1
+        except TimeoutError:
+            pass
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+
+    start = time.perf_counter()
+    for _ in range(DATAGRAM_COUNT):
+        sender.sendto(payload, ("localhost", PORT))
+    send_time = time.perf_counter() - start
+    thread.join()
+    total_time = time.perf_counter() - start
+
+    print(
+        "{:>8}: sent {:>10.0f} fragments/s, delivered {:>10.0f} fragments/s ({}/{} datagrams)".format(
+            "batched" if batched_io else "loop",
+            DATAGRAM_COUNT * frag_count / send_time,
+            received * frag_count / total_time,
+            received,
+            DATAGRAM_COUNT,
+        )
+    )
+
+    sender.close()
+    receiver.close()
+
+
+if __name__ == "__main__":
+    run(batched_io=False)
+    run(batched_io=True)
@@ -0,0 +1,87 @@
+"""
+Compares the bytes on the wire (fragments including UDP/IP headers) and the CPU time to fragment and reassemble a
+datagram without compression and with each codec, for typical payloads (JSON status reports, text chat and random
+data, which does not compress and is sent uncompressed).
+
+Run from the middleware directory with: python -m benchmarks.bench_compression
+"""
+import json
+import random
+import time
+import middleware.fragmentation.compression as compression
+import middleware.fragmentation.fragmentation as fragmentation
+
+ADDR = ("127.0.0.1", 7104)
+MTU = 512
+DURATION = 0.5
+
+
+def status_report(count: int) -> bytes:
+    return json.dumps(
+        [
+            {
+                "unit": "unit-{}".format(i),
+                "status": random.choice(["ok", "degraded", "offline"]),
+                "position": [
+                    round(random.uniform(-90, 90), 5),
+                    round(random.uniform(-180, 180), 5),
+                ],
+                "battery": random.randint(0, 100),
+            }
+            for i in range(count)
+        ]
+    ).encode()
+
+
+def chat_message() -> bytes:
+    words = "the convoy arrives at the checkpoint at dawn hold position until further notice over".split()
+    return " ".join(random.choice(words) for _ in range(40)).encode()
+
+
+PAYLOADS = {
+    "chat (~250 B)": chat_message(),
+    "status (~1 KB)": status_report(10),
+    "status (~10 KB)": status_report(100),
+    "random (1 KB)": random.randbytes(1000),
+}
+
+
+def measure(codec: str, payload: bytes) -> tuple[int, float, float]:
+    """
+    Returns the wire size, and the microseconds per datagram to fragment and to reassemble it
+    """
+    fragmenter = fragmentation.Fragmenter(MTU, compression_codec=codec)
+    reassembler = fragmentation.Reassembler()
+    fragments = [bytes(frag) for frag in fragmenter.fragment(payload)]
+    wire = sum(len(frag) + fragmentation.UDP_IP_HEADER_SIZE for frag in fragments)
+
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        fragmenter.fragment(payload)
+        count += 1
+    send_us = (time.perf_counter() - start) / count * 1e6
+
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        for frag in fragments:
+            reassembler.add_fragment_to_datagram(frag, ADDR)
+        assert reassembler.check_for_completed_datagrams()[0] == payload
+        reassembler.completed_keys.clear()
+        count += 1
+    recv_us = (time.perf_counter() - start) / count * 1e6
+    return wire, send_us, recv_us
+
+
+if __name__ == "__main__":
+    print("MTU {}:".format(MTU))
+    for name, payload in PAYLOADS.items():
+        print("{} payload, {} bytes:".format(name, len(payload)))
+        for codec in [compression.CODEC_NONE] + compression.available_codecs():
+            wire, send_us, recv_us = measure(codec, payload)
+            print(
+                "    {:>5}: {:>6} bytes on the wire, {:>8.1f} us to send, {:>8.1f} us to receive".format(
+                    codec, wire, send_us, recv_us
+                )
+            )
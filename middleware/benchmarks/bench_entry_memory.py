@@ -0,0 +1,42 @@
+"""
+Measures the memory used per in-flight (partial) datagram in the Reassembler, split into the reassembly buffer and
+the bookkeeping around it (store entry, received fragment indices, peer accounting and ordering structures).
+
+Run from the middleware directory with: python -m benchmarks.bench_entry_memory
+"""
+import middleware.fragmentation.fragmentation as fragmentation
+import tracemalloc
+
+PARTIAL_COUNT = 10000
+
+
+def run(frag_count: int) -> None:
+    fragmenter = fragmentation.Fragmenter()
+    payload = bytes(fragmenter.max_frag_payload * frag_count)
+    # NOTE: Every datagram is missing its FIN fragment, and comes from its own peer
+    fragments = [
+        (bytes(frag), ("10.0.0.1", i))
+        for i in range(PARTIAL_COUNT)
+        for frag in fragmenter.fragment(payload)[:-1]
+    ]
+
+    reassembler = fragmentation.Reassembler(max_bytes=0)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for frag, addr in fragments:
+        reassembler.add_fragment_to_datagram(frag, addr)
+    total = (tracemalloc.get_traced_memory()[0] - before) / PARTIAL_COUNT
+    tracemalloc.stop()
+
+    buffered = sum(len(entry.buffer) for entry in reassembler.datagrams.values())
+    buffered /= PARTIAL_COUNT
+    print(
+        "{:>4} fragments/datagram: {:>8.0f} bytes/datagram, of which {:>6.0f} bookkeeping".format(
+            frag_count, total, total - buffered
+        )
+    )
+
+
+if __name__ == "__main__":
+    for frag_count in [2, 4, 16, 64]:
+        run(frag_count)
@@ -0,0 +1,54 @@
+"""
+Measures datagram delivery under random fragment loss with and without forward error correction,
+together with the bandwidth overhead and encode/decode cost of the repair fragments.
+Loss is simulated in process between a Fragmenter and a Reassembler.
+
+Run from the middleware directory with: python -m benchmarks.bench_fec
+"""
+from middleware.fragmentation.fragmentation import Fragmenter, Reassembler
+import random
+import time
+
+DATAGRAM_COUNT = 200
+PAYLOAD_SIZE = 60000
+ADDR = ("127.0.0.1", 5000)
+
+
+def run(data_fragments: int, repair_fragments: int, loss: float) -> None:
+    fragmenter = Fragmenter(
+        fec_data_fragments=data_fragments, fec_repair_fragments=repair_fragments
+    )
+    reassembler = Reassembler()
+    payload = random.randbytes(PAYLOAD_SIZE)
+    rng = random.Random(0)
+
+    sent_bytes = 0
+    delivered = 0
+    start = time.perf_counter()
+    for _ in range(DATAGRAM_COUNT):
+        fragments = fragmenter.fragment(payload)
+        sent_bytes += sum(len(frag) for frag in fragments)
+        for frag in fragments:
+            if rng.random() >= loss:
+                reassembler.add_fragment_to_datagram(frag, ADDR)
+        while reassembler.check_for_completed_datagrams() != None:
+            delivered += 1
+    elapsed = time.perf_counter() - start
+
+    print(
+        "{:>8} loss {:>4.0%}: delivered {:>5.1%}, overhead {:>5.1%}, {:>8.0f} datagrams/s".format(
+            "k={} m={}".format(data_fragments, repair_fragments)
+            if data_fragments
+            else "no FEC",
+            loss,
+            delivered / DATAGRAM_COUNT,
+            sent_bytes / (DATAGRAM_COUNT * PAYLOAD_SIZE) - 1,
+            DATAGRAM_COUNT / elapsed,
+        )
+    )
+
+
+if __name__ == "__main__":
+    for loss in [0.0, 0.01, 0.05]:
+        for data_fragments, repair_fragments in [(0, 1), (8, 1), (8, 2), (4, 2)]:
+            run(data_fragments, repair_fragments, loss)
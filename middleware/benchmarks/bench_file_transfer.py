@@ -0,0 +1,126 @@
+"""
+Compares ways of moving bulk data over MiddlewareReliable on loopback: sending a file read in chunks with sendall
+against sendfile, receiving it with recv and write against recv_into_file, and sending a large in-memory buffer with
+and without MSG_ZEROCOPY. On loopback the kernel copies zero-copy buffers anyway, so only the overhead of
+MSG_ZEROCOPY shows there, its benefit needs a NIC.
+
+Run from the middleware directory with: python -m benchmarks.bench_file_transfer
+"""
+from middleware.middlewareAPI import *
+import os
+import tempfile
+import threading
+import time
+
+FILE_SIZE = 2**28
+BUFFER_SIZE = 2**24
+BUFFER_SENDS = 32
+CHUNK_SIZE = 2**16
+ADDR = ("127.0.0.1", 7106)
+
+
+def connect(send, receive, **kwargs) -> float:
+    """
+    Runs send on a client connection and receive on the accepted one, and returns the seconds until both are done
+    """
+    server = MiddlewareReliable()
+    server._socko.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    server.bind(ADDR)
+    server.listen()
+
+    def serve():
+        conn, _ = server.accept()
+        receive(conn)
+        conn.close()
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    client = MiddlewareReliable(**kwargs)
+    client.connect(ADDR)
+    start = time.perf_counter()
+    send(client)
+    client.close()
+    thread.join()
+    elapsed = time.perf_counter() - start
+    server.close()
+    return elapsed
+
+
+def send_read(sock: MiddlewareReliable, file) -> None:
+    file.seek(0)
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        if len(chunk) == 0:
+            break
+        sock.sendall(chunk)
+
+
+def receive_write(sock: MiddlewareReliable, file) -> None:
+    file.seek(0)
+    received = 0
+    while received < FILE_SIZE:
+        chunk = sock.recv(CHUNK_SIZE)
+        file.write(chunk)
+        received += len(chunk)
+    file.flush()
+
+
+def receive_discard(sock: MiddlewareReliable, size: int) -> None:
+    buffer = bytearray(2**20)
+    received = 0
+    while received < size:
+        received += sock._socko.recv_into(buffer)
+
+
+def report(name: str, size: int, elapsed: float) -> None:
+    print("{:>32}: {:>8.1f} MB/s".format(name, size / elapsed / 1e6))
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        source = open(os.path.join(directory, "source"), "w+b")
+        target = open(os.path.join(directory, "target"), "w+b")
+        source.write(os.urandom(FILE_SIZE))
+        source.flush()
+
+        print("File of {} MiB:".format(FILE_SIZE >> 20))
+        report(
+            "read + sendall, recv + write",
+            FILE_SIZE,
+            connect(
+                lambda sock: send_read(sock, source),
+                lambda sock: receive_write(sock, target),
+            ),
+        )
+        report(
+            "sendfile, recv + write",
+            FILE_SIZE,
+            connect(
+                lambda sock: sock.sendfile(source),
+                lambda sock: receive_write(sock, target),
+            ),
+        )
+        report(
+            "sendfile, recv_into_file",
+            FILE_SIZE,
+            connect(
+                lambda sock: sock.sendfile(source),
+                lambda sock: sock.recv_into_file(target, FILE_SIZE),
+            ),
+        )
+        source.close()
+        target.close()
+
+    data = os.urandom(BUFFER_SIZE)
+    size = BUFFER_SIZE * BUFFER_SENDS
+    print("{} sends of {} MiB:".format(BUFFER_SENDS, BUFFER_SIZE >> 20))
+    for zero_copy in [False, True]:
+        report(
+            "sendall" + (" (zero-copy)" if zero_copy else ""),
+            size,
+            connect(
+                lambda sock: [sock.sendall(data) for _ in range(BUFFER_SENDS)],
+                lambda sock: receive_discard(sock, size),
+                zero_copy=zero_copy,
+            ),
+        )
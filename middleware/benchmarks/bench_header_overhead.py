@@ -0,0 +1,49 @@
+"""
+Compares the bytes on the wire (fragments including UDP/IP headers) per datagram for the legacy and the compact
+fragment header, for a range of message sizes, with and without FEC.
+
+Run from the middleware directory with: python -m benchmarks.bench_header_overhead
+"""
+import middleware.fragmentation.fragmentation as fragmentation
+
+MESSAGE_SIZES = [8, 32, 128, 512, 1024, 4096, 65536]
+# NOTE: Datagram ids grow while a socket is in use, which makes compact headers longer. Measured after this many
+#       datagrams have been sent
+WARMUP = 1000
+
+
+def wire_size(fragmenter: fragmentation.Fragmenter, size: int) -> int:
+    for _ in range(WARMUP):
+        fragmenter.fragment(bytes(size))
+    fragments = fragmenter.fragment(bytes(size))
+    return sum(len(frag) + fragmentation.UDP_IP_HEADER_SIZE for frag in fragments)
+
+
+def run(mtu: int, fec_data_fragments: int) -> None:
+    print(
+        "MTU {}, {}:".format(
+            mtu,
+            "FEC {}+1".format(fec_data_fragments) if fec_data_fragments else "no FEC",
+        )
+    )
+    for size in MESSAGE_SIZES:
+        legacy = wire_size(fragmentation.Fragmenter(mtu, fec_data_fragments), size)
+        compact = wire_size(
+            fragmentation.Fragmenter(mtu, fec_data_fragments, compact_headers=True),
+            size,
+        )
+        print(
+            "{:>8} byte messages: legacy {:>8} bytes, compact {:>8} bytes, saved {:>4} bytes ({:.1f}%)".format(
+                size,
+                legacy,
+                compact,
+                legacy - compact,
+                100 * (legacy - compact) / legacy,
+            )
+        )
+
+
+if __name__ == "__main__":
+    run(1500, 0)
+    run(1500, 8)
+    run(256, 0)
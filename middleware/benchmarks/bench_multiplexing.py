@@ -0,0 +1,133 @@
+"""
+Compares the latency of a small urgent command sent while a large transfer is under way on the same
+MiddlewareReliable connection: on a plain connection the command waits until the transfer has been written, with a
+Multiplexer it is sent on a stream of higher priority and overtakes the rest of the transfer. Also reports the
+throughput of the transfer, which with the Multiplexer depends on the chunk size.
+
+Run from the middleware directory with: python -m benchmarks.bench_multiplexing
+"""
+from middleware.middlewareAPI import *
+import middleware.multiplexing.multiplexing as multiplexing
+import threading
+import time
+
+ADDR = ("127.0.0.1", 7107)
+TRANSFER_SIZE = 2**25
+COMMAND = bytes(100)
+COMMAND_DELAY = 0.005
+ROUNDS = 5
+# NOTE: Smaller chunks delay urgent data less, larger ones cost less CPU
+CHUNK_SIZES = [2**12, 2**14, multiplexing.DEFAULT_CHUNK_SIZE]
+
+
+def connection_pair() -> tuple[MiddlewareReliable, MiddlewareReliable]:
+    server = MiddlewareReliable()
+    server._socko.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    server.bind(ADDR)
+    server.listen()
+    client = MiddlewareReliable()
+    client.connect(ADDR)
+    conn, _ = server.accept()
+    server.close()
+    return client, conn
+
+
+def plain() -> tuple[float, float]:
+    """
+    Returns the latency of the command and the duration of the transfer, on a connection shared with a lock
+    """
+    client, conn = connection_pair()
+    lock = threading.Lock()
+    transfer = bytes(TRANSFER_SIZE)
+
+    def send_transfer():
+        with lock:
+            client.send_message(transfer)
+
+    def receive():
+        nonlocal transfer_time, received
+        conn.recv_message(TRANSFER_SIZE)
+        transfer_time = time.perf_counter() - start
+        assert conn.recv_message() == COMMAND
+        received = time.perf_counter()
+
+    transfer_time = None
+    received = None
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    start = time.perf_counter()
+    sender = threading.Thread(target=send_transfer)
+    sender.start()
+    time.sleep(COMMAND_DELAY)
+    submitted = time.perf_counter()
+    with lock:
+        client.send_message(COMMAND)
+    sender.join()
+    receiver.join()
+    client.close()
+    conn.close()
+    return received - submitted, transfer_time
+
+
+def multiplexed(chunk_size: int) -> tuple[float, float]:
+    """
+    Returns the latency of the command and the duration of the transfer, on two streams of a Multiplexer
+    """
+    client, conn = connection_pair()
+    client_mux = multiplexing.Multiplexer(client, chunk_size)
+    server_mux = multiplexing.Multiplexer(conn)
+    bulk = client_mux.open_stream(1, priority=1)
+    control = client_mux.open_stream(2, priority=0)
+    server_bulk = server_mux.open_stream(1)
+    server_control = server_mux.open_stream(2)
+    transfer = bytes(TRANSFER_SIZE)
+    transfer_time = None
+
+    def receive_transfer():
+        nonlocal transfer_time
+        received = 0
+        while received < TRANSFER_SIZE:
+            received += len(server_bulk.recv(2**20))
+        transfer_time = time.perf_counter() - start
+
+    receiver = threading.Thread(target=receive_transfer)
+    start = time.perf_counter()
+    receiver.start()
+    sender = threading.Thread(target=bulk.sendall, args=(transfer,))
+    sender.start()
+    time.sleep(COMMAND_DELAY)
+    submitted = time.perf_counter()
+    control.sendall(COMMAND)
+    received = b""
+    while len(received) < len(COMMAND):
+        received += server_control.recv(len(COMMAND))
+    latency = time.perf_counter() - submitted
+    sender.join()
+    receiver.join()
+    client_mux.close()
+    server_mux.close()
+    return latency, transfer_time
+
+
+if __name__ == "__main__":
+    print(
+        "{} byte command sent {} ms into a {} MiB transfer:".format(
+            len(COMMAND), COMMAND_DELAY * 1000, TRANSFER_SIZE >> 20
+        )
+    )
+    runs = [("plain", plain)] + [
+        (
+            "multiplexed, {} byte chunks".format(chunk_size),
+            lambda chunk_size=chunk_size: multiplexed(chunk_size),
+        )
+        for chunk_size in CHUNK_SIZES
+    ]
+    for name, run in runs:
+        results = [run() for _ in range(ROUNDS)]
+        latency = sorted(result[0] for result in results)[ROUNDS // 2]
+        transfer_time = sorted(result[1] for result in results)[ROUNDS // 2]
+        print(
+            "{:>36}: command latency {:>8.2f} ms, transfer {:>7.1f} MB/s".format(
+                name, latency * 1000, TRANSFER_SIZE / transfer_time / 1e6
+            )
+        )
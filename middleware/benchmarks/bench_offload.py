@@ -0,0 +1,66 @@
+"""
+Compares fragments/sec for large MiddlewareUnreliable datagrams over loopback sent and received one fragment per
+syscall, with batched I/O (sendmmsg/recvmmsg) and with UDP GSO/GRO offload (UDP_SEGMENT/UDP_GRO).
+
+Run from the middleware directory with: python -m benchmarks.bench_offload
+"""
+from middleware.middlewareAPI import *
+import threading
+import time
+
+DATAGRAM_COUNT = 500
+PORT = 7103
+
+
+def run(name: str, **kwargs) -> None:
+    sender = MiddlewareUnreliable(**kwargs)
+    receiver = MiddlewareUnreliable(**kwargs)
+    receiver._socko.setsockopt(SOL_SOCKET, SO_RCVBUF, 2**22)
+    receiver.bind(("", PORT))
+    receiver.settimeout(1)
+    if kwargs.get("offload") and not (
+        sender._segmentation.enabled and receiver._gro_receiver.enabled
+    ):
+        print("{:>8}: not supported by the kernel, using the fallback".format(name))
+
+    payload = bytes(60000)
+    frag_count = len(sender._fragmenter.fragment(payload))
+    received = 0
+
+    def receive():
+        nonlocal received
+        try:
+            while received < DATAGRAM_COUNT:
+                receiver.recvfrom()
+                received += 1
+        except TimeoutError:
+            pass
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+
+    start = time.perf_counter()
+    for _ in range(DATAGRAM_COUNT):
+        sender.sendto(payload, ("localhost", PORT))
+    send_time = time.perf_counter() - start
+    thread.join()
+    total_time = time.perf_counter() - start
+
+    print(
+        "{:>8}: sent {:>10.0f} fragments/s, delivered {:>10.0f} fragments/s ({}/{} datagrams)".format(
+            name,
+            DATAGRAM_COUNT * frag_count / send_time,
+            received * frag_count / total_time,
+            received,
+            DATAGRAM_COUNT,
+        )
+    )
+
+    sender.close()
+    receiver.close()
+
+
+if __name__ == "__main__":
+    run("loop")
+    run("batched", batched_io=True)
+    run("offload", offload=True)
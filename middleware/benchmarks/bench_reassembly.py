@@ -0,0 +1,47 @@
+"""
+Measures the receive cost per fragment in the Reassembler (timeout, add and completion check, as done by
+MiddlewareUnreliable.recvfrom) with an increasing number of concurrent partial datagrams (datagrams missing
+a fragment) held in the store.
+
+Run from the middleware directory with: python -m benchmarks.bench_reassembly
+"""
+import middleware.fragmentation.fragmentation as fragmentation
+import time
+
+FRAGMENTS_PER_DATAGRAM = 4
+MEASURED_DATAGRAMS = 5000
+
+
+def run(partial_count: int) -> None:
+    fragmenter = fragmentation.Fragmenter()
+    reassembler = fragmentation.Reassembler()
+    payload = bytes(fragmenter.max_frag_payload * FRAGMENTS_PER_DATAGRAM)
+
+    # NOTE: Partial datagrams are spread over many peers, each missing its last fragment
+    for i in range(partial_count):
+        for frag in fragmenter.fragment(payload)[:-1]:
+            reassembler.add_fragment_to_datagram(bytes(frag), ("10.0.0.1", i))
+
+    measured = [
+        (bytes(frag), ("10.0.0.2", 1))
+        for _ in range(MEASURED_DATAGRAMS)
+        for frag in fragmenter.fragment(payload)
+    ]
+
+    start = time.perf_counter()
+    for frag, addr in measured:
+        reassembler.timeout_old_datagrams()
+        reassembler.add_fragment_to_datagram(frag, addr)
+        reassembler.check_for_completed_datagrams()
+    elapsed = time.perf_counter() - start
+
+    print(
+        "{:>6} partial datagrams: {:>6.2f} us/fragment".format(
+            partial_count, elapsed / len(measured) * 1e6
+        )
+    )
+
+
+if __name__ == "__main__":
+    for partial_count in [0, 1000, 5000, 20000]:
+        run(partial_count)
@@ -0,0 +1,61 @@
+"""
+Measures messages/sec for small (single-fragment) MiddlewareUnreliable datagrams over loopback, for sending
+and for receiving with each of the receive paths. Messages are sent in bursts that fit in the socket receive
+buffer, and then received, so that nothing is lost.
+
+Run from the middleware directory with: python -m benchmarks.bench_small_messages
+"""
+from middleware.middlewareAPI import *
+import time
+
+MESSAGE_COUNT = 100000
+BURST = 500
+MESSAGE_SIZE = 64
+PORT = 7101
+
+
+def run(name: str, **kwargs) -> None:
+    sender = MiddlewareUnreliable(**kwargs)
+    receiver = MiddlewareUnreliable(**kwargs)
+    receiver._socko.setsockopt(SOL_SOCKET, SO_RCVBUF, 2**22)
+    receiver.bind(("", PORT))
+    receiver.settimeout(1)
+
+    payload = bytes(MESSAGE_SIZE)
+    send_time = 0.0
+    recv_time = 0.0
+    received = 0
+    for _ in range(MESSAGE_COUNT // BURST):
+        start = time.perf_counter()
+        for _ in range(BURST):
+            sender.sendto(payload, ("127.0.0.1", PORT))
+        send_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            for _ in range(BURST):
+                receiver.recvfrom()
+                received += 1
+        except TimeoutError:
+            pass
+        recv_time += time.perf_counter() - start
+
+    print(
+        "{:>9}: sent {:>8.0f} messages/s, received {:>8.0f} messages/s ({}/{} messages)".format(
+            name,
+            MESSAGE_COUNT / send_time,
+            received / recv_time,
+            received,
+            MESSAGE_COUNT,
+        )
+    )
+
+    sender.close()
+    receiver.close()
+
+
+if __name__ == "__main__":
+    run("loop")
+    run("batched", batched_io=True)
+    run("in-place", in_place_reassembly=True)
+    run("zero-copy", zero_copy=True)
@@ -0,0 +1,87 @@
+"""
+Compares the write modes of MiddlewareReliable for small writes: the throughput of a burst of small writes (until the
+last byte has arrived), the number of segments they were sent in, and the round-trip latency of small request/reply
+exchanges, where held writes are flushed by the receive waiting for the reply.
+
+Run from the middleware directory with: python -m benchmarks.bench_write_modes
+"""
+from middleware.middlewareAPI import *
+import threading
+import time
+
+WRITE_SIZE = 64
+BURST_WRITES = 20000
+ROUND_TRIPS = 2000
+MODES = ["default", "nodelay", "cork", "buffered"]
+
+
+def serve(server: MiddlewareReliable) -> None:
+    conn, _ = server.accept()
+    conn._socko.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+    # NOTE: Burst: read everything, then acknowledge with a single byte
+    received = 0
+    while received < WRITE_SIZE * BURST_WRITES:
+        received += len(conn._socko.recv(2**20))
+    conn._socko.sendall(b"!")
+    # NOTE: Round trips: echo every request
+    for _ in range(ROUND_TRIPS):
+        request = b""
+        while len(request) < WRITE_SIZE:
+            request += conn._socko.recv(WRITE_SIZE - len(request))
+        conn._socko.sendall(request)
+    conn.close()
+
+
+def segments_sent(sock: MiddlewareReliable) -> int:
+    # NOTE: tcpi_segs_out of struct tcp_info (Linux)
+    info = sock._socko.getsockopt(IPPROTO_TCP, TCP_INFO, 256)
+    return int.from_bytes(info[136:140], "little")
+
+
+def run(mode: str) -> None:
+    server = MiddlewareReliable()
+    server._socko.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", 7105))
+    server.listen()
+    thread = threading.Thread(target=serve, args=(server,))
+    thread.start()
+
+    client = MiddlewareReliable(write_mode=mode)
+    client.connect(("127.0.0.1", 7105))
+    message = bytes(WRITE_SIZE)
+
+    segments = segments_sent(client)
+    start = time.perf_counter()
+    for _ in range(BURST_WRITES):
+        client.sendall(message)
+    client.flush()
+    assert client.recv(1) == b"!"
+    burst_time = time.perf_counter() - start
+    segments = segments_sent(client) - segments
+
+    start = time.perf_counter()
+    for _ in range(ROUND_TRIPS):
+        client.sendall(message)
+        reply = b""
+        while len(reply) < WRITE_SIZE:
+            reply += client.recv(WRITE_SIZE - len(reply))
+    round_trip = (time.perf_counter() - start) / ROUND_TRIPS
+
+    thread.join()
+    client.close()
+    server.close()
+    print(
+        "{:>8}: {:>8.0f} writes/s ({:>6.1f} MB/s) in {:>6} segments, round trip {:>7.1f} us".format(
+            mode,
+            BURST_WRITES / burst_time,
+            BURST_WRITES * WRITE_SIZE / burst_time / 1e6,
+            segments,
+            round_trip * 1e6,
+        )
+    )
+
+
+if __name__ == "__main__":
+    print("{} writes of {} bytes:".format(BURST_WRITES, WRITE_SIZE))
+    for mode in MODES:
+        run(mode)
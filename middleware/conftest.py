@@ -1,4 +1,6 @@
 import pytest
+import socket
+from middleware.middlewareAPI import MiddlewareReliable
 
 
 def pytest_addoption(parser):
@@ -19,3 +21,36 @@ def pytest_collection_modifyitems(config, items):
     for item in items:
         if "slow" in item.keywords:
             item.add_marker(skip_slow)
+
+
+@pytest.fixture
+def tcp_connection():
+    """
+    A connected pair of plain TCP sockets over loopback, as (sender, receiver)
+    """
+    listener = socket.create_server(("127.0.0.1", 0))
+    sender = socket.create_connection(listener.getsockname())
+    receiver, _ = listener.accept()
+    listener.close()
+    receiver.settimeout(5)
+    sender.settimeout(5)
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+@pytest.fixture
+def reliable_connection():
+    """
+    A connected pair of MiddlewareReliable sockets over loopback, as (client, server)
+    """
+    listener = MiddlewareReliable()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    client = MiddlewareReliable()
+    client.connect(listener._socko.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    yield client, server
+    client.close()
+    server.close()
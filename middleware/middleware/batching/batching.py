@@ -0,0 +1,423 @@
+from socket import *
+from typing import Optional
+import ctypes
+import errno
+import os
+import select
+import sys
+import time
+
+# NOTE: Python's socket module does not expose sendmmsg/recvmmsg, so they are called directly
+#       from libc through ctypes. On platforms without them, the functions below fall back to
+#       one socket.sendto/socket.recvfrom call per message
+RECV_BATCH_SIZE = 32
+# NOTE: Large enough for any UDP payload, received datagrams can therefore never be truncated
+RECV_BUFFER_SIZE = 2**16
+MSG_WAITFORONE = 0x10000
+
+
+class _SockaddrIn(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+
+class _Iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _Msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_Iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _Mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _Msghdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    if sys.platform != "linux":
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.sendmmsg.argtypes = [
+            ctypes.c_int,
+            ctypes.POINTER(_Mmsghdr),
+            ctypes.c_uint,
+            ctypes.c_int,
+        ]
+        libc.recvmmsg.argtypes = [
+            ctypes.c_int,
+            ctypes.POINTER(_Mmsghdr),
+            ctypes.c_uint,
+            ctypes.c_int,
+            ctypes.c_void_p,
+        ]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _load_libc()
+BATCHED_IO_AVAILABLE = _libc != None
+
+
+def _to_sockaddr(address: tuple[str, int]) -> _SockaddrIn:
+    host, port = address
+    if host == "<broadcast>":
+        host = "255.255.255.255"
+
+    sockaddr = _SockaddrIn()
+    sockaddr.sin_family = AF_INET
+    sockaddr.sin_port = htons(port)
+    sockaddr.sin_addr[:] = inet_aton(gethostbyname(host))
+    return sockaddr
+
+
+def _from_sockaddr(sockaddr: _SockaddrIn) -> tuple[str, int]:
+    return inet_ntoa(bytes(sockaddr.sin_addr)), ntohs(sockaddr.sin_port)
+
+
+class _PyBuffer(ctypes.Structure):
+    _fields_ = [
+        ("buf", ctypes.c_void_p),
+        ("obj", ctypes.c_void_p),
+        ("len", ctypes.c_ssize_t),
+        ("itemsize", ctypes.c_ssize_t),
+        ("readonly", ctypes.c_int),
+        ("ndim", ctypes.c_int),
+        ("format", ctypes.c_char_p),
+        ("shape", ctypes.c_void_p),
+        ("strides", ctypes.c_void_p),
+        ("suboffsets", ctypes.c_void_p),
+        ("internal", ctypes.c_void_p),
+    ]
+
+
+ctypes.pythonapi.PyObject_GetBuffer.argtypes = [
+    ctypes.py_object,
+    ctypes.POINTER(_PyBuffer),
+    ctypes.c_int,
+]
+ctypes.pythonapi.PyBuffer_Release.argtypes = [ctypes.POINTER(_PyBuffer)]
+
+
+def _acquire_buffer(buffer, acquired: list[_PyBuffer]) -> tuple[int, int]:
+    """
+    Returns the address and length in bytes of any object supporting the buffer protocol (bytes, bytearray, memoryview, mmap, ...)
+    without copying it. The buffer is appended to acquired, and must be released with _release_buffers
+    after the syscall has completed
+    """
+    py_buffer = _PyBuffer()
+    ctypes.pythonapi.PyObject_GetBuffer(buffer, ctypes.byref(py_buffer), 0)
+    acquired.append(py_buffer)
+    return py_buffer.buf, py_buffer.len
+
+
+def _release_buffers(acquired: list[_PyBuffer]) -> None:
+    for py_buffer in acquired:
+        ctypes.pythonapi.PyBuffer_Release(ctypes.byref(py_buffer))
+
+
+def _wait_until_ready(sock: socket, for_write: bool, deadline: Optional[float]) -> None:
+    """
+    Emulates the blocking timeout of a Python socket, which is implemented with a non-blocking file descriptor.
+    Raises TimeoutError if the socket does not become ready before the deadline
+    """
+    timeout = None if deadline == None else max(0.0, deadline - time.monotonic())
+    if for_write:
+        _, ready, _ = select.select([], [sock], [], timeout)
+    else:
+        ready, _, _ = select.select([sock], [], [], timeout)
+    if not ready:
+        raise TimeoutError("timed out")
+
+
+def _call_with_timeout(sock: socket, for_write: bool, syscall) -> int:
+    """
+    Calls syscall(flags) and retries it according to the timeout set on sock. Mirrors Python socket behaviour:
+    a timeout of 0 raises BlockingIOError, a timeout > 0 raises TimeoutError and None blocks indefinitely
+    """
+    timeout = sock.gettimeout()
+    deadline = None if timeout == None else time.monotonic() + timeout
+    flags = 0 if timeout == None else MSG_DONTWAIT
+
+    while True:
+        result = syscall(flags)
+        if result >= 0:
+            return result
+
+        err = ctypes.get_errno()
+        if err == errno.EINTR:
+            continue
+        if err in (errno.EAGAIN, errno.EWOULDBLOCK) and timeout != 0:
+            _wait_until_ready(sock, for_write, deadline)
+            continue
+        raise OSError(err, os.strerror(err))
+
+
+def sendmmsg(sock: socket, messages: list, address: tuple[str, int]) -> int:
+    """
+    Sends every message in messages to address, using as few syscalls as possible. Each message is either a single
+    bytes-like object or a list of bytes-like objects which are sent as one datagram (scatter-gather).
+    Returns the total number of bytes sent
+    """
+    if not BATCHED_IO_AVAILABLE:
+        sent = 0
+        for message in messages:
+            if isinstance(message, list):
+                sent += sock.sendmsg(message, [], 0, address)
+            else:
+                sent += sock.sendto(message, address)
+        return sent
+
+    sockaddr = _to_sockaddr(address)
+    acquired = []
+    keep_alive = []
+    try:
+        msgvec = (_Mmsghdr * len(messages))()
+        for i, message in enumerate(messages):
+            buffers = message if isinstance(message, list) else [message]
+            iovecs = (_Iovec * len(buffers))()
+            for j, buffer in enumerate(buffers):
+                iovecs[j].iov_base, iovecs[j].iov_len = _acquire_buffer(
+                    buffer, acquired
+                )
+            keep_alive.append(iovecs)
+
+            msgvec[i].msg_hdr.msg_name = ctypes.addressof(sockaddr)
+            msgvec[i].msg_hdr.msg_namelen = ctypes.sizeof(sockaddr)
+            msgvec[i].msg_hdr.msg_iov = iovecs
+            msgvec[i].msg_hdr.msg_iovlen = len(buffers)
+
+        fd = sock.fileno()
+        offset = 0
+        while offset < len(messages):
+            # NOTE: sendmmsg may send fewer messages than requested, the remainder is sent by the next call
+            count = _call_with_timeout(
+                sock,
+                True,
+                lambda flags: _libc.sendmmsg(
+                    fd,
+                    ctypes.byref(msgvec[offset]),
+                    len(messages) - offset,
+                    flags,
+                ),
+            )
+            offset += count
+    finally:
+        _release_buffers(acquired)
+
+    return sum(msg.msg_len for msg in msgvec)
+
+
+class ReceiveBatch:
+    """
+    Preallocated buffers for receiving up to RECV_BATCH_SIZE datagrams with a single recvmmsg call.
+    Allocated once per socket, as building the structures for each call would defeat the purpose of batching
+    """
+
+    def __init__(self, batch_size: int = RECV_BATCH_SIZE):
+        self._batch_size = batch_size
+        self._buffers = [
+            ctypes.create_string_buffer(RECV_BUFFER_SIZE) for _ in range(batch_size)
+        ]
+        self._iovecs = (_Iovec * batch_size)()
+        self._sockaddrs = (_SockaddrIn * batch_size)()
+        self._msgvec = (_Mmsghdr * batch_size)()
+
+        for i in range(batch_size):
+            self._iovecs[i].iov_base = ctypes.addressof(self._buffers[i])
+            self._iovecs[i].iov_len = RECV_BUFFER_SIZE
+            self._msgvec[i].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            self._msgvec[i].msg_hdr.msg_iovlen = 1
+            self._msgvec[i].msg_hdr.msg_name = ctypes.addressof(self._sockaddrs[i])
+
+    def recv(self, sock: socket) -> list[tuple[bytes, tuple[str, int]]]:
+        """
+        Receives at least one and at most batch_size datagrams. Blocks according to the timeout set on sock,
+        but returns as soon as one datagram is available
+        """
+        if not BATCHED_IO_AVAILABLE:
+            return [sock.recvfrom(RECV_BUFFER_SIZE)]
+
+        for i in range(self._batch_size):
+            self._msgvec[i].msg_hdr.msg_namelen = ctypes.sizeof(_SockaddrIn)
+
+        fd = sock.fileno()
+        count = _call_with_timeout(
+            sock,
+            False,
+            lambda flags: _libc.recvmmsg(
+                fd, self._msgvec, self._batch_size, flags | MSG_WAITFORONE, None
+            ),
+        )
+
+        return [
+            (
+                ctypes.string_at(self._buffers[i], self._msgvec[i].msg_len),
+                _from_sockaddr(self._sockaddrs[i]),
+            )
+            for i in range(count)
+        ]
+
+
+# NOTE: UDP generic segmentation/receive offload (Linux 4.18 and 5.0). With UDP_SEGMENT, a single buffer is split by
+#       the kernel (or the NIC) into packets of the given segment size, of which only the last may be shorter. With
+#       UDP_GRO, consecutive packets of the same flow are coalesced into a single buffer, received together with their
+#       segment size in a control message
+SOL_UDP = 17
+UDP_SEGMENT = 103
+UDP_GRO = 104
+UDP_MAX_SEGMENTS = 64
+UDP_MAX_PAYLOAD = 2**16 - 1 - 20 - 8
+# NOTE: Raised by sends that can not be segmented, e.g. when the outgoing device has no checksum offload
+_OFFLOAD_ERRNOS = (errno.EIO, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOPROTOOPT)
+
+
+def message_size(message) -> int:
+    """
+    Returns the size in bytes of a message (see sendmmsg)
+    """
+    if isinstance(message, list):
+        return sum(memoryview(buffer).nbytes for buffer in message)
+    return memoryview(message).nbytes
+
+
+def segment_groups(messages: list) -> list[tuple[int, list]]:
+    """
+    Splits messages (see sendmmsg) into runs that can each be sent as a single segmented buffer: messages of the
+    same size, optionally followed by one shorter message. Returns (segment size, messages) pairs
+    """
+    groups = []
+    segment_size = 0
+    total = 0
+    group = []
+    for message in messages:
+        size = message_size(message)
+        if (
+            len(group) == 0
+            or not 0 < size <= segment_size
+            or total % segment_size
+            != 0  # The group already ends with a shorter message
+            or len(group) == UDP_MAX_SEGMENTS
+            or total + size > UDP_MAX_PAYLOAD
+        ):
+            if len(group) > 0:
+                groups.append((segment_size, group))
+            segment_size, total, group = max(size, 1), 0, []
+        group.append(message)
+        total += size
+    if len(group) > 0:
+        groups.append((segment_size, group))
+    return groups
+
+
+def _buffers(messages: list) -> list:
+    buffers = []
+    for message in messages:
+        if isinstance(message, list):
+            buffers.extend(message)
+        else:
+            buffers.append(message)
+    return buffers
+
+
+class SegmentationOffload:
+    """
+    Sends runs of equal-sized messages to an address with a single UDP_SEGMENT sendmsg call each. enabled is False if
+    the kernel does not support it, and is cleared the first time the kernel rejects a segmented send
+    """
+
+    enabled: bool
+
+    def __init__(self, sock: socket):
+        self.enabled = False
+        if sys.platform != "linux" or not hasattr(sock, "sendmsg"):
+            return
+        try:
+            # NOTE: A socket wide segment size of 0 (the default) leaves unsegmented sends unchanged
+            sock.setsockopt(SOL_UDP, UDP_SEGMENT, 0)
+            self.enabled = True
+        except OSError:
+            pass
+
+    def send(
+        self, sock: socket, messages: list, address: tuple[str, int], fallback
+    ) -> int:
+        """
+        Sends every message in messages (see sendmmsg) to address, returns the total number of bytes sent. Messages
+        that are not segmented are sent with fallback(messages, address)
+        """
+        sent = 0
+        for segment_size, group in segment_groups(messages):
+            if self.enabled and len(group) > 1:
+                try:
+                    sent += sock.sendmsg(
+                        _buffers(group),
+                        [
+                            (
+                                SOL_UDP,
+                                UDP_SEGMENT,
+                                segment_size.to_bytes(2, sys.byteorder),
+                            )
+                        ],
+                        0,
+                        address,
+                    )
+                    continue
+                except OSError as e:
+                    if e.errno not in _OFFLOAD_ERRNOS:
+                        raise
+                    self.enabled = False
+            sent += fallback(group, address)
+        return sent
+
+
+class GroReceiver:
+    """
+    Receives with UDP_GRO enabled on a socket. Coalesced packets are received into a preallocated buffer with a
+    single call, and split into the original packets again
+    """
+
+    enabled: bool
+
+    def __init__(self, sock: socket):
+        self.enabled = False
+        self._buffer = bytearray(RECV_BUFFER_SIZE)
+        if sys.platform != "linux" or not hasattr(sock, "recvmsg_into"):
+            return
+        try:
+            sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+            self.enabled = True
+        except OSError:
+            pass
+
+    def recv(self, sock: socket) -> list[tuple[memoryview, tuple[str, int]]]:
+        """
+        Receives at least one packet, blocking according to the timeout set on sock. The packets are views into
+        the receive buffer, and only valid until the next call
+        """
+        size, ancdata, _, address = sock.recvmsg_into([self._buffer], CMSG_SPACE(4))
+        segment_size = size
+        for level, kind, data in ancdata:
+            if level == SOL_UDP and kind == UDP_GRO and len(data) >= 4:
+                segment_size = int.from_bytes(data[:4], sys.byteorder)
+
+        view = memoryview(self._buffer)[:size]
+        if segment_size <= 0 or segment_size >= size:
+            return [(view, address)]
+        return [
+            (view[offset : offset + segment_size], address)
+            for offset in range(0, size, segment_size)
+        ]
@@ -0,0 +1,175 @@
+from socket import *
+from typing import Optional
+import middleware.framing.framing as _framing
+import middleware.transfer.transfer as _transfer
+import middleware.scheduling.scheduling as _scheduling
+import threading
+import time
+
+# NOTE: "default" leaves Nagle's algorithm on and the socket uncorked (kernel defaults). "nodelay" sends every write
+#       right away (TCP_NODELAY). "cork" holds partial segments in the kernel (TCP_CORK) until flushed, or at most
+#       max_delay after the first write held. "buffered" collects writes in an application buffer, sent with a single
+#       syscall when it is full or flushed
+WRITE_MODES = ("default", "nodelay", "cork", "buffered")
+# NOTE: TCP_CORK is only exported by the socket module on Linux
+CORK_AVAILABLE = "TCP_CORK" in globals()
+
+
+class WriteCoalescer:
+    """
+    Applies a write mode (see WRITE_MODES) to a stream socket, all writes to the socket must go through it. Without
+    TCP_CORK (platforms other than Linux), the "cork" mode falls back to "buffered". With zero_copy, large buffers
+    written with sendall are sent with MSG_ZEROCOPY (see transfer.ZeroCopySender)
+    """
+
+    sock: socket
+    mode: str
+    max_delay: float
+    buffer_size: int
+    buffer: Optional[bytearray]  # Only used in "buffered" mode
+    pending: bool  # Data has been written and not flushed yet (only tracked for "cork" and "buffered")
+    deadline: Optional[
+        float
+    ]  # time.monotonic the cork is released, None if nothing is held
+    lock: threading.Lock
+    zero_copy: Optional[_transfer.ZeroCopySender]
+
+    def __init__(
+        self,
+        sock: socket,
+        mode: str,
+        max_delay: float,
+        buffer_size: int,
+        zero_copy: bool = False,
+    ):
+        if mode not in WRITE_MODES:
+            raise ValueError(
+                "Write mode must be one of {}".format(", ".join(WRITE_MODES))
+            )
+
+        if mode == "cork" and not CORK_AVAILABLE:
+            mode = "buffered"
+        self.sock = sock
+        self.mode = mode
+        self.max_delay = max_delay
+        self.buffer_size = buffer_size
+        self.buffer = bytearray() if mode == "buffered" else None
+        self.pending = False
+        self.deadline = None
+        self.lock = threading.Lock()
+        self.zero_copy = _transfer.ZeroCopySender(sock) if zero_copy else None
+
+        if mode == "nodelay":
+            sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        elif mode == "cork":
+            sock.setsockopt(IPPROTO_TCP, TCP_CORK, 1)
+
+    def send(self, data) -> int:
+        """
+        Writes data like socket.send, returns the number of bytes written. In "buffered" mode, all of data is buffered
+        """
+        if self.buffer != None:
+            self._buffer([data])
+            return memoryview(data).nbytes
+        sent = self.sock.send(data)
+        self._written()
+        return sent
+
+    def sendall(self, data) -> None:
+        """
+        Writes all of data like socket.sendall. In "buffered" mode, writes of at least buffer_size bytes are sent
+        directly after the buffer, instead of being copied into it
+        """
+        if self.buffer != None:
+            if memoryview(data).nbytes < self.buffer_size:
+                self._buffer([data])
+                return
+            self.flush()
+        if self.zero_copy != None:
+            self.zero_copy.sendall(data)
+        else:
+            self.sock.sendall(data)
+        self._written()
+
+    def sendfile(self, file, offset: int, count: Optional[int]) -> int:
+        """
+        Writes count bytes of file from offset (to the end of the file if count is None) like socket.sendfile, after
+        the buffered writes. Returns the number of bytes written
+        """
+        if self.buffer != None:
+            self.flush()
+        sent = self.sock.sendfile(file, offset, count)
+        self._written()
+        return sent
+
+    def send_buffers(self, buffers: list) -> None:
+        """
+        Writes every buffer in buffers in order, gathered by as few syscalls as possible (see framing.send_buffers)
+        """
+        if self.buffer != None:
+            self._buffer(buffers)
+            return
+        _framing.send_buffers(self.sock, buffers)
+        self._written()
+
+    def _buffer(self, buffers: list) -> None:
+        for buffer in buffers:
+            self.buffer += buffer
+        self.pending = len(self.buffer) > 0
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def _written(self) -> None:
+        """
+        Schedules the release of the cork after the first write held by it
+        """
+        if self.mode != "cork":
+            return
+        with self.lock:
+            self.pending = True
+            if self.deadline != None:
+                return
+            self.deadline = time.monotonic() + self.max_delay
+            deadline = self.deadline
+        _scheduling.deadline_scheduler.schedule(self, deadline)
+
+    def _expire(self, deadline: float) -> None:
+        with self.lock:
+            # NOTE: Flushed since, the deadline belongs to writes that are already sent
+            if self.deadline == deadline:
+                self._uncork()
+
+    def _uncork(self) -> None:
+        """
+        Sends the segments held by the cork, and corks the socket again for the next writes. Called with lock held
+        """
+        self.deadline = None
+        if self.pending:
+            self.pending = False
+            try:
+                self.sock.setsockopt(IPPROTO_TCP, TCP_CORK, 0)
+                self.sock.setsockopt(IPPROTO_TCP, TCP_CORK, 1)
+            except OSError:
+                pass  # NOTE: Closed in the meantime, nothing left to send
+
+    def flush(self) -> None:
+        """
+        Sends everything written so far right away. Does nothing in the "default" and "nodelay" modes
+        """
+        if self.buffer != None:
+            if len(self.buffer) > 0:
+                # NOTE: Swapped out first, so that the buffer is not sent twice if sendall raises
+                data = self.buffer
+                self.buffer = bytearray()
+                self.pending = False
+                self.sock.sendall(data)
+        elif self.mode == "cork":
+            with self.lock:
+                self._uncork()
+
+    def close(self) -> None:
+        """
+        Flushes the writes still held
+        """
+        if self.pending:
+            self.flush()
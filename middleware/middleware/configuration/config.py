@@ -36,6 +36,30 @@ class Config:
 
     mtu: int
     fragment_timeout: int
+    fec_data_fragments: int
+    fec_repair_fragments: int
+    nack_interval: float
+    reassembly_max_bytes: int
+    reassembly_max_peer_bytes: int
+    reassembly_max_peer_datagrams: int
+    reassembly_eviction_policy: str
+    compact_headers: bool
+    aggregation_hold_time: float
+    pacing_rate: int
+    pacing_burst: int
+    compression_codec: str
+    compression_threshold: int
+    write_mode: str
+    write_max_delay: float
+    write_buffer_size: int
+    max_message_size: int
+    pool_max_size: int
+    pool_max_idle: int
+    pool_idle_timeout: float
+    pmtu_discovery: bool
+    pmtu_expiry: float
+    stats_interval: float
+    stats_capacity: int
     congestion_algorithm: str
     echo_config_path: bool
 
@@ -0,0 +1,104 @@
+from typing import Optional
+import zlib
+
+try:
+    import lzma
+except ImportError:  # NOTE: Python can be built without liblzma
+    lzma = None
+
+# NOTE: Codec ids are sent in the compression extension of every fragment, an id must never be reused for another
+#       codec. Streams are raw (no container headers or checksums, fragments are already covered by the UDP
+#       checksum), which saves 6 bytes per datagram with zlib and around 60 with lzma
+CODEC_IDS = {"zlib": 1, "lzma": 2}
+CODEC_NONE = "none"
+# NOTE: The LZMA dictionary is limited, as the full dictionary of a preset (8 MiB for the default) is allocated for
+#       every datagram. The decoder must use the same dictionary size
+LZMA_DICT_SIZE = 2**16
+_LZMA_PRESET = 6
+_ZLIB_LEVEL = 6
+_DECOMPRESSION_ERRORS = (zlib.error,) if lzma == None else (zlib.error, lzma.LZMAError)
+
+
+def available_codecs() -> list[str]:
+    """
+    Returns the names of the codecs supported by this Python build
+    """
+    return [codec for codec in CODEC_IDS if codec != "lzma" or lzma != None]
+
+
+def _lzma_filters(preset: Optional[int]) -> list[dict]:
+    if preset == None:
+        return [{"id": lzma.FILTER_LZMA2, "dict_size": LZMA_DICT_SIZE}]
+    return [{"id": lzma.FILTER_LZMA2, "preset": preset, "dict_size": LZMA_DICT_SIZE}]
+
+
+class Compressor:
+    """
+    Compresses datagrams with a single codec, skipping the ones that are too small to be worth it
+    """
+
+    codec: str
+    codec_id: int
+    threshold: int
+
+    def __init__(self, codec: str, threshold: int = 0):
+        """
+        Datagrams shorter than threshold bytes are never compressed
+        """
+        if codec not in available_codecs():
+            raise ValueError(
+                "Compression codec must be one of {}".format(
+                    ", ".join(available_codecs())
+                )
+            )
+
+        self.codec = codec
+        self.codec_id = CODEC_IDS[codec]
+        self.threshold = threshold
+
+    def compress(self, data: memoryview, overhead: int = 0) -> Optional[bytes]:
+        """
+        Returns data compressed, or None if it is below the threshold or does not shrink by more than overhead bytes
+        (the cost of marking it compressed)
+        """
+        if len(data) < max(self.threshold, overhead + 1):
+            return None
+
+        if self.codec == "zlib":
+            compressor = zlib.compressobj(_ZLIB_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+            compressed = compressor.compress(data) + compressor.flush()
+        else:
+            compressed = lzma.compress(
+                data, format=lzma.FORMAT_RAW, filters=_lzma_filters(_LZMA_PRESET)
+            )
+
+        if len(compressed) + overhead >= len(data):
+            return None
+        return compressed
+
+
+def decompress(codec_id: int, data, max_size: int) -> Optional[bytes]:
+    """
+    Returns data decompressed, or None if the codec is unknown (or not supported by this Python build) or the stream is
+    corrupt or truncated. Raises ValueError if it decompresses to more than max_size bytes
+    """
+    try:
+        if codec_id == CODEC_IDS["zlib"]:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        elif codec_id == CODEC_IDS["lzma"] and lzma != None:
+            decompressor = lzma.LZMADecompressor(
+                format=lzma.FORMAT_RAW, filters=_lzma_filters(None)
+            )
+        else:
+            return None
+
+        # NOTE: Output is limited while decompressing, so a small datagram can not expand into a huge allocation
+        decompressed = decompressor.decompress(data, max_size + 1)
+    except _DECOMPRESSION_ERRORS:
+        return None
+
+    if len(decompressed) > max_size:
+        raise ValueError("Datagram decompresses to more than {} bytes".format(max_size))
+    if not decompressor.eof:
+        return None
+    return decompressed
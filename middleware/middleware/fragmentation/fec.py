@@ -0,0 +1,121 @@
+from functools import lru_cache
+
+# NOTE: Systematic Reed-Solomon erasure code over GF(2^8), built from a Cauchy matrix. The columns of the
+#       matrix are scaled so that the first repair row is all ones, which means a single repair fragment
+#       per block is plain XOR parity. Multiplying a whole fragment by a constant is done with bytes.translate
+#       and additions (XOR) are done on Python integers, so no per-byte Python loops are needed.
+# NOTE: Data + repair fragments per block, limited by the size of the field
+MAX_BLOCK_FRAGMENTS = 256
+
+_EXP = [0] * 512
+_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    _EXP[_i] = _x
+    _LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11D
+for _i in range(255, 512):
+    _EXP[_i] = _EXP[_i - 255]
+
+
+def _mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+def _inv(a: int) -> int:
+    return _EXP[255 - _LOG[a]]
+
+
+@lru_cache(maxsize=256)
+def _mul_table(c: int) -> bytes:
+    return bytes(_mul(c, x) for x in range(256))
+
+
+@lru_cache(maxsize=64)
+def _coefficients(data_count: int, repair_count: int) -> tuple[tuple[int, ...], ...]:
+    """
+    Returns the repair_count x data_count encoding matrix (any square submatrix is invertible)
+    """
+    cauchy = [
+        [_inv(row ^ (repair_count + col)) for col in range(data_count)]
+        for row in range(repair_count)
+    ]
+    return tuple(
+        tuple(_mul(cauchy[row][col], _inv(cauchy[0][col])) for col in range(data_count))
+        for row in range(repair_count)
+    )
+
+
+def _scale(c: int, data: bytes) -> int:
+    if c == 1:
+        return int.from_bytes(data, "little")
+    return int.from_bytes(data.translate(_mul_table(c)), "little")
+
+
+def _invert(matrix: list[list[int]]) -> list[list[int]]:
+    size = len(matrix)
+    aug = [row[:] + [int(i == j) for j in range(size)] for i, row in enumerate(matrix)]
+    for col in range(size):
+        pivot = next(row for row in range(col, size) if aug[row][col] != 0)
+        aug[col], aug[pivot] = aug[pivot], aug[col]
+        pivot_inv = _inv(aug[col][col])
+        aug[col] = [_mul(pivot_inv, x) for x in aug[col]]
+        for row in range(size):
+            if row != col and aug[row][col] != 0:
+                factor = aug[row][col]
+                aug[row] = [x ^ _mul(factor, y) for x, y in zip(aug[row], aug[col])]
+    return [row[size:] for row in aug]
+
+
+def encode(data: list[bytes], repair_count: int, length: int) -> list[bytes]:
+    """
+    Returns repair_count repair fragments of the given length for a block of data fragments.
+    Data fragments shorter than length are treated as if padded with zeros
+    """
+    coefficients = _coefficients(len(data), repair_count)
+    repairs = []
+    for row in range(repair_count):
+        acc = 0
+        for col, frag in enumerate(data):
+            acc ^= _scale(coefficients[row][col], frag)
+        repairs.append(acc.to_bytes(length, "little"))
+    return repairs
+
+
+def decode(
+    data_count: int,
+    repair_count: int,
+    data: dict[int, bytes],
+    repairs: dict[int, bytes],
+    length: int,
+) -> dict[int, bytes]:
+    """
+    Recovers the missing data fragments of a block from the received data fragments (by index in the block)
+    and repair fragments (by repair row). At least data_count fragments in total must have been received.
+    Recovered fragments are returned zero padded to length
+    """
+    missing = [i for i in range(data_count) if i not in data]
+    rows = list(repairs)[: len(missing)]
+    assert len(rows) == len(missing), "Not enough fragments to recover the block"
+
+    coefficients = _coefficients(data_count, repair_count)
+    syndromes = []
+    for row in rows:
+        acc = int.from_bytes(repairs[row], "little")
+        for col, frag in data.items():
+            acc ^= _scale(coefficients[row][col], frag)
+        syndromes.append(acc.to_bytes(length, "little"))
+
+    inverse = _invert([[coefficients[row][col] for col in missing] for row in rows])
+    recovered = {}
+    for i, col in enumerate(missing):
+        acc = 0
+        for j, syndrome in enumerate(syndromes):
+            if inverse[i][j] != 0:
+                acc ^= _scale(inverse[i][j], syndrome)
+        recovered[col] = acc.to_bytes(length, "little")
+    return recovered
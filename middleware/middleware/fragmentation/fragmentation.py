@@ -1,121 +1,1448 @@
 from __future__ import annotations
 from middleware.configuration.config import config
 from typing import Optional
-from collections import defaultdict
+from collections import OrderedDict, deque
+import middleware.fragmentation.fec as fec
+import middleware.fragmentation.compression as compression
+import struct
 import time
 import math
+import random
 
-DGRAM_ID_BITS = 28
+DGRAM_ID_BITS = 27
 FRAG_IDX_BITS = 11
+# NOTE: The top bit of the header marks an extension: a flags byte followed by the fields of each flag set.
+#       Plain data fragments never carry an extension, and are therefore understood by peers without support
+#       for any of the extensions
+EXT_BIT = 12 + DGRAM_ID_BITS
+EXT_FLAG_FEC = 0x01
 UDP_IP_HEADER_SIZE = 28
 MW_HEADER_SIZE = 5
 TOTAL_HEADER_SIZE = UDP_IP_HEADER_SIZE + MW_HEADER_SIZE
+# NOTE: Flags byte, data fragments per block, repair fragments per block, repair row, block index,
+#       fragment size and datagram size
+FEC_FIELDS = struct.Struct("<BBBBHHI")
+FEC_HEADER_SIZE = FEC_FIELDS.size
+EXT_FLAG_NACK = 0x02
+# NOTE: Flags byte, repair round, index of the first fragment in the bitmap and the index from which all fragments
+#       are missing (the FIN fragment has not arrived), followed by a bitmap of missing fragments
+NACK_FIELDS = struct.Struct("<BBHH")
+NACK_CACHE_SIZE = 2**22
+# NOTE: A bundle packs several small datagrams into one packet: the flags byte, followed by the length and payload of
+#       each datagram. Peers without support for bundles drop them like any unknown extension
+EXT_FLAG_BUNDLE = 0x04
+BUNDLE_LENGTH = struct.Struct("<H")
+EVICTION_POLICIES = ("oldest", "lru")
+# NOTE: Every fragment of a compressed datagram (data and repair fragments) carries the compression extension: the
+#       flags byte followed by the codec id. Repair fragments set both EXT_FLAG_FEC and EXT_FLAG_COMPRESSED, the codec
+#       id following the FEC fields. The datagram is reassembled from the compressed payload and decompressed once
+#       complete. Peers without support for compression drop these fragments like any unknown extension
+EXT_FLAG_COMPRESSED = 0x08
+COMPRESSION_FIELDS = struct.Struct("<BB")
+# NOTE: Compact header (opt-in, both peers must enable it): a flags byte followed by the datagram id and the fragment
+#       index as varints, each only when present. The top bit of the flags byte is the version bit, always set. The
+#       first byte of a legacy header is the low byte of the fragment index and can take any value, so the two
+#       formats can not be told apart: a socket using compact headers only understands compact headers, and drops
+#       fragments without the version bit. A single-fragment datagram without FEC carries neither id nor index, and
+#       has a 1-byte header. Datagram ids are limited to 14 bits, so that the
+#       compact header is never longer than the legacy header
+COMPACT_VERSION_BIT = 0x80
+COMPACT_EXT = 0x40
+COMPACT_FIN = 0x20
+COMPACT_IDX = 0x10
+COMPACT_ID = 0x08
+COMPACT_RESERVED = 0x07
+COMPACT_DGRAM_ID_BITS = 14
+# NOTE: Upper bound on the recently completed datagrams a Reassembler remembers (see Reassembler.completed_keys). It is
+#       below the number of compact datagram ids, so a remembered id is not reused by its peer before it is forgotten
+MAX_COMPLETED_KEYS = 2 ** (COMPACT_DGRAM_ID_BITS - 1)
+NO_DGRAM_ID = -1
 MTU_MIN = 64
-MAX_DGRAM_PAYLOAD = (MTU_MIN - TOTAL_HEADER_SIZE) * 2**FRAG_IDX_BITS
-MAX_FRAG_PAYLOAD = config.mtu - TOTAL_HEADER_SIZE
+MTU_MAX = 2**16 - 1
+
+
+def max_frag_payload(mtu: int) -> int:
+    """
+    Returns the payload carried by each fragment (except the last) when fragmenting for the given MTU
+    """
+    return mtu - TOTAL_HEADER_SIZE
+
+
+def max_dgram_payload(mtu: int) -> int:
+    """
+    Returns the largest datagram payload that can be fragmented for the given MTU,
+    limited by the number of fragment index bits
+    """
+    return max_frag_payload(mtu) * 2**FRAG_IDX_BITS
+
+
+# NOTE: Largest datagram a peer could send, the reassembly buffer of a partial datagram never grows past it
+MAX_DATAGRAM_SIZE = max_dgram_payload(MTU_MAX)
+
+
+def _pack_varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def pack_header(
+    dgram_id: int,
+    is_fin: bool,
+    frag_idx: int,
+    extension: bool = False,
+    compact: bool = False,
+) -> bytes:
+    """
+    Returns the header of a fragment, in the legacy 5-byte format or in the compact format. dgram_id can be
+    NO_DGRAM_ID for a compact single-fragment datagram
+    """
+    if not compact:
+        return (
+            (extension << EXT_BIT) | (dgram_id << 12) | (is_fin << 11) | frag_idx
+        ).to_bytes(length=5, byteorder="little", signed=False)
+
+    header = bytearray(1)
+    header[0] = COMPACT_VERSION_BIT
+    if extension:
+        header[0] |= COMPACT_EXT
+    if is_fin:
+        header[0] |= COMPACT_FIN
+    if dgram_id != NO_DGRAM_ID:
+        header[0] |= COMPACT_ID
+        _pack_varint(dgram_id, header)
+    if frag_idx != 0:
+        header[0] |= COMPACT_IDX
+        _pack_varint(frag_idx, header)
+    return bytes(header)
+
+
+def _unpack_varint(frag, pos: int) -> tuple[int, int]:
+    """
+    Returns a varint starting at pos and the position after it, or -1 as position if it is truncated or too long
+    """
+    value = 0
+    shift = 0
+    for i in range(pos, min(len(frag), pos + 3)):
+        value |= (frag[i] & 0x7F) << shift
+        if frag[i] & 0x80 == 0:
+            return value, i + 1
+        shift += 7
+    return 0, -1
+
+
+def unpack_header(
+    frag, compact: bool = False
+) -> Optional[tuple[int, bool, int, bool, int]]:
+    """
+    Returns the datagram id, FIN bit, fragment index, extension bit and header size of a fragment (or a prefix of it
+    holding at least the header), or None if it is malformed. With compact, only compact headers are understood
+    (see COMPACT_VERSION_BIT)
+    """
+    if compact:
+        if len(frag) == 0 or not frag[0] & COMPACT_VERSION_BIT:
+            return None  # Not a compact header
+        flags = frag[0]
+        if flags & COMPACT_RESERVED:
+            return None  # Unknown (newer) header version
+
+        dgram_id = NO_DGRAM_ID
+        frag_idx = 0
+        pos = 1
+        if flags & COMPACT_ID:
+            dgram_id, pos = _unpack_varint(frag, pos)
+        elif not flags & COMPACT_FIN or flags & (COMPACT_IDX | COMPACT_EXT):
+            return None  # Only single-fragment datagrams can omit the datagram id
+        if pos != -1 and flags & COMPACT_IDX:
+            frag_idx, pos = _unpack_varint(frag, pos)
+        if pos == -1 or frag_idx >= 2**FRAG_IDX_BITS:
+            return None
+        return (
+            dgram_id,
+            bool(flags & COMPACT_FIN),
+            frag_idx,
+            bool(flags & COMPACT_EXT),
+            pos,
+        )
+
+    if len(frag) < MW_HEADER_SIZE:
+        return None
+    header_bits = int.from_bytes(frag[:MW_HEADER_SIZE], byteorder="little")
+    return (
+        (header_bits >> 12) & ((1 << DGRAM_ID_BITS) - 1),
+        bool(header_bits & (1 << 11)),
+        header_bits & ((1 << FRAG_IDX_BITS) - 1),
+        bool(header_bits >> EXT_BIT),
+        MW_HEADER_SIZE,
+    )
 
 
 class Fragmenter:
     current_dgram_id: int
+    max_frag_payload: int
+    max_dgram_payload: int
+    payload_overhead: int  # Bytes of each fragment taken by extensions, on top of the legacy header
+    fec_data_fragments: int
+    fec_repair_fragments: int
+    compact_headers: bool
+    compressor: Optional[compression.Compressor]
 
-    def __init__(self):
-        self.current_dgram_id = 0
+    def __init__(
+        self,
+        mtu: int = config.mtu,
+        fec_data_fragments: int = 0,
+        fec_repair_fragments: int = 1,
+        compact_headers: bool = False,
+        compression_codec: str = compression.CODEC_NONE,
+        compression_threshold: int = 0,
+    ):
+        """
+        When fec_data_fragments > 0, forward error correction is enabled: the fragments of each datagram are
+        grouped in blocks of fec_data_fragments, and fec_repair_fragments repair fragments are sent after each
+        block. Any fec_repair_fragments lost fragments of a block can then be recovered by the receiver.
+        When compact_headers is set, fragments carry the compact header (see COMPACT_VERSION_BIT), which the
+        receiver must be configured for as well. Fragments are sized for the legacy header either way, for mtu unless
+        fragment is given another MTU (e.g. the path MTU of the destination).
+        When compression_codec is not "none", datagrams of at least compression_threshold bytes are compressed with
+        the codec (see compression.CODEC_IDS), unless that does not make them shorter. Receivers decompress them
+        without any configuration
+        """
+        if not MTU_MIN <= mtu <= MTU_MAX:
+            raise ValueError(
+                "MTU must be between {} and {} bytes".format(MTU_MIN, MTU_MAX)
+            )
+        if fec_data_fragments > 0 and not (
+            fec_repair_fragments >= 1
+            and fec_data_fragments + fec_repair_fragments <= fec.MAX_BLOCK_FRAGMENTS
+        ):
+            raise ValueError(
+                "FEC blocks must have at least one repair fragment, and at most {} fragments in total".format(
+                    fec.MAX_BLOCK_FRAGMENTS
+                )
+            )
+
+        # NOTE: Receivers drop fragments of the datagrams they completed recently, a random first datagram id keeps
+        #       a sender that restarted on the same address from reusing their ids
+        self.current_dgram_id = random.getrandbits(
+            COMPACT_DGRAM_ID_BITS if compact_headers else DGRAM_ID_BITS
+        )
+        self.compact_headers = compact_headers
+        self.compressor = None
+        if compression_codec != compression.CODEC_NONE:
+            self.compressor = compression.Compressor(
+                compression_codec, compression_threshold
+            )
+        self.fec_data_fragments = fec_data_fragments
+        self.fec_repair_fragments = fec_repair_fragments
+        self.payload_overhead = 0
+        if fec_data_fragments > 0:
+            # NOTE: Repair fragments carry the FEC fields in addition to a full fragment payload
+            self.payload_overhead += FEC_HEADER_SIZE
+        if self.compressor != None:
+            self.payload_overhead += COMPRESSION_FIELDS.size
+        self.max_frag_payload, self.max_dgram_payload = self.payload_limits(mtu)
 
-    def fragment(self, data: bytes) -> list[bytes]:
-        if len(data) > MAX_DGRAM_PAYLOAD:
+    def payload_limits(self, mtu: int) -> tuple[int, int]:
+        """
+        Returns the payload of each fragment and the largest datagram payload when fragmenting for mtu
+        """
+        if not MTU_MIN <= mtu <= MTU_MAX:
+            raise ValueError(
+                "MTU must be between {} and {} bytes".format(MTU_MIN, MTU_MAX)
+            )
+        frag_payload = max_frag_payload(mtu) - self.payload_overhead
+        return frag_payload, frag_payload * 2**FRAG_IDX_BITS
+
+    def _limits(self, mtu: Optional[int]) -> tuple[int, int]:
+        if mtu == None:
+            return self.max_frag_payload, self.max_dgram_payload
+        return self.payload_limits(mtu)
+
+    def _next_dgram_id(self, payload_size: int, max_dgram_payload: int) -> int:
+        if payload_size > max_dgram_payload:
             raise ValueError(
                 "Payload is too large to be sent with a MiddlewareUnreliable datagram"
             )
 
         dgram_id = self.current_dgram_id
-        self.current_dgram_id = (self.current_dgram_id + 1) % 2**DGRAM_ID_BITS
+        id_bits = COMPACT_DGRAM_ID_BITS if self.compact_headers else DGRAM_ID_BITS
+        self.current_dgram_id = (self.current_dgram_id + 1) % 2**id_bits
+        return dgram_id
+
+    def _single_fragment_header(
+        self, payload_size: int, frag_payload: int
+    ) -> Optional[bytes]:
+        """
+        Returns the header of a datagram that fits in a single fragment and needs no repair fragments, else None
+        """
+        if not 0 < payload_size <= frag_payload or self.fec_data_fragments:
+            return None
+        if self.compact_headers:
+            return bytes([COMPACT_VERSION_BIT | COMPACT_FIN])
+        return pack_header(self._next_dgram_id(payload_size, frag_payload), True, 0)
 
-        frag_count = int(math.ceil(len(data) / MAX_FRAG_PAYLOAD))
+    def _compress(
+        self, data: memoryview, max_dgram_payload: int
+    ) -> tuple[memoryview, bytes]:
+        """
+        Returns the payload to fragment and the compression extension to add to its fragments, which is empty
+        if data is sent uncompressed
+        """
+        if self.compressor == None or len(data) > max_dgram_payload:
+            return data, b""
+
+        # NOTE: With compact headers, a compressed single-fragment datagram also needs a datagram id
+        overhead = COMPRESSION_FIELDS.size + (2 if self.compact_headers else 0)
+        compressed = self.compressor.compress(data, overhead)
+        if compressed == None:
+            return data, b""
+        return memoryview(compressed), COMPRESSION_FIELDS.pack(
+            EXT_FLAG_COMPRESSED, self.compressor.codec_id
+        )
+
+    def fragment(self, data, mtu: Optional[int] = None) -> list[bytes]:
+        """
+        Splits data (any object supporting the buffer protocol) into fragments, each a separate
+        bytearray containing a header and a copy of its part of the payload. Fragments are sized for mtu if given,
+        else for the MTU of the Fragmenter
+        """
+        frag_payload, max_dgram_payload = self._limits(mtu)
+        data, extension = self._compress(memoryview(data).cast("B"), max_dgram_payload)
+        # NOTE: Fast path for the common single-fragment datagram
+        header = (
+            None if extension else self._single_fragment_header(len(data), frag_payload)
+        )
+        if header != None:
+            fragment = bytearray(header)
+            fragment += data
+            return [fragment]
+
+        dgram_id = self._next_dgram_id(len(data), max_dgram_payload)
+        frag_count = int(math.ceil(len(data) / frag_payload))
 
         fragments = []
         for frag_idx in range(frag_count):
-            is_fin = int(frag_idx == frag_count - 1)
-
-            header_bits = (dgram_id << 12) | (is_fin << 11) | frag_idx
-            header = header_bits.to_bytes(length=5, byteorder="little", signed=False)
+            is_fin = frag_idx == frag_count - 1
+            header = pack_header(
+                dgram_id,
+                is_fin,
+                frag_idx,
+                extension=bool(extension),
+                compact=self.compact_headers,
+            )
 
             fragment = bytearray()
             fragment.extend(header)
+            fragment.extend(extension)
             fragment.extend(
-                data[frag_idx * MAX_FRAG_PAYLOAD : (frag_idx + 1) * MAX_FRAG_PAYLOAD]
+                data[frag_idx * frag_payload : (frag_idx + 1) * frag_payload]
             )
 
             fragments.append(fragment)
 
+        for header, repair in self._repair_fragments(
+            dgram_id, data, frag_payload, extension
+        ):
+            fragment = bytearray()
+            fragment.extend(header)
+            fragment.extend(repair)
+            fragments.append(fragment)
+
         return fragments
 
+    def fragment_iovecs(self, data, mtu: Optional[int] = None) -> list[list]:
+        """
+        Zero-copy variant of fragment. Each fragment is returned as a [header, payload] iovec pair, where
+        payload is a memoryview slice of data. Meant to be sent with socket.sendmsg (or sendmmsg), which
+        gathers the pair into a single datagram without the payload ever being copied in user space
+        """
+        frag_payload, max_dgram_payload = self._limits(mtu)
+        data, extension = self._compress(memoryview(data).cast("B"), max_dgram_payload)
+        header = (
+            None if extension else self._single_fragment_header(len(data), frag_payload)
+        )
+        if header != None:
+            return [[header, data]]
+
+        dgram_id = self._next_dgram_id(len(data), max_dgram_payload)
+        frag_count = int(math.ceil(len(data) / frag_payload))
+        fin_idx = frag_count - 1
+
+        iovecs = [
+            [
+                pack_header(
+                    dgram_id,
+                    frag_idx == fin_idx,
+                    frag_idx,
+                    extension=bool(extension),
+                    compact=self.compact_headers,
+                )
+                + extension,
+                data[frag_idx * frag_payload : (frag_idx + 1) * frag_payload],
+            ]
+            for frag_idx in range(frag_count)
+        ]
+        iovecs.extend(
+            [header, repair]
+            for header, repair in self._repair_fragments(
+                dgram_id, data, frag_payload, extension
+            )
+        )
+        return iovecs
+
+    def _repair_fragments(
+        self,
+        dgram_id: int,
+        data: memoryview,
+        frag_payload: int,
+        extension: bytes = b"",
+    ) -> list[tuple[bytes, bytes]]:
+        """
+        Returns the header and payload of every FEC repair fragment of a datagram (none if FEC is disabled).
+        Each repair fragment is as long as the longest data fragment of its block. The compression extension of the
+        data fragments, if any, is carried by the repair fragments as well
+        """
+        if self.fec_data_fragments == 0 or len(data) == 0:
+            return []
+
+        block_payload = frag_payload * self.fec_data_fragments
+        header = pack_header(
+            dgram_id, False, 0, extension=True, compact=self.compact_headers
+        )
+        flags = EXT_FLAG_FEC
+        if extension:
+            flags |= EXT_FLAG_COMPRESSED
+
+        repairs = []
+        for block in range(int(math.ceil(len(data) / block_payload))):
+            block_data = data[block * block_payload : (block + 1) * block_payload]
+            frags = [
+                bytes(block_data[i : i + frag_payload])
+                for i in range(0, len(block_data), frag_payload)
+            ]
+            for row, repair in enumerate(
+                fec.encode(frags, self.fec_repair_fragments, len(frags[0]))
+            ):
+                fields = FEC_FIELDS.pack(
+                    flags,
+                    self.fec_data_fragments,
+                    self.fec_repair_fragments,
+                    row,
+                    block,
+                    frag_payload,
+                    len(data),
+                )
+                repairs.append((header + fields + extension[1:], repair))
+        return repairs
+
+
+class RetransmitCache:
+    """
+    Data fragments of recently sent datagrams, kept so that fragments reported lost by a NACK can be sent again.
+    Holds at most max_bytes of fragments (the oldest datagrams are evicted first), and every datagram is
+    repaired at most max_rounds times
+    """
+
+    class CacheEntry:
+        __slots__ = ("fragments", "size", "rounds")
+
+        fragments: list[bytes]
+        size: int
+        rounds: int
+
+        def __init__(self, fragments: list[bytes]):
+            self.fragments = fragments
+            self.size = sum(len(frag) for frag in fragments)
+            self.rounds = 0
+
+    datagrams: OrderedDict[int, CacheEntry]
+    max_bytes: int
+    max_rounds: int
+    compact_headers: bool
+    size: int
+
+    def __init__(
+        self,
+        max_bytes: int = NACK_CACHE_SIZE,
+        max_rounds: int = 1,
+        compact_headers: bool = False,
+    ):
+        self.datagrams = OrderedDict()
+        self.max_bytes = max_bytes
+        self.max_rounds = max_rounds
+        self.compact_headers = compact_headers
+        self.size = 0
+
+    def add(self, fragments: list) -> None:
+        """
+        Caches the data fragments of a sent datagram, as returned by Fragmenter.fragment or Fragmenter.fragment_iovecs.
+        Iovec fragments are copied, as they refer to the caller's buffer
+        """
+        data_fragments = []
+        dgram_id = NO_DGRAM_ID
+        for frag in fragments:
+            if isinstance(frag, list):
+                frag = b"".join(frag)
+            dgram_id, _, _, extension, header_size = unpack_header(
+                frag, self.compact_headers
+            )
+            # NOTE: Repair fragments are skipped, the data fragments of compressed datagrams carry an extension too
+            if extension and frag[header_size] != EXT_FLAG_COMPRESSED:
+                continue
+            data_fragments.append(frag)
+        # NOTE: A compact single-fragment datagram without id can not be requested by a NACK
+        if len(data_fragments) == 0 or dgram_id == NO_DGRAM_ID:
+            return
+
+        entry = self.CacheEntry(data_fragments)
+        if entry.size > self.max_bytes:
+            return
+
+        self._remove(dgram_id)
+        while self.size + entry.size > self.max_bytes:
+            self._remove(next(iter(self.datagrams)))
+        self.datagrams[dgram_id] = entry
+        self.size += entry.size
+
+    def _remove(self, dgram_id: int) -> None:
+        entry = self.datagrams.pop(dgram_id, None)
+        if entry != None:
+            self.size -= entry.size
+
+    def repair(self, dgram_id: int, missing: list[int], tail: int) -> list[bytes]:
+        """
+        Returns the cached fragments requested by a NACK: every index in missing, and every index from tail onwards.
+        Nothing is returned if the datagram is no longer cached, or has already been repaired max_rounds times
+        """
+        entry = self.datagrams.get(dgram_id)
+        if entry == None or entry.rounds >= self.max_rounds:
+            return []
+
+        entry.rounds += 1
+        fragments = entry.fragments
+        return [fragments[i] for i in missing if i < len(fragments)] + fragments[tail:]
+
+
+def nack_fragment(
+    dgram_id: int,
+    repair_round: int,
+    missing: list[int],
+    tail: int,
+    compact: bool = False,
+) -> bytes:
+    """
+    Returns a NACK requesting the fragments in missing (sorted) and every fragment from tail onwards of a datagram
+    """
+    header = pack_header(dgram_id, False, 0, extension=True, compact=compact)
+    first = missing[0] if len(missing) > 0 else tail
+    bitmap = bytearray(int(math.ceil((missing[-1] - first + 1) / 8)) if missing else 0)
+    for frag_idx in missing:
+        bitmap[(frag_idx - first) // 8] |= 1 << ((frag_idx - first) % 8)
+    return (
+        header
+        + NACK_FIELDS.pack(EXT_FLAG_NACK, min(repair_round, 255), first, tail)
+        + bitmap
+    )
+
+
+def parse_nack(extension) -> tuple[list[int], int]:
+    """
+    Returns the missing fragment indices and the tail index (see nack_fragment) of a NACK extension
+    """
+    _, _, first, tail = NACK_FIELDS.unpack_from(extension)
+    bitmap = extension[NACK_FIELDS.size :]
+    missing = [
+        first + i * 8 + bit
+        for i, byte in enumerate(bitmap)
+        if byte != 0
+        for bit in range(8)
+        if byte & (1 << bit)
+    ]
+    return missing, tail
+
+
+def bundle_fragment(messages: list[bytes], compact: bool = False) -> bytes:
+    """
+    Returns a bundle carrying every datagram in messages
+    """
+    bundle = bytearray(pack_header(0, False, 0, extension=True, compact=compact))
+    bundle.append(EXT_FLAG_BUNDLE)
+    for message in messages:
+        bundle += BUNDLE_LENGTH.pack(len(message))
+        bundle += message
+    return bytes(bundle)
+
+
+def parse_bundle(extension) -> list[bytes]:
+    """
+    Returns the datagrams carried by a bundle extension, a truncated datagram and everything after it is dropped
+    """
+    messages = []
+    pos = 1
+    while pos + BUNDLE_LENGTH.size <= len(extension):
+        (length,) = BUNDLE_LENGTH.unpack_from(extension, pos)
+        pos += BUNDLE_LENGTH.size
+        if pos + length > len(extension):
+            break
+        messages.append(bytes(extension[pos : pos + length]))
+        pos += length
+    return messages
+
+
+class Aggregator:
+    """
+    Small datagrams held back per destination, to be sent together in a single bundle. A bundle is sent once it is
+    full, once the first datagram in it has been held for hold_time (see due), or when flushed
+    """
+
+    class PendingBundle:
+        __slots__ = ("messages", "size", "deadline")
+
+        messages: list[bytes]
+        size: int  # Bundle payload size, the lengths included
+        deadline: float
+
+        def __init__(self, deadline: float):
+            self.messages = []
+            self.size = 0
+            self.deadline = deadline
+
+    # NOTE: Bundles are created with a deadline hold_time ahead, so the insertion order is also the deadline order
+    pending: OrderedDict[tuple[str, int], PendingBundle]
+    hold_time: float
+    capacity: int
+    compact_headers: bool
+
+    def __init__(
+        self,
+        mtu: int = config.mtu,
+        hold_time: float = config.aggregation_hold_time,
+        compact_headers: bool = False,
+    ):
+        self.pending = OrderedDict()
+        self.hold_time = hold_time
+        self.compact_headers = compact_headers
+        header_size = len(
+            pack_header(0, False, 0, extension=True, compact=compact_headers)
+        )
+        self.capacity = mtu - UDP_IP_HEADER_SIZE - header_size - 1
+
+    def can_hold(self, size: int) -> bool:
+        """
+        Returns True if a datagram of size bytes is small enough to be bundled
+        """
+        return 0 < size <= self.capacity - BUNDLE_LENGTH.size
+
+    def add(
+        self, data, address: tuple[str, int]
+    ) -> list[tuple[list[bytes], tuple[str, int]]]:
+        """
+        Holds a copy of data (see can_hold) for address. Returns the datagrams to send right away, as (datagrams,
+        address) pairs: the previous bundle for address if data did not fit in it, and the new one if it is full
+        """
+        size = BUNDLE_LENGTH.size + len(data)
+        bundles = []
+        bundle = self.pending.get(address)
+        if bundle != None and bundle.size + size > self.capacity:
+            bundles.append((self.pending.pop(address).messages, address))
+            bundle = None
+        if bundle == None:
+            bundle = self.PendingBundle(time.perf_counter() + self.hold_time)
+            self.pending[address] = bundle
+
+        bundle.messages.append(bytes(data))
+        bundle.size += size
+        if bundle.size + BUNDLE_LENGTH.size >= self.capacity:
+            bundles.append((self.pending.pop(address).messages, address))
+        return bundles
+
+    def due(self) -> list[tuple[list[bytes], tuple[str, int]]]:
+        """
+        Returns the bundles held for hold_time (see add), which are no longer held
+        """
+        now = time.perf_counter()
+        bundles = []
+        while len(self.pending) > 0:
+            address, bundle = next(iter(self.pending.items()))
+            if bundle.deadline > now:
+                break
+            del self.pending[address]
+            bundles.append((bundle.messages, address))
+        return bundles
+
+    def flush(
+        self, address: Optional[tuple[str, int]] = None
+    ) -> list[tuple[list[bytes], tuple[str, int]]]:
+        """
+        Returns the bundle held for address, or every bundle if address is None, which are no longer held
+        """
+        if address != None:
+            bundle = self.pending.pop(address, None)
+            return [] if bundle == None else [(bundle.messages, address)]
+
+        bundles = [
+            (bundle.messages, address) for address, bundle in self.pending.items()
+        ]
+        self.pending.clear()
+        return bundles
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        Returns the time (time.perf_counter) the next bundle is due, None if no datagrams are held
+        """
+        if len(self.pending) == 0:
+            return None
+        return next(iter(self.pending.values())).deadline
+
+
+def has_extension(header) -> bool:
+    """
+    Returns True if the fragment header is followed by an extension
+    """
+    return bool(header[MW_HEADER_SIZE - 1] & (1 << (EXT_BIT % 8)))
+
+
+def parse_header(header) -> tuple[int, bool, int]:
+    """
+    Returns the datagram id, FIN bit and fragment index of a fragment header
+    """
+    header_bits = int.from_bytes(header, byteorder="little", signed=False)
+    dgram_id = (header_bits >> 12) & ((1 << DGRAM_ID_BITS) - 1)
+    is_fin = bool(header_bits & (1 << 11))
+    frag_idx = header_bits & ((1 << FRAG_IDX_BITS) - 1)
+    return dgram_id, is_fin, frag_idx
+
+
+class EvictionCounters:
+    """
+    Number of partial datagrams evicted by a Reassembler for each of its memory limits, and the number of
+    buffered bytes discarded with them
+    """
+
+    __slots__ = ("total_bytes", "peer_bytes", "peer_datagrams", "bytes")
+
+    total_bytes: int  # Evicted because all buffered datagrams exceeded max_bytes
+    peer_bytes: int  # Evicted because the datagrams of the peer exceeded max_peer_bytes
+    peer_datagrams: int  # Evicted because the peer exceeded max_peer_datagrams
+    bytes: int
+
+    def __init__(self):
+        self.total_bytes = 0
+        self.peer_bytes = 0
+        self.peer_datagrams = 0
+        self.bytes = 0
+
 
 class Reassembler:
-    datagrams: defaultdict[tuple[str, int], DatagramStoreEntry]
+    # NOTE: Entries are kept ordered by the arrival time of their last fragment (entries are moved to the end
+    #       when touched), which means the datagrams to time out are always found at the front
+    datagrams: OrderedDict[tuple[tuple[str, int], int], DatagramStoreEntry]
+    completed: deque[tuple[bytearray, tuple[str, int]]]
+    # NOTE: Recently completed datagrams, by completion time. FEC repair fragments and late or duplicated data
+    #       fragments that arrive for these after completion are dropped instead of starting a new entry, which would
+    #       be NACKed and deliver the datagram a second time. Single-fragment datagrams are delivered as they arrive.
+    #       At most max_completed_keys are kept, the oldest are forgotten first
+    completed_keys: OrderedDict[tuple[tuple[str, int], int], float]
+    max_completed_keys: int
+    nack_rounds: int
+    nack_interval: float
+    # NOTE: When NACKs are enabled, the time each partial datagram is due a NACK. Every arriving fragment pushes
+    #       the due time of its datagram nack_interval ahead, so the schedule is ordered by due time as well
+    nack_schedule: OrderedDict[tuple[tuple[str, int], int], float]
+    # NOTE: NACKs received from peers for datagrams sent by this socket: peer, datagram id, missing fragments and tail
+    nack_requests: deque[tuple[tuple[str, int], int, list[int], int]]
+    max_bytes: int
+    max_peer_bytes: int
+    max_peer_datagrams: int
+    # NOTE: Largest reassembly buffer of a partial datagram: the largest possible datagram, or the byte limits if
+    #       lower (see _admit). Compressed datagrams never decompress to more either
+    max_buffer_size: int
+    eviction_policy: str
+    compact_headers: bool
+    size: int  # Bytes buffered by all partial datagrams
+    peers: dict[tuple[str, int], PeerUsage]
+    # NOTE: Partial datagrams by creation time, only kept for the "oldest" eviction policy. For "lru", datagrams
+    #       is already ordered by last use
+    creation_order: OrderedDict[tuple[tuple[str, int], int], None]
+    evictions: EvictionCounters
+
+    class PeerUsage:
+        """
+        Partial datagrams of a single peer, ordered by eviction policy (creation or last use), and their size
+        """
+
+        __slots__ = ("datagrams", "size")
+
+        datagrams: OrderedDict[tuple[tuple[str, int], int], None]
+        size: int
+
+        def __init__(self):
+            self.datagrams = OrderedDict()
+            self.size = 0
 
     class DatagramStoreEntry:
+        """
+        Payloads are written directly to their final position in a single reassembly buffer. All fragments
+        except the last have the same payload size, so a fragment's offset is frag_idx * frag_size.
+        Thousands of these can be in flight, so the entry has no __dict__, received fragments are kept in
+        a bitmap and the FEC state is only allocated when a repair fragment arrives
+        """
+
+        __slots__ = (
+            "timestamp",
+            "is_fin",
+            "expected_frag_count",
+            "received_frag_count",
+            "received",
+            "frag_size",
+            "fin_payload_size",
+            "deferred_fin",
+            "buffer",
+            "fec_data_fragments",
+            "fec_repair_fragments",
+            "repairs",
+            "repair_size",
+            "nack_rounds",
+            "codec_id",
+            "size",
+        )
+
         timestamp: float
         is_fin: bool
         expected_frag_count: int
-        frag_store: dict[int, bytes]
+        received_frag_count: int
+        received: int  # Bitmap, bit frag_idx is set when the fragment has arrived (or was recovered)
+        frag_size: int  # Payload size of non-FIN fragments, -1 until known
+        fin_payload_size: int
+        # NOTE: FIN payload that arrived before frag_size was known
+        deferred_fin: Optional[bytes]
+        buffer: bytearray
+        fec_data_fragments: int  # 0 until a repair fragment has arrived
+        fec_repair_fragments: int
+        repairs: Optional[
+            dict[int, dict[int, bytes]]
+        ]  # Repair payloads by block and row
+        repair_size: int
+        nack_rounds: int
+        codec_id: int  # Compression codec of the datagram, 0 if uncompressed
+        size: int  # Memory size last accounted for by the reassembler
 
         def __init__(self):
             self.timestamp = time.perf_counter()
             self.is_fin = False
             self.expected_frag_count = -1
-            self.frag_store = {}
+            self.received_frag_count = 0
+            self.received = 0
+            self.frag_size = -1
+            self.fin_payload_size = -1
+            self.deferred_fin = None
+            self.buffer = bytearray()
+            self.fec_data_fragments = 0
+            self.fec_repair_fragments = 0
+            self.repairs = None
+            self.repair_size = 0
+            self.nack_rounds = 0
+            self.codec_id = 0
+            self.size = 0
 
-    def __init__(self):
-        self.datagrams: defaultdict[
-            tuple[str, int], self.DatagramStoreEntry
-        ] = defaultdict(self.DatagramStoreEntry)
+        def fragment_offset(
+            self, is_fin: bool, frag_idx: int, payload_size: int
+        ) -> int:
+            """
+            Returns the offset of a fragment's payload in the reassembly buffer, or -1 if it cannot be placed
+            (FIN fragment arriving before frag_size is known, or a non-FIN fragment with the wrong size)
+            """
+            if not is_fin:
+                if self.frag_size not in (-1, payload_size):
+                    return -1
+                return frag_idx * payload_size
+            elif frag_idx == 0:
+                return 0
+            elif self.frag_size == -1:
+                return -1
+            return frag_idx * self.frag_size
+
+        def extent(self, is_fin: bool, offset: int, payload_size: int) -> int:
+            """
+            Returns the size the reassembly buffer needs once a fragment is placed at offset: the end of its
+            payload, or the datagram size if placing the fragment makes it known
+            """
+            size = offset + payload_size
+            if self.is_fin and not is_fin:
+                size = max(
+                    size,
+                    (self.expected_frag_count - 1) * payload_size
+                    + self.fin_payload_size,
+                )
+            return size
+
+        def reserve(self, size: int, limit: int = MAX_DATAGRAM_SIZE) -> None:
+            """
+            Grows the reassembly buffer to hold at least size bytes. The exact datagram size is allocated once
+            the FIN fragment is known, until then the buffer grows geometrically (but not past limit) to avoid
+            repeated copying
+            """
+            if len(self.buffer) >= size:
+                return
+            if self.is_fin and self.frag_size != -1:
+                target = max(size, self.datagram_size())
+            else:
+                target = max(size, min(2 * len(self.buffer), limit))
+            # NOTE: Copied into a new zeroed buffer, extending would first build a temporary of the added size
+            buffer = bytearray(target)
+            buffer[: len(self.buffer)] = self.buffer
+            self.buffer = buffer
+
+        def datagram_size(self) -> int:
+            return (self.expected_frag_count - 1) * max(
+                self.frag_size, 0
+            ) + self.fin_payload_size
+
+        def payload_size(self, frag_idx: int) -> int:
+            if frag_idx == self.expected_frag_count - 1:
+                return self.fin_payload_size
+            return self.frag_size
+
+        def has_fragment(self, frag_idx: int) -> bool:
+            return (self.received >> frag_idx) & 1 == 1
+
+        def mark_received(self, frag_idx: int) -> None:
+            self.received |= 1 << frag_idx
+            self.received_frag_count += 1
+
+        def missing_fragments(self) -> tuple[list[int], int]:
+            """
+            Returns the indices of the fragments known to be missing, and the index from which all fragments must be
+            requested. Until the FIN fragment has arrived, that is everything after the highest received fragment
+            """
+            if self.is_fin:
+                tail = self.expected_frag_count
+            else:
+                tail = self.received.bit_length()
+            return [i for i in range(tail) if not self.has_fragment(i)], tail
+
+        def memory_size(self) -> int:
+            deferred_size = 0 if self.deferred_fin == None else len(self.deferred_fin)
+            return len(self.buffer) + deferred_size + self.repair_size
+
+        def place_deferred_fin(self) -> None:
+            if self.deferred_fin != None and self.frag_size != -1:
+                offset = (self.expected_frag_count - 1) * self.frag_size
+                self.reserve(offset + self.fin_payload_size)
+                self.buffer[offset : offset + self.fin_payload_size] = self.deferred_fin
+                self.deferred_fin = None
+
+    def __init__(
+        self,
+        nack_rounds: int = 0,
+        nack_interval: float = config.nack_interval,
+        max_bytes: int = config.reassembly_max_bytes,
+        max_peer_bytes: int = config.reassembly_max_peer_bytes,
+        max_peer_datagrams: int = config.reassembly_max_peer_datagrams,
+        eviction_policy: str = config.reassembly_eviction_policy,
+        compact_headers: bool = False,
+    ):
+        """
+        When compact_headers is set, only fragments with compact headers are understood (see COMPACT_VERSION_BIT), and NACKs are sent with compact headers.
+        When nack_rounds > 0, lost fragments are requested from the sender with up to nack_rounds NACKs per datagram
+        (see nacks_due), and NACKs received from peers are queued in nack_requests.
+        Partial datagrams are evicted, oldest-first or least recently used first (eviction_policy "oldest" or "lru"),
+        to keep the memory buffered in total below max_bytes, the memory buffered per peer below max_peer_bytes and
+        the number of partial datagrams per peer below max_peer_datagrams. A limit of 0 disables it
+        """
+        if eviction_policy not in EVICTION_POLICIES:
+            raise ValueError(
+                "Eviction policy must be one of {}".format(", ".join(EVICTION_POLICIES))
+            )
+
+        self.datagrams = OrderedDict()
+        self.completed = deque()
+        self.completed_keys = OrderedDict()
+        # NOTE: Bounded like the partial datagrams, so that a burst of small datagrams can not grow it until they time out
+        self.max_completed_keys = MAX_COMPLETED_KEYS
+        if max_peer_datagrams > 0:
+            self.max_completed_keys = min(max_peer_datagrams, MAX_COMPLETED_KEYS)
+        self.nack_rounds = nack_rounds
+        self.nack_interval = nack_interval
+        self.nack_schedule = OrderedDict()
+        self.nack_requests = deque()
+        self.max_bytes = max_bytes
+        self.max_peer_bytes = max_peer_bytes
+        self.max_peer_datagrams = max_peer_datagrams
+        self.max_buffer_size = min(
+            [MAX_DATAGRAM_SIZE]
+            + [limit for limit in (max_bytes, max_peer_bytes) if limit > 0]
+        )
+        self.eviction_policy = eviction_policy
+        self.compact_headers = compact_headers
+        self.size = 0
+        self.peers = {}
+        self.creation_order = OrderedDict()
+        self.evictions = EvictionCounters()
 
     def timeout_old_datagrams(self) -> None:
         """
-        Goes through all received partial/complete datagrams and times out old ones based on
-        the arrival of their last fragment
+        Times out old partial datagrams based on the arrival of their last fragment. Only the datagrams
+        that are due are visited, so this is O(1) when nothing has timed out
         """
-        for key in list(self.datagrams.keys()):
-            if (
-                time.perf_counter() - self.datagrams[key].timestamp
-            ) >= config.fragment_timeout:
-                del self.datagrams[key]
+        deadline = time.perf_counter() - config.fragment_timeout
+        while len(self.datagrams) > 0:
+            key = next(iter(self.datagrams))
+            if self.datagrams[key].timestamp > deadline:
+                break
+            self._remove_entry(key)
+
+        while len(self.completed_keys) > 0:
+            key = next(iter(self.completed_keys))
+            if self.completed_keys[key] > deadline:
+                break
+            del self.completed_keys[key]
+
+    def _remember_completed(self, key: tuple[tuple[str, int], int]) -> None:
+        self.completed_keys[key] = time.perf_counter()
+        self.completed_keys.move_to_end(key)
+        if len(self.completed_keys) > self.max_completed_keys:
+            self.completed_keys.popitem(last=False)
+
+    def _touch_entry(self, key: tuple[tuple[str, int], int]) -> DatagramStoreEntry:
+        entry = self.datagrams.get(key)
+        if entry == None:
+            entry = self.DatagramStoreEntry()
+            self.datagrams[key] = entry
+            self.peers.setdefault(key[0], self.PeerUsage()).datagrams[key] = None
+            if self.eviction_policy == "oldest":
+                self.creation_order[key] = None
+        else:
+            entry.timestamp = time.perf_counter()
+            self.datagrams.move_to_end(key)
+            if self.eviction_policy == "lru":
+                self.peers[key[0]].datagrams.move_to_end(key)
 
-    def add_fragment_to_datagram(self, frag: bytes, addr: tuple[str, int]) -> None:
+        if self.nack_rounds > 0:
+            self.nack_schedule[key] = entry.timestamp + self.nack_interval
+            self.nack_schedule.move_to_end(key)
+        return entry
+
+    def _remove_entry(self, key: tuple[tuple[str, int], int]) -> DatagramStoreEntry:
         """
-        Appends a fragment to a partial/complete datagram
+        Removes a partial datagram from the store and from the bookkeeping of its memory use
         """
-        header = frag[:MW_HEADER_SIZE]
-        payload = frag[MW_HEADER_SIZE:]
+        entry = self.datagrams.pop(key)
+        self.nack_schedule.pop(key, None)
+        self.creation_order.pop(key, None)
 
-        header_bits = int.from_bytes(header, byteorder="little", signed=False)
-        dgram_id = (header_bits >> 12) & ((1 << DGRAM_ID_BITS) - 1)
-        is_fin = bool(header_bits & (1 << 11))
-        frag_idx = header_bits & ((1 << FRAG_IDX_BITS) - 1)
+        peer = self.peers[key[0]]
+        del peer.datagrams[key]
+        peer.size -= entry.size
+        self.size -= entry.size
+        if len(peer.datagrams) == 0:
+            del self.peers[key[0]]
+        return entry
 
-        self.datagrams[addr, dgram_id].timestamp = time.perf_counter()
-        self.datagrams[addr, dgram_id].frag_store[frag_idx] = payload
+    def _evict(self, key: tuple[tuple[str, int], int]) -> None:
+        entry = self._remove_entry(key)
+        self.evictions.bytes += entry.size
+
+    def _enforce_limits(
+        self, key: tuple[tuple[str, int], int], entry: DatagramStoreEntry
+    ) -> None:
+        """
+        Accounts for the memory used by a partial datagram after a fragment was added to it, and evicts partial
+        datagrams (possibly this one) until the memory limits are met again
+        """
+        size = entry.memory_size()
+        peer = self.peers[key[0]]
+        peer.size += size - entry.size
+        self.size += size - entry.size
+        entry.size = size
+
+        while 0 < self.max_peer_datagrams < len(peer.datagrams):
+            self._evict(next(iter(peer.datagrams)))
+            self.evictions.peer_datagrams += 1
+        while 0 < self.max_peer_bytes < peer.size:
+            self._evict(next(iter(peer.datagrams)))
+            self.evictions.peer_bytes += 1
+        while 0 < self.max_bytes < self.size:
+            if self.eviction_policy == "oldest":
+                self._evict(next(iter(self.creation_order)))
+            else:
+                self._evict(next(iter(self.datagrams)))
+            self.evictions.total_bytes += 1
+
+    def _admit(
+        self,
+        key: tuple[tuple[str, int], int],
+        entry: DatagramStoreEntry,
+        size: int,
+        evict: bool = True,
+    ) -> bool:
+        """
+        Checks, before anything is allocated, that the reassembly buffer of a partial datagram can grow to size bytes
+        with the memory of the datagram staying within max_peer_bytes and max_bytes. If it can not, the datagram can
+        never be reassembled: it is evicted (unless evict is False) and False is returned
+        """
+        if size > MAX_DATAGRAM_SIZE:
+            return False  # Larger than any datagram a peer could send
+        projected = entry.memory_size() + max(size - len(entry.buffer), 0)
+        if 0 < self.max_peer_bytes < projected:
+            if evict:
+                self._evict(key)
+                self.evictions.peer_bytes += 1
+            return False
+        if 0 < self.max_bytes < projected:
+            if evict:
+                self._evict(key)
+                self.evictions.total_bytes += 1
+            return False
+        return True
+
+    def nacks_due(self) -> list[tuple[bytes, tuple[str, int]]]:
+        """
+        Returns a NACK (and the address to send it to) for every partial datagram that has received no fragments
+        for nack_interval, and has not used up its NACK rounds. Only the datagrams that are due are visited
+        """
+        now = time.perf_counter()
+        nacks = []
+        # NOTE: Rescheduled datagrams move to the end, so every datagram is visited at most once per call
+        for _ in range(len(self.nack_schedule)):
+            key = next(iter(self.nack_schedule))
+            if self.nack_schedule[key] > now:
+                break
+
+            entry = self.datagrams[key]
+            if entry.nack_rounds >= self.nack_rounds:
+                del self.nack_schedule[key]
+                continue
+
+            entry.nack_rounds += 1
+            self.nack_schedule[key] = now + self.nack_interval
+            self.nack_schedule.move_to_end(key)
+
+            missing, tail = entry.missing_fragments()
+            nacks.append(
+                (
+                    nack_fragment(
+                        key[1], entry.nack_rounds, missing, tail, self.compact_headers
+                    ),
+                    key[0],
+                )
+            )
+        return nacks
+
+    def next_nack_time(self) -> Optional[float]:
+        """
+        Returns the time (time.perf_counter) the next NACK is due, None if no partial datagram is waiting for one
+        """
+        if len(self.nack_schedule) == 0:
+            return None
+        return next(iter(self.nack_schedule.values()))
+
+    def header_size(self, header) -> int:
+        """
+        Returns the size of the header at the start of header (a fragment or a prefix of it), -1 if it is malformed
+        """
+        parsed = unpack_header(header, self.compact_headers)
+        if parsed == None:
+            return -1
+        return parsed[4]
+
+    def reserve_fragment(
+        self, header, payload_size: int, addr: tuple[str, int]
+    ) -> Optional[tuple[bytearray, int]]:
+        """
+        Finds where the payload of a fragment belongs in the reassembly buffer of its datagram, so that it can be
+        written there directly (e.g. by socket.recvmsg_into). Returns the buffer and offset, after which
+        commit_fragment must be called once the payload is written. Returns None if the fragment can not be placed
+        directly (duplicate, misplaced, malformed or carrying an extension), in which case it must be given to
+        add_fragment_to_datagram
+        """
+        parsed = unpack_header(header, self.compact_headers)
+        if parsed == None:
+            return None
+
+        dgram_id, is_fin, frag_idx, extension, _ = parsed
+        if extension or (is_fin and frag_idx == 0):
+            return None  # Single-fragment datagram, see add_fragment_to_datagram
+        if (addr, dgram_id) in self.completed_keys:
+            return None  # Fragment of a completed datagram, dropped by add_fragment_to_datagram
+
+        key = (addr, dgram_id)
+        entry = self._touch_entry(key)
+        # NOTE: A datagram exceeding the memory limits is evicted by add_fragment_to_datagram, which the fragment is
+        #       given to next
+        offset = self._reserve(key, entry, is_fin, frag_idx, payload_size, evict=False)
+        if offset == -1:
+            return None
+        return entry.buffer, offset
+
+    def _reserve(
+        self,
+        key: tuple[tuple[str, int], int],
+        entry: DatagramStoreEntry,
+        is_fin: bool,
+        frag_idx: int,
+        payload_size: int,
+        evict: bool = True,
+    ) -> int:
+        """
+        Returns the offset of a fragment's payload in the (grown if needed) reassembly buffer, or -1 if the
+        fragment can not be placed directly. The buffer is only grown if the datagram stays within the memory
+        limits, see _admit
+        """
+        if entry.has_fragment(frag_idx):
+            return -1
+
+        offset = entry.fragment_offset(is_fin, frag_idx, payload_size)
+        if offset == -1:
+            return -1
+        if not self._admit(
+            key, entry, entry.extent(is_fin, offset, payload_size), evict
+        ):
+            return -1
 
         if is_fin:
-            self.datagrams[addr, dgram_id].is_fin = True
-            self.datagrams[addr, dgram_id].expected_frag_count = frag_idx + 1
+            entry.is_fin = True
+            entry.expected_frag_count = frag_idx + 1
+            entry.fin_payload_size = payload_size
+        else:
+            entry.frag_size = payload_size
+        entry.reserve(offset + payload_size, self.max_buffer_size)
+        return offset
 
-    def check_for_completed_datagrams(self) -> Optional[tuple[bytes, tuple[str, int]]]:
+    def commit_fragment(self, header, addr: tuple[str, int]) -> bool:
+        """
+        Marks a fragment placed by reserve_fragment as received. Returns True if the fragment completed its datagram,
+        in which case the datagram is moved to the queue of completed datagrams
         """
-        Returns the first complete datagram found, else None
+        dgram_id, _, frag_idx, _, _ = unpack_header(header, self.compact_headers)
+        key = (addr, dgram_id)
+        entry = self.datagrams[key]
+        entry.mark_received(frag_idx)
+        return self._complete_if_done(key, entry, frag_idx)
+
+    def add_fragment_to_datagram(self, frag, addr: tuple[str, int]) -> bool:
+        """
+        Appends a fragment to a partial/complete datagram. Returns True if the fragment completed its datagram,
+        in which case the datagram is moved to the queue of completed datagrams
         """
-        for key in self.datagrams:
+        frag = memoryview(frag)
+        parsed = unpack_header(frag, self.compact_headers)
+        if parsed == None:
+            return False  # Malformed fragment
+
+        dgram_id, is_fin, frag_idx, extension, header_size = parsed
+        payload = frag[header_size:]
+        key = (addr, dgram_id)
+        codec_id = 0
+        if extension:
             if (
-                self.datagrams[key].is_fin
-                and len(self.datagrams[key].frag_store.keys())
-                == self.datagrams[key].expected_frag_count
+                len(payload) < COMPRESSION_FIELDS.size
+                or payload[0] != EXT_FLAG_COMPRESSED
             ):
-                frag_store = self.datagrams[key].frag_store
-                addr = key[0]
-                data = bytearray(
-                    b"".join([frag_store[i] for i in range(len(frag_store.keys()))])
-                )
+                return self._add_extension_fragment(key, payload)
+            _, codec_id = COMPRESSION_FIELDS.unpack_from(payload)
+            payload = payload[COMPRESSION_FIELDS.size :]
 
-                del self.datagrams[key]
-                return data, addr
-        return None
+        if is_fin and frag_idx == 0 and key not in self.datagrams:
+            # NOTE: Fast path for single-fragment datagrams, which are complete on arrival and never need an entry.
+            #       The key is still remembered, so that FEC repair fragments arriving for it are ignored
+            self._remember_completed(key)
+            if codec_id != 0:
+                payload = self._decompress(codec_id, payload)
+                if payload == None:
+                    return False
+            self.completed.append((bytes(payload), addr))
+            return True
+        if key in self.completed_keys:
+            return False  # Late or duplicated fragment of a completed datagram
+
+        # NOTE: Same as reserve_fragment followed by commit_fragment, without parsing the header and looking
+        #       up the entry twice
+        entry = self._touch_entry(key)
+        if codec_id != 0:
+            entry.codec_id = codec_id
+        offset = self._reserve(key, entry, is_fin, frag_idx, len(payload))
+        if offset != -1:
+            entry.buffer[offset : offset + len(payload)] = payload
+            entry.mark_received(frag_idx)
+            return self._complete_if_done(key, entry, frag_idx)
+        if key not in self.datagrams:
+            return False  # Evicted, the datagram exceeds the memory limits
+
+        if (
+            entry.has_fragment(frag_idx)
+            or not is_fin
+            or frag_idx == 0
+            or entry.frag_size != -1
+        ):
+            return False  # Duplicate, malformed or oversized fragment
+
+        entry.is_fin = True
+        entry.expected_frag_count = frag_idx + 1
+        entry.fin_payload_size = len(payload)
+        entry.deferred_fin = bytes(payload)
+        entry.mark_received(frag_idx)
+        return self._complete_if_done(key, entry, frag_idx)
+
+    def _add_extension_fragment(
+        self, key: tuple[tuple[str, int], int], extension: memoryview
+    ) -> bool:
+        """
+        Handles a fragment carrying an extension: FEC repair fragments, NACKs and bundles, others are dropped.
+        Data fragments of compressed datagrams are handled by add_fragment_to_datagram
+        """
+        if len(extension) > 0 and extension[0] == EXT_FLAG_BUNDLE:
+            messages = parse_bundle(extension)
+            self.completed.extend((message, key[0]) for message in messages)
+            return len(messages) > 0
+        if len(extension) >= NACK_FIELDS.size and extension[0] == EXT_FLAG_NACK:
+            # NOTE: The datagram id of a NACK refers to a datagram sent by this socket, not one received from the peer
+            if self.nack_rounds > 0:
+                missing, tail = parse_nack(extension)
+                self.nack_requests.append((key[0], key[1], missing, tail))
+            return False
+        if (
+            len(extension) < FEC_HEADER_SIZE
+            or extension[0] & ~EXT_FLAG_COMPRESSED != EXT_FLAG_FEC
+        ):
+            return False
+        if key in self.completed_keys:
+            return False
+        repair_start = FEC_HEADER_SIZE
+        codec_id = 0
+        if extension[0] & EXT_FLAG_COMPRESSED:
+            if len(extension) <= FEC_HEADER_SIZE:
+                return False
+            codec_id = extension[FEC_HEADER_SIZE]
+            repair_start += 1
+        (
+            _,
+            data_fragments,
+            repair_fragments,
+            row,
+            block,
+            frag_size,
+            data_size,
+        ) = FEC_FIELDS.unpack_from(extension)
+        if (
+            data_fragments == 0
+            or frag_size == 0
+            or data_size == 0
+            or data_size > frag_size * 2**FRAG_IDX_BITS
+        ):
+            return False
+
+        entry = self._touch_entry(key)
+        if entry.frag_size not in (-1, frag_size) or not self._admit(
+            key, entry, data_size
+        ):
+            return False
+
+        # NOTE: A repair fragment describes the whole datagram, so the FIN fragment is no longer needed to know
+        #       how many fragments to expect
+        frag_count = int(math.ceil(data_size / frag_size))
+        entry.frag_size = frag_size
+        entry.is_fin = True
+        entry.expected_frag_count = frag_count
+        entry.fin_payload_size = data_size - (frag_count - 1) * frag_size
+        entry.fec_data_fragments = data_fragments
+        entry.fec_repair_fragments = repair_fragments
+        if codec_id != 0:
+            entry.codec_id = codec_id
+        if entry.repairs == None:
+            entry.repairs = {}
+        block_repairs = entry.repairs.setdefault(block, {})
+        if row not in block_repairs:
+            block_repairs[row] = bytes(extension[repair_start:])
+            entry.repair_size += len(block_repairs[row])
+        return self._complete_if_done(key, entry, block * data_fragments)
+
+    def _recover_block(self, entry: DatagramStoreEntry, frag_idx: int) -> None:
+        """
+        Recovers the missing fragments in the FEC block of frag_idx, if enough of the block has arrived
+        """
+        block = frag_idx // entry.fec_data_fragments
+        repairs = entry.repairs.get(block)
+        if repairs == None:
+            return
+
+        start = block * entry.fec_data_fragments
+        end = min(start + entry.fec_data_fragments, entry.expected_frag_count)
+        missing = [i for i in range(start, end) if not entry.has_fragment(i)]
+        if len(missing) == 0 or len(missing) > len(repairs):
+            return
+
+        entry.place_deferred_fin()
+        data = {
+            i
+            - start: bytes(
+                entry.buffer[
+                    i * entry.frag_size : i * entry.frag_size + entry.payload_size(i)
+                ]
+            )
+            for i in range(start, end)
+            if entry.has_fragment(i)
+        }
+        recovered = fec.decode(
+            end - start,
+            entry.fec_repair_fragments,
+            data,
+            repairs,
+            len(next(iter(repairs.values()))),
+        )
+        for i, payload in recovered.items():
+            frag_idx = start + i
+            offset = frag_idx * entry.frag_size
+            size = entry.payload_size(frag_idx)
+            entry.reserve(offset + size)
+            entry.buffer[offset : offset + size] = payload[:size]
+            entry.mark_received(frag_idx)
+
+    def _complete_if_done(
+        self, key: tuple[tuple[str, int], int], entry: DatagramStoreEntry, frag_idx: int
+    ) -> bool:
+        if entry.fec_data_fragments > 0:
+            self._recover_block(entry, frag_idx)
+        entry.place_deferred_fin()
+
+        if entry.is_fin and entry.received_frag_count == entry.expected_frag_count:
+            # NOTE: The buffer can be larger than the datagram, it is trimmed in place instead of copied
+            data = entry.buffer
+            del data[entry.datagram_size() :]
+
+            self._remove_entry(key)
+            self._remember_completed(key)
+            if entry.codec_id != 0:
+                data = self._decompress(entry.codec_id, data)
+                if data == None:
+                    return False
+            self.completed.append((data, key[0]))
+            return True
+
+        self._enforce_limits(key, entry)
+        return False
+
+    def _decompress(self, codec_id: int, data) -> Optional[bytes]:
+        """
+        Returns a completed datagram decompressed, or None if it is corrupt or compressed with a codec this socket does
+        not support. A datagram is held to the reassembly limits once decompressed as well: one decompressing to more
+        than max_buffer_size is dropped, and counted as an eviction for the limit it exceeds
+        """
+        try:
+            return compression.decompress(codec_id, data, self.max_buffer_size)
+        except ValueError:
+            if 0 < self.max_peer_bytes == self.max_buffer_size:
+                self.evictions.peer_bytes += 1
+            elif 0 < self.max_bytes == self.max_buffer_size:
+                self.evictions.total_bytes += 1
+            self.evictions.bytes += len(data)
+            return None
+
+    def check_for_completed_datagrams(self) -> Optional[tuple[bytes, tuple[str, int]]]:
+        """
+        Returns the oldest completed datagram, else None
+        """
+        if len(self.completed) == 0:
+            return None
+        return self.completed.popleft()
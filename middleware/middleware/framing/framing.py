@@ -0,0 +1,157 @@
+from socket import socket
+from middleware.configuration.config import config as _config
+from typing import Optional
+import struct
+
+# NOTE: Every message is preceded by its length, a 4-byte unsigned integer in network byte order
+MESSAGE_LENGTH = struct.Struct("!I")
+MAX_MESSAGE_SIZE = 2**32 - 1  # Largest message the wire format can carry
+# NOTE: Limit on the buffers passed to a single sendmsg call (IOV_MAX on Linux), longer lists are sent in several calls
+IOV_MAX = 1024
+INITIAL_BUFFER_SIZE = 2**16
+
+
+def frame_messages(messages: list) -> list:
+    """
+    Returns the buffers to send for messages (any objects supporting the buffer protocol): the length prefix and
+    the message itself for each, without copying the messages
+    """
+    buffers = []
+    for message in messages:
+        message = memoryview(message).cast("B")
+        if len(message) > MAX_MESSAGE_SIZE:
+            raise ValueError(
+                "Messages can be at most {} bytes".format(MAX_MESSAGE_SIZE)
+            )
+        buffers.append(MESSAGE_LENGTH.pack(len(message)))
+        buffers.append(message)
+    return buffers
+
+
+def send_buffers(sock: socket, buffers: list) -> int:
+    """
+    Sends every buffer in buffers in order on a stream socket, gathered by as few sendmsg calls as possible, and
+    returns the number of bytes sent. Like socket.sendall, the remainder is sent again after a partial send.
+    Platforms without sendmsg send the buffers joined into one with sendall
+    """
+    if not hasattr(sock, "sendmsg"):
+        data = b"".join(buffers)
+        sock.sendall(data)
+        return len(data)
+
+    buffers = [memoryview(buffer).cast("B") for buffer in buffers]
+    total = 0
+    first = 0
+    while first < len(buffers):
+        sent = sock.sendmsg(buffers[first : first + IOV_MAX])
+        total += sent
+        # NOTE: Skips the buffers sent in full, and the part sent of the first buffer that was not
+        while first < len(buffers) and sent >= len(buffers[first]):
+            sent -= len(buffers[first])
+            first += 1
+        if sent > 0:
+            buffers[first] = buffers[first][sent:]
+    return total
+
+
+class MessageReader:
+    """
+    Splits the byte stream of a connection into length-prefixed messages. Data is received directly into a single
+    reusable buffer with recv_into, and messages are parsed from it in place. A message that was only partly received
+    when the receive timed out (or would block) stays buffered, so reading can resume with the next call
+    """
+
+    buffer: bytearray
+    start: int  # Position of the first unparsed byte in buffer
+    end: int  # Position after the last received byte in buffer
+
+    def __init__(self, buffer_size: int = INITIAL_BUFFER_SIZE):
+        self.buffer = bytearray(buffer_size)
+        self.start = 0
+        self.end = 0
+
+    def pending(self) -> int:
+        """
+        Returns the number of received bytes that have not been returned as part of a message yet
+        """
+        return self.end - self.start
+
+    def take(self, size: int) -> bytes:
+        """
+        Returns up to size received bytes that have not been parsed yet, which are no longer parsed as messages
+        """
+        size = min(size, self.end - self.start)
+        with memoryview(self.buffer) as view:
+            data = bytes(view[self.start : self.start + size])
+        self.start += size
+        if self.start == self.end:
+            self.start = self.end = 0
+        return data
+
+    def next_message(self, max_size: int = _config.max_message_size) -> Optional[bytes]:
+        """
+        Returns the next message if it has been received in full, else None. Raises ValueError if the length of the
+        next message exceeds max_size, before any memory is allocated for it
+        """
+        if self.end - self.start < MESSAGE_LENGTH.size:
+            return None
+        (length,) = MESSAGE_LENGTH.unpack_from(self.buffer, self.start)
+        if length > max_size:
+            raise ValueError(
+                "Message of {} bytes exceeds the limit of {} bytes".format(
+                    length, max_size
+                )
+            )
+
+        message_end = self.start + MESSAGE_LENGTH.size + length
+        if message_end > self.end:
+            self._reserve(MESSAGE_LENGTH.size + length)
+            return None
+        # NOTE: Copied once through a memoryview, slicing the bytearray would copy it twice
+        with memoryview(self.buffer) as view:
+            message = bytes(view[self.start + MESSAGE_LENGTH.size : message_end])
+        self.start = message_end
+        if self.start == self.end:
+            self.start = self.end = 0
+        return message
+
+    def _reserve(self, size: int) -> None:
+        """
+        Makes room for size bytes from the first unparsed byte, moving the unparsed bytes to the front of the buffer
+        and growing it if needed
+        """
+        if self.start + size <= len(self.buffer):
+            return
+        pending = self.end - self.start
+        if self.start > 0:
+            self.buffer[:pending] = self.buffer[self.start : self.end]
+            self.start, self.end = 0, pending
+        if size > len(self.buffer):
+            self.buffer.extend(
+                bytes(max(size, 2 * len(self.buffer)) - len(self.buffer))
+            )
+
+    def read(
+        self, sock: socket, max_size: int = _config.max_message_size
+    ) -> Optional[bytes]:
+        """
+        Returns the next message, receiving from sock (blocking according to its timeout) until it is complete.
+        Returns None if the connection was closed by the peer between two messages, and raises ConnectionError if it
+        was closed in the middle of a message
+        """
+        while True:
+            message = self.next_message(max_size)
+            if message != None:
+                return message
+
+            if self.end == len(self.buffer):
+                self._reserve(self.end - self.start + 1)
+            with memoryview(self.buffer) as view:
+                received = sock.recv_into(view[self.end :])
+            if received == 0:
+                if self.end > self.start:
+                    raise ConnectionError(
+                        "Connection closed in the middle of a message"
+                    )
+                return None
+            self.end += received
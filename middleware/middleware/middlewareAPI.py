@@ -1,40 +1,103 @@
 from socket import *
 import middleware.fragmentation.fragmentation as _fragmentation
+import middleware.batching.batching as _batching
+import middleware.pacing.pacing as _pacing
+import middleware.framing.framing as _framing
+import middleware.coalescing.coalescing as _coalescing
+import middleware.scheduling.scheduling as _scheduling
+import middleware.transfer.transfer as _transfer
+import middleware.pmtu.pmtu as _pmtu
+import middleware.stats.stats as _stats
 from middleware.configuration.config import config as _config
 import collections
+import errno
+from typing import Optional
 import math
+import selectors
+import threading
 import time
 import sys
 
 
+def _configure_tcp_socket(
+    sock: socket, mtu: int, congestion_algorithm: str, clamp_mss: bool = True
+) -> int:
+    """
+    Applies the socket options of a MiddlewareReliable socket to sock: no IP options, the MSS from mtu (unless
+    clamp_mss is False) and the congestion algorithm. Returns the MSS. Shared with AsyncMiddlewareReliable, which
+    configures its sockets the same way without their write coalescing
+    """
+    # TODO: Force tcp to not use ip or tcp options when sending data.
+    #       This will reduce overhead from 120 bytes to 40
+    ip_header_size = 20  # IP_OPTIONS are forced off below
+    tcp_header_size = (
+        20  # TCP options are only used in SYN,ACK and mss is not affected by this
+    )
+    mss = mtu - ip_header_size - tcp_header_size
+    sock.setsockopt(IPPROTO_IP, IP_OPTIONS, b"")
+    if sys.platform == "linux":
+        if clamp_mss:
+            sock.setsockopt(IPPROTO_TCP, TCP_MAXSEG, mss)
+        sock.setsockopt(
+            IPPROTO_TCP,
+            TCP_CONGESTION,
+            congestion_algorithm.encode("utf-8"),
+        )
+    return mss
+
+
 class MiddlewareReliable:
     _socko: socket
     _mtu: int
     _mss: int
-
-    def __init__(self, mtu=_config.mtu, *, _internal_socket=None):
+    _message_reader: Optional[_framing.MessageReader]
+    _coalescer: _coalescing.WriteCoalescer
+    _congestion_algorithm: str
+    _pmtu_discovery: bool
+    _peer_host: Optional[str]  # Host of the connected peer, for the path MTU cache
+
+    def __init__(
+        self,
+        mtu=_config.mtu,
+        *,
+        congestion_algorithm: str = _config.congestion_algorithm,
+        write_mode: str = _config.write_mode,
+        write_max_delay: float = _config.write_max_delay,
+        write_buffer_size: int = _config.write_buffer_size,
+        zero_copy: bool = False,
+        pmtu_discovery: bool = _config.pmtu_discovery,
+        _internal_socket=None,
+    ):
+        """
+        write_mode controls how small writes are coalesced into segments: "default" (Nagle's algorithm), "nodelay"
+        (TCP_NODELAY, every write is sent right away), "cork" (TCP_CORK, partial segments are held until flush or
+        at most write_max_delay seconds) or "buffered" (writes are collected in an application buffer, sent when it
+        holds write_buffer_size bytes or on flush). In the "cork" and "buffered" modes, writes held are flushed before
+        every receive as well, so that a request is never held back while waiting for its reply.
+        When zero_copy is set, sendall sends large buffers with MSG_ZEROCOPY (Linux) instead of copying them into the
+        kernel, and returns once the kernel has released them. congestion_algorithm (Linux) must be one of the
+        algorithms allowed in system_config.ini.
+        When pmtu_discovery is set (Linux), segments are sized for the path MTU of the connection as discovered by the
+        kernel instead of for mtu, which is then only used until the socket is connected (see get_mtu)
+        """
         if _internal_socket != None:
             self._socko = _internal_socket
         else:
             self._socko = socket(AF_INET, SOCK_STREAM)
 
         self._mtu = mtu
-        # TODO: Force tcp to not use ip or tcp options when sending data.
-        #       This will reduce overhead from 120 bytes to 40
-        ip_header_size = 20  # IP_OPTIONS are forced off below
-        tcp_header_size = (
-            20  # TCP options are only used in SYN,ACK and mss is not affected by this
+        self._congestion_algorithm = congestion_algorithm
+        self._message_reader = None
+        self._peer_host = None
+        self._pmtu_discovery = pmtu_discovery and _pmtu.enable_discovery(self._socko)
+        self._mss = _configure_tcp_socket(
+            self._socko, mtu, congestion_algorithm, not self._pmtu_discovery
         )
-        self._mss = self._mtu - ip_header_size - tcp_header_size
-        self._socko.setsockopt(IPPROTO_IP, IP_OPTIONS, b"")
-        if sys.platform == "linux":
-            self._socko.setsockopt(IPPROTO_TCP, TCP_MAXSEG, self._mss)
-            self._socko.setsockopt(
-                IPPROTO_TCP,
-                TCP_CONGESTION,
-                _config.congestion_algorithm.encode("utf-8"),
-            )
-        # self._socko.setsockopt(IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO) TODO: is path MTU discovery something we want?
+        self._coalescer = _coalescing.WriteCoalescer(
+            self._socko, write_mode, write_max_delay, write_buffer_size, zero_copy
+        )
+        if _internal_socket != None and self._pmtu_discovery:
+            self._update_path_mtu(_internal_socket.getpeername()[0])
 
     def bind(self, address: tuple[str, int]) -> None:
         """
@@ -52,30 +115,120 @@ class MiddlewareReliable:
         """
         Funtionally identical to Pyton socket.connect
         """
+        if self._pmtu_discovery:
+            # NOTE: A path MTU discovered earlier limits the MSS announced, so it does not have to be discovered again
+            mtu = _pmtu.path_mtu_cache.get(address[0])
+            if mtu != None:
+                self._socko.setsockopt(IPPROTO_TCP, TCP_MAXSEG, mtu - 40)
         self._socko.connect(address)
+        if self._pmtu_discovery:
+            self._update_path_mtu(address[0])
+
+    def _update_path_mtu(self, host: str) -> None:
+        """
+        Reads the path MTU of the connection from the kernel, which lowers it when routers report a smaller MTU, and
+        updates the MTU and MSS of the socket and the path MTU cache
+        """
+        mtu = _pmtu.connected_path_mtu(self._socko)
+        if mtu == None:
+            return
+        self._peer_host = host
+        self._mtu = mtu
+        self._mss = mtu - 40
+        _pmtu.path_mtu_cache.set(host, mtu)
 
     def accept(self) -> tuple["MiddlewareReliable", tuple[str, int]]:
         """
         Funtionally identical to Pyton socket.accept, except the connection socket is converted to a MiddlewareReliable socket
         """
         socko, address = self._socko.accept()
-        return MiddlewareReliable(mtu=self._mtu, _internal_socket=socko), address
+        conn = MiddlewareReliable(
+            mtu=self._mtu,
+            congestion_algorithm=self._congestion_algorithm,
+            write_mode=self._coalescer.mode,
+            write_max_delay=self._coalescer.max_delay,
+            write_buffer_size=self._coalescer.buffer_size,
+            zero_copy=self._coalescer.zero_copy != None,
+            pmtu_discovery=self._pmtu_discovery,
+            _internal_socket=socko,
+        )
+        return conn, address
 
     def send(self, data: bytes) -> int:
         """
-        Funtionally identical to Pyton socket.send
+        Funtionally identical to Pyton socket.send, except in the "buffered" write mode, where all of data is buffered
         """
-        return self._socko.send(data)
+        return self._coalescer.send(data)
 
     def sendall(self, data: bytes) -> None:
         """
         Funtionally identical to Pyton socket.sendall
         """
-        self._socko.sendall(data)
+        self._coalescer.sendall(data)
+
+    def sendfile(self, file, offset: int = 0, count: Optional[int] = None) -> int:
+        """
+        Sends count bytes of file (a regular file opened in binary mode) from offset, to the end of the file if count
+        is None. The file is sent with os.sendfile without passing through user space where supported, else it is
+        read and sent in chunks. Returns the number of bytes sent
+        """
+        return self._coalescer.sendfile(file, offset, count)
+
+    def flush(self) -> None:
+        """
+        Sends the writes held by the "cork" and "buffered" write modes right away
+        """
+        self._coalescer.flush()
 
     def recv(self, buffer_size: int) -> bytes:
+        if self._coalescer.pending:
+            self._coalescer.flush()
+        # NOTE: Bytes received ahead by recv_message come first
+        if self._message_reader != None and self._message_reader.pending() > 0:
+            return self._message_reader.take(buffer_size)
         return self._socko.recv(buffer_size)
 
+    def recv_into_file(self, file, count: int, offset: int = 0) -> int:
+        """
+        Receives count bytes directly into file (opened for reading and writing, e.g. "r+b" or "w+b") at offset,
+        through a memory mapping of the file, which is extended as needed. Returns the number of bytes received,
+        fewer than count if the peer closed the connection first
+        """
+        if self._coalescer.pending:
+            self._coalescer.flush()
+        prefix = b""
+        if self._message_reader != None:
+            prefix = self._message_reader.take(count)
+        return _transfer.recv_into_file(self._socko, file, count, offset, prefix)
+
+    def send_message(self, data) -> None:
+        """
+        Sends data (any object supporting the buffer protocol) as a single length-prefixed message, to be received
+        in one piece by recv_message. Blocks until the whole message is sent, like sendall
+        """
+        self.send_messages([data])
+
+    def send_messages(self, messages: list) -> None:
+        """
+        Sends every message in messages as a separate length-prefixed message (see send_message). The length prefixes
+        and messages are gathered by a single sendmsg call (more for a very long list or after a partial send),
+        without being copied into one buffer first
+        """
+        self._coalescer.send_buffers(_framing.frame_messages(messages))
+
+    def recv_message(self, max_size: int = _config.max_message_size) -> Optional[bytes]:
+        """
+        Receives the next message sent with send_message/send_messages. Returns None once the peer has closed the
+        connection, and raises ConnectionError if it was closed in the middle of a message, or ValueError if the
+        message is larger than max_size. On a timeout, the part of the message received so far is kept and the next
+        call resumes it. Bytes received beyond the message are kept for the next recv_message, recv or recv_into_file
+        """
+        if self._coalescer.pending:
+            self._coalescer.flush()
+        if self._message_reader == None:
+            self._message_reader = _framing.MessageReader()
+        return self._message_reader.read(self._socko, max_size)
+
     def settimeout(self, timeout_s: float) -> None:
         """
         Sets the current timeout (in seconds) for blocking operations (accept/connect/send/sendall/recv), None signifies an infinite timeout
@@ -88,6 +241,18 @@ class MiddlewareReliable:
         """
         return self._socko.gettimeout()
 
+    def setblocking(self, flag: bool) -> None:
+        """
+        Funtionally identical to Pyton socket.setblocking
+        """
+        self._socko.setblocking(flag)
+
+    def fileno(self) -> int:
+        """
+        Returns the file descriptor of the underlying socket, for use with select/selectors
+        """
+        return self._socko.fileno()
+
     def set_tos(self, tos: int) -> None:
         """
         Sets the current TOS value used for outbound packets
@@ -102,19 +267,40 @@ class MiddlewareReliable:
 
     def get_mtu(self) -> int:
         """
-        Returns the MTU used by this socket
+        Returns the MTU used by this socket. With path MTU discovery, this is the current path MTU of the connection
         """
+        if self._peer_host != None:
+            self._update_path_mtu(self._peer_host)
         return self._mtu
 
     def get_mss(self) -> int:
         """
         Returns the MSS (Maximum Segment Size, MTU - headers) used by this socket
         """
+        if self._peer_host != None:
+            self._update_path_mtu(self._peer_host)
         return self._mss
 
+    def get_congestion_algorithm(self) -> str:
+        """
+        Returns the TCP congestion algorithm used by this socket
+        """
+        return self._congestion_algorithm
+
+    def get_stats(self) -> Optional[_stats.TcpInfo]:
+        """
+        Returns the TCP_INFO statistics of the connection (smoothed RTT, congestion window, retransmissions, delivery
+        rate, ...) decoded into a TcpInfo, or None where TCP_INFO is not supported. See StatsSampler for recording them
+        over time
+        """
+        return _stats.read_tcp_info(self._socko)
+
     def close(self) -> None:
         """Banishes the socket from the mortal realm"""
-        self._socko.close()
+        try:
+            self._coalescer.close()
+        finally:
+            self._socko.close()
 
 
 class MiddlewareUnreliable:
@@ -122,14 +308,135 @@ class MiddlewareUnreliable:
     _fragmenter: _fragmentation.Fragmenter
     _reassembler: _fragmentation.Reassembler
     _mtu: int
+    _batched_io: bool
+    _zero_copy: bool
+    _in_place_reassembly: bool
+    _receive_batch: Optional[_batching.ReceiveBatch]
+    _header_buffer: bytearray
+    _retransmit_cache: Optional[_fragmentation.RetransmitCache]
+    _aggregator: Optional[_fragmentation.Aggregator]
+    # NOTE: Held datagrams are also sent by the deadline scheduler thread, so everything touching the aggregator
+    #       holds this lock
+    _aggregation_lock: Optional[threading.Lock]
+    _flush_scheduled: bool  # The deadline scheduler will send the next held bundle once it is due
+    _segmentation: Optional[_batching.SegmentationOffload]
+    _gro_receiver: Optional[_batching.GroReceiver]
+    _pacer: _pacing.Pacer
+    _pmtu_discovery: bool
+
+    def __init__(
+        self,
+        mtu=_config.mtu,
+        *,
+        batched_io: bool = False,
+        zero_copy: bool = False,
+        in_place_reassembly: bool = False,
+        offload: bool = False,
+        fec_data_fragments: int = _config.fec_data_fragments,
+        fec_repair_fragments: int = _config.fec_repair_fragments,
+        nack_rounds: int = 0,
+        nack_cache_size: int = _fragmentation.NACK_CACHE_SIZE,
+        nack_interval: float = _config.nack_interval,
+        reassembly_max_bytes: int = _config.reassembly_max_bytes,
+        reassembly_max_peer_bytes: int = _config.reassembly_max_peer_bytes,
+        reassembly_max_peer_datagrams: int = _config.reassembly_max_peer_datagrams,
+        reassembly_eviction_policy: str = _config.reassembly_eviction_policy,
+        compact_headers: bool = _config.compact_headers,
+        aggregation: bool = False,
+        aggregation_hold_time: float = _config.aggregation_hold_time,
+        pacing_rate: int = _config.pacing_rate,
+        pacing_burst: int = _config.pacing_burst,
+        compression_codec: str = _config.compression_codec,
+        compression_threshold: int = _config.compression_threshold,
+        pmtu_discovery: bool = _config.pmtu_discovery,
+    ):
+        """
+        When batched_io is set, all fragments of a datagram are sent with a single sendmmsg call, and received
+        fragments are drained with recvmmsg. Platforms without these calls fall back to one call per fragment.
+        When zero_copy is set, each fragment is sent as a header and a slice of the caller's buffer with
+        scatter-gather I/O instead of being copied into a new buffer first.
+        When in_place_reassembly is set, the payload of each received fragment is written by the socket directly
+        to its final position in the reassembly buffer of its datagram (not available together with batched_io).
+        When offload is set, runs of equal-sized fragments are sent as a single buffer segmented by the kernel
+        (UDP_SEGMENT), and received fragments are coalesced by the kernel (UDP_GRO). Without kernel support, fragments
+        are sent and received as usual (not available together with in_place_reassembly).
+        fec_data_fragments and fec_repair_fragments configure forward error correction for sent datagrams
+        (see Fragmenter), received datagrams are always decoded.
+        When nack_rounds > 0 the socket is semi-reliable: as a receiver it requests lost fragments with up to
+        nack_rounds NACKs per datagram (each after nack_interval without progress), and as a sender it keeps the
+        fragments of recently sent datagrams (at most nack_cache_size bytes) to resend the ones requested.
+        Both peers must enable it.
+        The reassembly_* arguments limit the memory held by partial datagrams (see Reassembler), evictions are
+        counted by get_eviction_counters.
+        When compact_headers is set, fragments are sent with the compact variable-length header (1 byte for a small
+        datagram). Both peers must enable it, a socket with compact headers drops fragments with the legacy header.
+        When aggregation is set, small datagrams sent to the same address are held for at most aggregation_hold_time
+        and sent together in a single packet (see flush). Receivers unpack them into separate datagrams.
+        When pacing_rate > 0, the packets sent by the socket are paced to pacing_rate bytes per second (UDP/IP headers
+        included), in bursts of at most pacing_burst bytes (see set_pacing for per-destination pacing).
+        When compression_codec is not "none", sent datagrams of at least compression_threshold bytes are compressed
+        with the codec ("zlib" or "lzma") if that makes them shorter. Compressed datagrams are always decompressed by
+        the receiver, but datagrams held by aggregation are bundled uncompressed.
+        When pmtu_discovery is set (Linux), packets are sent with the don't fragment bit set, and the fragments of
+        each datagram are sized for the path MTU of its destination as discovered by the kernel (see pmtu), instead
+        of for mtu. A datagram rejected as too large for a path MTU that has just shrunk is fragmented again and resent
+        """
+        if batched_io and in_place_reassembly:
+            raise ValueError("batched_io and in_place_reassembly can not be combined")
+        if offload and in_place_reassembly:
+            raise ValueError("offload and in_place_reassembly can not be combined")
 
-    def __init__(self, mtu=_config.mtu):
         self._socko = socket(AF_INET, SOCK_DGRAM)
-        # self._socko.setsockopt(IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO) TODO: is path MTU discovery something we want?
-
-        self._fragmenter = _fragmentation.Fragmenter()
-        self._reassembler = _fragmentation.Reassembler()
+        self._pmtu_discovery = pmtu_discovery and _pmtu.enable_discovery(self._socko)
+
+        # NOTE: Fragments are sized from this socket's MTU. The reassembler learns the fragment size of each
+        #       datagram from its fragments, so peers with different MTUs can still communicate
+        self._fragmenter = _fragmentation.Fragmenter(
+            mtu,
+            fec_data_fragments,
+            fec_repair_fragments,
+            compact_headers,
+            compression_codec,
+            compression_threshold,
+        )
+        self._reassembler = _fragmentation.Reassembler(
+            nack_rounds,
+            nack_interval,
+            max_bytes=reassembly_max_bytes,
+            max_peer_bytes=reassembly_max_peer_bytes,
+            max_peer_datagrams=reassembly_max_peer_datagrams,
+            eviction_policy=reassembly_eviction_policy,
+            compact_headers=compact_headers,
+        )
         self._mtu = mtu
+        self._batched_io = batched_io and _batching.BATCHED_IO_AVAILABLE
+        self._zero_copy = zero_copy and hasattr(socket, "sendmsg")
+        self._in_place_reassembly = in_place_reassembly and hasattr(
+            socket, "recvmsg_into"
+        )
+        self._receive_batch = None
+        self._segmentation = None
+        self._gro_receiver = None
+        if offload:
+            self._segmentation = _batching.SegmentationOffload(self._socko)
+            self._gro_receiver = _batching.GroReceiver(self._socko)
+        self._header_buffer = bytearray(_fragmentation.MW_HEADER_SIZE)
+        self._retransmit_cache = None
+        if nack_rounds > 0:
+            self._retransmit_cache = _fragmentation.RetransmitCache(
+                nack_cache_size, nack_rounds, compact_headers
+            )
+        self._pacer = _pacing.Pacer()
+        if pacing_rate > 0:
+            self._pacer.set_rate(pacing_rate, pacing_burst)
+        self._aggregator = None
+        self._aggregation_lock = None
+        self._flush_scheduled = False
+        if aggregation:
+            self._aggregator = _fragmentation.Aggregator(
+                mtu, aggregation_hold_time, compact_headers
+            )
+            self._aggregation_lock = threading.Lock()
 
     def bind(self, address: tuple[str, int]) -> None:
         """
@@ -149,6 +456,20 @@ class MiddlewareUnreliable:
         """
         return self._socko.gettimeout()
 
+    def setblocking(self, flag: bool) -> None:
+        """
+        Functionally identical to Python socket.setblocking. On a non-blocking socket, recvfrom raises BlockingIOError
+        when no complete datagram can be assembled from the fragments that are ready, use poll_datagrams instead
+        """
+        self._socko.setblocking(flag)
+
+    def fileno(self) -> int:
+        """
+        Returns the file descriptor of the underlying socket, for use with select/selectors. The socket being readable
+        means fragments are ready, not necessarily a complete datagram (see poll_datagrams)
+        """
+        return self._socko.fileno()
+
     def set_tos(self, tos: int) -> None:
         """
         Sets the current TOS value used for outbound packets
@@ -161,11 +482,24 @@ class MiddlewareUnreliable:
         """
         return self._socko.getsockopt(IPPROTO_IP, IP_TOS)
 
-    def get_mtu(self) -> int:
+    def get_mtu(self, address: Optional[tuple[str, int]] = None) -> int:
         """
-        Returns the MTU used by this socket
+        Returns the MTU used by this socket, or with path MTU discovery, the MTU used for sending to address
         """
-        return self._mtu
+        if address == None:
+            return self._mtu
+        return self._path_mtu(address) or self._mtu
+
+    def _path_mtu(self, address: tuple[str, int]) -> Optional[int]:
+        """
+        Returns the MTU to fragment datagrams to address for, None for the MTU of the socket
+        """
+        if not self._pmtu_discovery:
+            return None
+        mtu = _pmtu.path_mtu(address)
+        if mtu == None:
+            return None
+        return max(_fragmentation.MTU_MIN, min(mtu, _fragmentation.MTU_MAX))
 
     def get_mss(self) -> int:
         """
@@ -173,66 +507,508 @@ class MiddlewareUnreliable:
         and is therefore different from the maximum payload that can be sent (indicated by get_max_payload_size()).
         This value is the maximum amount of payload that can be sent with each fragment.
         """
-        return (
-            self._mtu
-            - _fragmentation.UDP_IP_HEADER_SIZE
-            - _fragmentation.MW_HEADER_SIZE
-        )
+        return self._fragmenter.max_frag_payload
 
-    @staticmethod
-    def get_max_payload_size() -> int:
+    def get_max_payload_size(self, address: Optional[tuple[str, int]] = None) -> int:
         """
-        Returns the maximum payload size than can be sent with a single MiddlewareUnrelaible datagram (single call to sendto)
+        Returns the maximum payload size than can be sent with a single MiddlewareUnrelaible datagram (single call to sendto).
+        This depends on the MTU of the socket, as a datagram can consist of at most 2048 fragments. With path MTU
+        discovery, the path MTU to address is used instead
         """
-        return _fragmentation.MAX_DGRAM_PAYLOAD
+        if address == None:
+            return self._fragmenter.max_dgram_payload
+        return self._fragmenter.payload_limits(self.get_mtu(address))[1]
+
+    def set_pacing(
+        self, rate: int, burst: int, address: Optional[tuple[str, int]] = None
+    ) -> None:
+        """
+        Paces the packets sent to address (all packets sent by the socket if address is None) to rate bytes per second,
+        UDP/IP headers included, in bursts of at most burst bytes. A packet to an address with its own pacing must
+        be allowed by the pacing of the socket as well. A rate of 0 disables the pacing
+        """
+        self._pacer.set_rate(rate, burst, address)
+
+    def get_eviction_counters(self) -> _fragmentation.EvictionCounters:
+        """
+        Returns the number of partial datagrams evicted for each reassembly memory limit, and the bytes discarded with them
+        """
+        return self._reassembler.evictions
 
     def close(self) -> None:
         """Closes the socket and banishes it from the mortal realm (or plane, if you prefer).
         Use this method to rid your system of any malevolent socket entities and restore order to the world of network programming!
          - ChatGPT 2023"""
+        if self._aggregator != None:
+            self.flush()
         self._socko.close()
 
-    def sendto(self, data: bytes, address: tuple[str, int]) -> int:
+    def sendto(self, data, address: tuple[str, int]) -> int:
         """
         Mimics Python socket.sendto, but the blocking timeout affects an internal socket.sendto call
-        for each fragment sent, and not the MiddlewareUnreliable.sendto call. Rated for max payload of 63488 B
-        (this can be queried with MiddlewareUnreliable.get_max_payload_size)
-        """
-        sent = 0
-        for fragment in self._fragmenter.fragment(data):
-            sent += self._socko.sendto(fragment, address)
+        for each fragment sent, and not the MiddlewareUnreliable.sendto call. The max payload depends on the MTU
+        of the socket (this can be queried with MiddlewareUnreliable.get_max_payload_size). data can be any object supporting
+        the buffer protocol (bytes, bytearray, memoryview, mmap, ...).
+        With aggregation, small datagrams are held instead of sent, and the bytes sent by this call can be 0
+        """
+        if self._retransmit_cache != None:
+            self.process_nacks()
+        if self._aggregator == None:
+            return self._send_datagram(data, address)
+
+        with self._aggregation_lock:
+            sent = self._send_bundles(self._aggregator.due())
+            if self._aggregator.can_hold(memoryview(data).nbytes):
+                sent += self._send_bundles(self._aggregator.add(data, address))
+                deadline = self._claim_flush_deadline()
+            else:
+                # NOTE: Held datagrams are sent first, to keep the order of datagrams to the same address
+                sent += self._send_bundles(self._aggregator.flush(address))
+                return sent + self._send_datagram(data, address)
+        if deadline != None:
+            _scheduling.deadline_scheduler.schedule(self, deadline)
         return sent
 
-    def recvfrom(self) -> tuple[bytes, tuple[str, int]]:
+    def _claim_flush_deadline(self) -> Optional[float]:
         """
-        Mimics Python socket.recvfrom, but "block" until either a timeout error is raised by an internal socket.recvfrom call
-        or a complete MiddlewareUnreliable datagram has arrived
+        Returns the time (time.monotonic) the deadline scheduler has to send the next held bundle at, None if
+        it is already scheduled or nothing is held. Called with _aggregation_lock held
         """
-        while True:
-            # NOTE: Probe received fragment size
-            buffer_size = _config.mtu
-            if sys.platform == "win32":
-                frag, addr = self._socko.recvfrom(buffer_size)
+        next_deadline = self._aggregator.next_deadline()
+        if self._flush_scheduled or next_deadline == None:
+            return None
+        self._flush_scheduled = True
+        return time.monotonic() + max(0.0, next_deadline - time.perf_counter())
+
+    def _expire(self, deadline: float) -> None:
+        """
+        Called by the deadline scheduler: sends the held bundles that are due, so that a datagram is never held for
+        longer than the hold time, even if the socket is not used again
+        """
+        with self._aggregation_lock:
+            self._flush_scheduled = False
+            if self._socko.fileno() == -1:
+                return
+            try:
+                self._send_bundles(self._aggregator.due())
+            except OSError:
+                pass  # NOTE: As with any UDP send, the held datagrams are lost
+            deadline = self._claim_flush_deadline()
+        if deadline != None:
+            _scheduling.deadline_scheduler.schedule(self, deadline)
+
+    def try_sendto(self, data, address: tuple[str, int]) -> float:
+        """
+        Non-blocking variant of sendto for paced sockets. Sends data right away if pacing allows all of its fragments
+        and returns 0, else sends nothing and returns the number of seconds until it is allowed. The fragments are sent
+        back to back, so a datagram of several fragments must fit in the pacing burst (UDP/IP headers included),
+        else ValueError is raised. NACKs are not processed, and it can not be used together with aggregation
+        """
+        if self._aggregator != None:
+            raise ValueError("try_sendto can not be used together with aggregation")
+
+        fragments = self._fragment(data, address)
+        if self._pacer.is_active(address):
+            delay = self._pacer.take_all(address, self._wire_sizes(fragments))
+            if delay > 0:
+                return delay
+
+        if self._retransmit_cache != None:
+            self._retransmit_cache.add(fragments)
+        try:
+            self._send_unpaced(fragments, address)
+        except OSError as e:
+            self._send_unpaced(self._refragment(data, address, e), address)
+        return 0.0
+
+    def flush(self) -> int:
+        """
+        Sends all datagrams held by aggregation right away, returns the number of bytes sent
+        """
+        if self._aggregator == None:
+            return 0
+        with self._aggregation_lock:
+            return self._send_bundles(self._aggregator.flush())
+
+    def _send_bundles(self, bundles: list[tuple[list[bytes], tuple[str, int]]]) -> int:
+        sent = 0
+        for messages, address in bundles:
+            if len(messages) == 1:
+                sent += self._send_datagram(messages[0], address)
             else:
-                while True:
-                    _, _, msg_flags, _ = self._socko.recvmsg(buffer_size, 0, MSG_PEEK)
-                    if msg_flags & MSG_TRUNC:
-                        buffer_size *= 2
-                        continue
-                    else:
-                        break
+                bundle = _fragmentation.bundle_fragment(
+                    messages, self._aggregator.compact_headers
+                )
+                # NOTE: Bundles are filled up to the MTU of the socket, a smaller path MTU splits them up again
+                if len(bundle) + _fragmentation.UDP_IP_HEADER_SIZE > self.get_mtu(
+                    address
+                ):
+                    for message in messages:
+                        sent += self._send_datagram(message, address)
+                    continue
+                sent += self._send_fragments([bundle], address)
+        return sent
+
+    def _fragment(self, data, address: tuple[str, int]) -> list:
+        mtu = self._path_mtu(address)
+        if self._zero_copy:
+            return self._fragmenter.fragment_iovecs(data, mtu)
+        return self._fragmenter.fragment(data, mtu)
+
+    def _send_datagram(self, data, address: tuple[str, int]) -> int:
+        fragments = self._fragment(data, address)
+        if self._retransmit_cache != None:
+            self._retransmit_cache.add(fragments)
+        try:
+            return self._send_fragments(fragments, address)
+        except OSError as e:
+            fragments = self._refragment(data, address, e)
+        return self._send_fragments(fragments, address)
+
+    def _refragment(self, data, address: tuple[str, int], error: OSError) -> list:
+        """
+        Fragments data again after sending it to address failed with error, if that is because the path MTU has
+        shrunk since it was cached (the kernel learned the new one from an ICMP message), else raises error
+        """
+        if error.errno != errno.EMSGSIZE or not self._pmtu_discovery:
+            raise error
+        _pmtu.path_mtu(address, refresh=True)
+        fragments = self._fragment(data, address)
+        if self._retransmit_cache != None:
+            self._retransmit_cache.add(fragments)
+        return fragments
+
+    def _wire_sizes(self, fragments: list) -> list[int]:
+        return [
+            _batching.message_size(fragment) + _fragmentation.UDP_IP_HEADER_SIZE
+            for fragment in fragments
+        ]
+
+    def _send_fragments(self, fragments: list, address: tuple[str, int]) -> int:
+        """
+        Sends fragments to address, waiting (without busy waiting) for the pacing to allow them
+        """
+        if not self._pacer.is_active(address):
+            return self._send_unpaced(fragments, address)
+
+        sizes = self._wire_sizes(fragments)
+        sent = 0
+        start = 0
+        while start < len(fragments):
+            # NOTE: All fragments allowed right away are sent together, to keep the benefit of batched I/O and offload
+            count = self._pacer.take(address, sizes[start:])
+            if count == 0:
+                time.sleep(self._pacer.delay(address, sizes[start]))
+                continue
+            sent += self._send_unpaced(fragments[start : start + count], address)
+            start += count
+        return sent
 
-                frag, _, msg_flags, addr = self._socko.recvmsg(buffer_size)
-                assert (msg_flags & MSG_TRUNC) == 0
+    def _send_unpaced(self, fragments: list, address: tuple[str, int]) -> int:
+        if (
+            self._segmentation != None
+            and self._segmentation.enabled
+            and len(fragments) > 1
+        ):
+            return self._segmentation.send(
+                self._socko, fragments, address, self._send_unsegmented
+            )
+        return self._send_unsegmented(fragments, address)
 
-            # NOTE: Old datagrams (partial/complete datagrams containing old fragments) are timed out after the blocking socket.recvfrom
-            #       operation has completed to avoid datagram id collisions when a lot of time is spent in socket.recvfrom
-            self._reassembler.timeout_old_datagrams()
+    def _send_unsegmented(self, fragments: list, address: tuple[str, int]) -> int:
+        # NOTE: A single fragment gains nothing from sendmmsg, which is more expensive to set up than sendto
+        if self._batched_io and len(fragments) > 1:
+            return _batching.sendmmsg(self._socko, fragments, address)
 
-            self._reassembler.add_fragment_to_datagram(frag, addr)
+        sent = 0
+        for fragment in fragments:
+            if isinstance(fragment, list):
+                sent += self._socko.sendmsg(fragment, [], 0, address)
+            else:
+                sent += self._socko.sendto(fragment, address)
+        return sent
+
+    def process_nacks(self) -> None:
+        """
+        Answers the NACKs that have arrived by resending the requested fragments, and sends the NACKs that are due
+        for partial datagrams, without blocking. Called by sendto and recvfrom, but a semi-reliable socket that only
+        sends should also call this (or recvfrom) for a while after its last sendto, so that late NACKs are answered.
+        Fragments of datagrams received on the way are kept for recvfrom
+        """
+        self._drain()
+        self._exchange_nacks()
+
+    def poll_datagrams(self) -> list[tuple[bytes, tuple[str, int]]]:
+        """
+        Receives the fragments that are ready without blocking, and returns every datagram completed so far
+        (possibly none). Held datagrams that are due are sent. Meant for sockets driven by select/selectors
+        (see fileno and MiddlewarePoller)
+        """
+        if self._aggregator != None:
+            with self._aggregation_lock:
+                self._send_bundles(self._aggregator.due())
+        self._drain()
+        if self._retransmit_cache != None:
+            self._exchange_nacks()
 
+        datagrams = []
+        while True:
             completed_dgram = self._reassembler.check_for_completed_datagrams()
             if completed_dgram == None:
+                return datagrams
+            datagrams.append(completed_dgram)
+
+    def _drain(self) -> None:
+        """
+        Adds every fragment that can be received without blocking to its datagram
+        """
+        timeout = self._socko.gettimeout()
+        self._socko.settimeout(0)
+        try:
+            while True:
+                self._recv_step()
+        except BlockingIOError:
+            pass
+        finally:
+            self._socko.settimeout(timeout)
+
+    def _exchange_nacks(self) -> None:
+        for nack, address in self._reassembler.nacks_due():
+            self._socko.sendto(nack, address)
+
+        requests = self._reassembler.nack_requests
+        while len(requests) > 0:
+            address, dgram_id, missing, tail = requests.popleft()
+            fragments = self._retransmit_cache.repair(dgram_id, missing, tail)
+            if len(fragments) == 0:
+                continue
+            try:
+                self._send_fragments(fragments, address)
+            except OSError as e:
+                if e.errno != errno.EMSGSIZE or not self._pmtu_discovery:
+                    raise
+                # NOTE: Fragments sized for a path MTU that has shrunk since can not be repaired
+                _pmtu.path_mtu(address, refresh=True)
+
+    def _recv_fragments(self) -> list[tuple[bytes, tuple[str, int]]]:
+        """
+        Receives at least one fragment, blocking according to the socket timeout. With batched I/O, all
+        fragments that are ready (up to the batch size) are drained at once. With offload, all fragments
+        coalesced by the kernel are received at once
+        """
+        if self._gro_receiver != None and self._gro_receiver.enabled:
+            return self._gro_receiver.recv(self._socko)
+
+        if self._batched_io:
+            if self._receive_batch == None:
+                self._receive_batch = _batching.ReceiveBatch()
+            return self._receive_batch.recv(self._socko)
+
+        # NOTE: Probe received fragment size
+        buffer_size = self._mtu
+        if sys.platform == "win32":
+            return [self._socko.recvfrom(_batching.RECV_BUFFER_SIZE)]
+
+        while True:
+            _, _, msg_flags, _ = self._socko.recvmsg(buffer_size, 0, MSG_PEEK)
+            if msg_flags & MSG_TRUNC:
+                buffer_size *= 2
                 continue
             else:
+                break
+
+        frag, _, msg_flags, addr = self._socko.recvmsg(buffer_size)
+        assert (msg_flags & MSG_TRUNC) == 0
+        return [(frag, addr)]
+
+    def _recv_fragment_in_place(self) -> None:
+        """
+        Receives a single fragment, writing its payload directly into the reassembly buffer of its datagram.
+        The header is peeked first (which also yields the fragment size) to find where the payload belongs
+        """
+        frag_size, _, _, addr = self._socko.recvmsg_into(
+            [self._header_buffer], 0, MSG_PEEK | MSG_TRUNC
+        )
+        self._reassembler.timeout_old_datagrams()
+
+        # NOTE: The buffer fits the longest header, the header of a short fragment is only a prefix of it
+        header = bytes(self._header_buffer[:frag_size])
+        header_size = self._reassembler.header_size(header)
+        placement = None
+        if header_size != -1:
+            placement = self._reassembler.reserve_fragment(
+                header, frag_size - header_size, addr
+            )
+
+        if placement == None:
+            frag, addr = self._socko.recvfrom(frag_size)
+            if header_size != -1:
+                self._reassembler.add_fragment_to_datagram(frag, addr)
+            return
+
+        buffer, offset = placement
+        with memoryview(buffer) as view:
+            with view[offset : offset + frag_size - header_size] as payload_view:
+                with memoryview(self._header_buffer)[:header_size] as header_view:
+                    self._socko.recvmsg_into([header_view, payload_view])
+        self._reassembler.commit_fragment(header, addr)
+
+    def recvfrom(self) -> tuple[bytes, tuple[str, int]]:
+        """
+        Mimics Python socket.recvfrom, but "block" until either a timeout error is raised by an internal socket.recvfrom call
+        or a complete MiddlewareUnreliable datagram has arrived. On a semi-reliable socket, NACKs are sent and answered
+        while waiting, and the timeout is the longest time without any fragment arriving. Datagrams held by aggregation
+        are sent before waiting, as they could be what the peer has to answer
+        """
+        if self._aggregator != None:
+            self.flush()
+        idle_since = time.perf_counter()
+        while True:
+            completed_dgram = self._reassembler.check_for_completed_datagrams()
+            if completed_dgram != None:
                 return completed_dgram[0], completed_dgram[1]
+
+            if self._retransmit_cache == None:
+                self._recv_step()
+                continue
+
+            self._exchange_nacks()
+            if not self._recv_step_until_nack_due(idle_since):
+                continue
+            idle_since = time.perf_counter()
+
+    def _next_timer(self) -> Optional[float]:
+        """
+        Returns the time (time.perf_counter) poll_datagrams is next due to send NACKs or held datagrams,
+        None if neither are pending
+        """
+        next_nack = self._reassembler.next_nack_time()
+        if self._aggregator == None:
+            return next_nack
+        with self._aggregation_lock:
+            next_bundle = self._aggregator.next_deadline()
+        if next_nack == None or next_bundle == None:
+            return next_bundle if next_nack == None else next_nack
+        return min(next_nack, next_bundle)
+
+    def _recv_step_until_nack_due(self, idle_since: float) -> bool:
+        """
+        Performs a receive step, but gives up when the next NACK is due so it can be sent. Returns False if no
+        fragment arrived. Raises TimeoutError once nothing has arrived for the socket timeout
+        """
+        timeout = self._socko.gettimeout()
+        next_nack = self._reassembler.next_nack_time()
+        if next_nack == None or timeout == 0:
+            self._recv_step()
+            return True
+
+        wait = next_nack - time.perf_counter()
+        if timeout != None:
+            remaining = idle_since + timeout - time.perf_counter()
+            if remaining <= 0:
+                raise TimeoutError("timed out")
+            wait = min(wait, remaining)
+
+        # NOTE: A timeout of 0 would make the socket non-blocking
+        self._socko.settimeout(max(wait, 0.001))
+        try:
+            self._recv_step()
+            return True
+        except TimeoutError:
+            return False
+        finally:
+            self._socko.settimeout(timeout)
+
+    def _recv_step(self) -> None:
+        """
+        Receives at least one fragment and adds it to its datagram
+        """
+        if self._in_place_reassembly:
+            self._recv_fragment_in_place()
+            return
+
+        fragments = self._recv_fragments()
+
+        # NOTE: Old datagrams (partial/complete datagrams containing old fragments) are timed out after the blocking socket.recvfrom
+        #       operation has completed to avoid datagram id collisions when a lot of time is spent in socket.recvfrom
+        self._reassembler.timeout_old_datagrams()
+
+        for frag, addr in fragments:
+            self._reassembler.add_fragment_to_datagram(frag, addr)
+
+
+class MiddlewarePoller:
+    """
+    Waits on many MiddlewareReliable and MiddlewareUnreliable sockets at once, using the selectors module
+    """
+
+    _selector: selectors.BaseSelector
+    _unreliable: dict[int, MiddlewareUnreliable]
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._unreliable = {}
+
+    def register(self, socko, data=None) -> None:
+        """
+        Adds a middleware socket to wait on for incoming data (or connections, for a listening MiddlewareReliable).
+        data is returned together with the socket by poll
+        """
+        self._selector.register(socko, selectors.EVENT_READ, data)
+        if isinstance(socko, MiddlewareUnreliable):
+            self._unreliable[socko.fileno()] = socko
+
+    def unregister(self, socko) -> None:
+        self._selector.unregister(socko)
+        self._unreliable.pop(socko.fileno(), None)
+
+    def poll(
+        self, timeout: Optional[float] = None
+    ) -> list[tuple[object, object, list]]:
+        """
+        Waits until at least one socket is ready, or timeout (in seconds, None waits indefinitely) has passed.
+        Returns a (socket, data, datagrams) tuple for every ready socket. A MiddlewareReliable socket is ready when
+        recv/accept will not block, and datagrams is empty. A MiddlewareUnreliable socket is ready when datagrams,
+        the list of datagrams completed by fragments received without blocking (see poll_datagrams), is not empty
+        """
+        deadline = None if timeout == None else time.perf_counter() + timeout
+        while True:
+            wait = None if deadline == None else max(deadline - time.perf_counter(), 0)
+            for socko in self._unreliable.values():
+                if len(socko._reassembler.completed) > 0:
+                    wait = 0
+                    break
+                # NOTE: Sockets must also be polled when their next NACK is due, or their held datagrams
+                next_timer = socko._next_timer()
+                if next_timer != None:
+                    timer_wait = max(next_timer - time.perf_counter(), 0)
+                    wait = timer_wait if wait == None else min(wait, timer_wait)
+
+            ready = {key.fd: key for key, _ in self._selector.select(wait)}
+            results = []
+            for key in ready.values():
+                if key.fd not in self._unreliable:
+                    results.append((key.fileobj, key.data, []))
+            for fd, socko in self._unreliable.items():
+                if (
+                    fd in ready
+                    or len(socko._reassembler.completed) > 0
+                    or socko._next_timer() != None
+                ):
+                    datagrams = socko.poll_datagrams()
+                    if len(datagrams) > 0:
+                        results.append(
+                            (socko, self._selector.get_key(socko).data, datagrams)
+                        )
+
+            if len(results) > 0 or (
+                deadline != None and time.perf_counter() >= deadline
+            ):
+                return results
+
+    def close(self) -> None:
+        """
+        Closes the selector, the registered sockets are left open
+        """
+        self._selector.close()
+        self._unreliable.clear()
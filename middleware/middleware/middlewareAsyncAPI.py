@@ -0,0 +1,280 @@
+from socket import *
+import middleware.fragmentation.fragmentation as _fragmentation
+from middleware.middlewareAPI import _configure_tcp_socket
+from middleware.configuration.config import config as _config
+from typing import Awaitable, Callable, Optional
+import asyncio
+import collections
+
+
+class AsyncMiddlewareReliable:
+    """
+    asyncio counterpart of MiddlewareReliable, wrapping a StreamReader/StreamWriter pair. The underlying socket is
+    configured exactly like a MiddlewareReliable socket (MSS from the MTU, no IP options and the configured
+    congestion algorithm). Created with open_reliable_connection or by start_reliable_server
+    """
+
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    _mtu: int
+    _mss: int
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, mtu: int
+    ):
+        self.reader = reader
+        self.writer = writer
+        self._mtu = mtu
+        # NOTE: Socket options of accepted connections are applied again, as with MiddlewareReliable.accept. The
+        #       write coalescing of MiddlewareReliable is not, as nothing on the asyncio path would flush it
+        self._mss = _configure_tcp_socket(
+            writer.get_extra_info("socket"), mtu, _config.congestion_algorithm
+        )
+
+    async def send(self, data) -> int:
+        """
+        Writes data to the stream and waits until the write buffer has drained. Returns the number of bytes sent
+        """
+        self.writer.write(data)
+        await self.writer.drain()
+        return len(data)
+
+    async def sendall(self, data) -> None:
+        """
+        Writes all of data to the stream and waits until the write buffer has drained
+        """
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def recv(self, buffer_size: int) -> bytes:
+        """
+        Receives at most buffer_size bytes, an empty bytes object signifies that the connection was closed
+        """
+        return await self.reader.read(buffer_size)
+
+    def set_tos(self, tos: int) -> None:
+        """
+        Sets the current TOS value used for outbound packets
+        """
+        self.writer.get_extra_info("socket").setsockopt(IPPROTO_IP, IP_TOS, tos)
+
+    def get_tos(self) -> int:
+        """
+        Returns the current TOS value used for outbound packets
+        """
+        return self.writer.get_extra_info("socket").getsockopt(IPPROTO_IP, IP_TOS)
+
+    def get_mtu(self) -> int:
+        """
+        Returns the MTU used by this socket
+        """
+        return self._mtu
+
+    def get_mss(self) -> int:
+        """
+        Returns the MSS (Maximum Segment Size, MTU - headers) used by this socket
+        """
+        return self._mss
+
+    def getpeername(self) -> tuple[str, int]:
+        return self.writer.get_extra_info("peername")
+
+    async def close(self) -> None:
+        """Closes the stream and waits for the socket to be closed"""
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def open_reliable_connection(
+    address: tuple[str, int], mtu: int = _config.mtu
+) -> AsyncMiddlewareReliable:
+    """
+    Connects to address, the asyncio counterpart of MiddlewareReliable.connect
+    """
+    socko = socket(AF_INET, SOCK_STREAM)
+    _configure_tcp_socket(socko, mtu, _config.congestion_algorithm)
+    socko.setblocking(False)
+    try:
+        await asyncio.get_running_loop().sock_connect(socko, address)
+        reader, writer = await asyncio.open_connection(sock=socko)
+    except BaseException:
+        socko.close()
+        raise
+    return AsyncMiddlewareReliable(reader, writer, mtu)
+
+
+async def start_reliable_server(
+    client_connected: Callable[[AsyncMiddlewareReliable], Awaitable[None]],
+    address: tuple[str, int],
+    mtu: int = _config.mtu,
+    backlog: int = 100,
+) -> asyncio.Server:
+    """
+    Listens on address and calls client_connected (a coroutine function) with an AsyncMiddlewareReliable for every
+    accepted connection, the asyncio counterpart of MiddlewareReliable.bind/listen/accept
+    """
+    listener = socket(AF_INET, SOCK_STREAM)
+    _configure_tcp_socket(listener, mtu, _config.congestion_algorithm)
+    listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    listener.bind(address)
+
+    async def on_connection(reader, writer):
+        await client_connected(AsyncMiddlewareReliable(reader, writer, mtu))
+
+    return await asyncio.start_server(on_connection, sock=listener, backlog=backlog)
+
+
+class _UnreliableProtocol(asyncio.DatagramProtocol):
+    def __init__(self, endpoint: "AsyncMiddlewareUnreliable"):
+        self._endpoint = endpoint
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        self._endpoint._fragment_received(data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        self._endpoint._wake_receivers(exc)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._endpoint._wake_receivers(exc or ConnectionAbortedError("closed"))
+
+
+class AsyncMiddlewareUnreliable:
+    """
+    asyncio counterpart of MiddlewareUnreliable, built on a DatagramProtocol. Fragments are reassembled as they
+    are delivered by the event loop, so no task is blocked while a datagram is incomplete and a single event loop
+    can serve any number of endpoints. Created with open_unreliable_endpoint
+    """
+
+    _fragmenter: _fragmentation.Fragmenter
+    _reassembler: _fragmentation.Reassembler
+    _mtu: int
+    _transport: Optional[asyncio.DatagramTransport]
+    _waiters: collections.deque[asyncio.Future]
+    _exception: Optional[Exception]
+
+    def __init__(
+        self,
+        mtu: int = _config.mtu,
+        *,
+        fec_data_fragments: int = _config.fec_data_fragments,
+        fec_repair_fragments: int = _config.fec_repair_fragments,
+        compact_headers: bool = _config.compact_headers,
+        compression_codec: str = _config.compression_codec,
+        compression_threshold: int = _config.compression_threshold,
+    ):
+        self._fragmenter = _fragmentation.Fragmenter(
+            mtu,
+            fec_data_fragments,
+            fec_repair_fragments,
+            compact_headers,
+            compression_codec,
+            compression_threshold,
+        )
+        self._reassembler = _fragmentation.Reassembler(compact_headers=compact_headers)
+        self._mtu = mtu
+        self._transport = None
+        self._waiters = collections.deque()
+        self._exception = None
+
+    def _fragment_received(self, frag: bytes, addr: tuple[str, int]) -> None:
+        self._reassembler.timeout_old_datagrams()
+        if self._reassembler.add_fragment_to_datagram(frag, addr):
+            self._wake_receivers()
+
+    def _wake_receivers(self, exc: Optional[Exception] = None) -> None:
+        if exc != None:
+            self._exception = exc
+        while len(self._waiters) > 0:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def recvfrom(self) -> tuple[bytes, tuple[str, int]]:
+        """
+        Waits until a complete MiddlewareUnreliable datagram has arrived, and returns it with the sender address.
+        Use asyncio.wait_for (or asyncio.timeout) for a timeout
+        """
+        while True:
+            completed_dgram = self._reassembler.check_for_completed_datagrams()
+            if completed_dgram != None:
+                return completed_dgram[0], completed_dgram[1]
+
+            if self._exception != None:
+                exc, self._exception = self._exception, None
+                raise exc
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    def sendto(self, data, address: tuple[str, int]) -> None:
+        """
+        Queues all fragments of data for sending to address, without blocking (see asyncio.DatagramTransport.sendto).
+        data can be any object supporting the buffer protocol
+        """
+        for fragment in self._fragmenter.fragment(data):
+            self._transport.sendto(fragment, address)
+
+    def getsockname(self) -> tuple[str, int]:
+        return self._transport.get_extra_info("sockname")
+
+    def set_tos(self, tos: int) -> None:
+        """
+        Sets the current TOS value used for outbound packets
+        """
+        self._transport.get_extra_info("socket").setsockopt(IPPROTO_IP, IP_TOS, tos)
+
+    def get_tos(self) -> int:
+        """
+        Returns the current TOS value used for outbound packets
+        """
+        return self._transport.get_extra_info("socket").getsockopt(IPPROTO_IP, IP_TOS)
+
+    def get_mtu(self) -> int:
+        """
+        Returns the MTU used by this socket
+        """
+        return self._mtu
+
+    def get_mss(self) -> int:
+        """
+        Returns the maximum amount of payload that can be sent with each fragment (see MiddlewareUnreliable.get_mss)
+        """
+        return self._fragmenter.max_frag_payload
+
+    def get_max_payload_size(self) -> int:
+        """
+        Returns the maximum payload size than can be sent with a single datagram (single call to sendto)
+        """
+        return self._fragmenter.max_dgram_payload
+
+    def close(self) -> None:
+        """Closes the transport, pending recvfrom calls raise ConnectionAbortedError"""
+        self._transport.close()
+
+
+async def open_unreliable_endpoint(
+    address: Optional[tuple[str, int]] = None,
+    mtu: int = _config.mtu,
+    **kwargs,
+) -> AsyncMiddlewareUnreliable:
+    """
+    Creates an AsyncMiddlewareUnreliable bound to address (an ephemeral port if None). Keyword arguments are
+    passed on to AsyncMiddlewareUnreliable
+    """
+    endpoint = AsyncMiddlewareUnreliable(mtu, **kwargs)
+    socko = socket(AF_INET, SOCK_DGRAM)
+    try:
+        # NOTE: Bound right away, so that getsockname returns the ephemeral port before anything is sent
+        socko.bind(address if address != None else ("", 0))
+        socko.setblocking(False)
+        (
+            endpoint._transport,
+            _,
+        ) = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _UnreliableProtocol(endpoint), sock=socko
+        )
+    except BaseException:
+        socko.close()
+        raise
+    return endpoint
@@ -0,0 +1,518 @@
+from socket import *
+from typing import Optional
+import middleware.framing.framing as _framing
+from middleware.middlewareAPI import MiddlewareReliable
+import collections
+import struct
+import sys
+import threading
+
+# NOTE: Every frame is sent as a length-prefixed message (see framing), starting with its type, flags and stream id
+FRAME_HEADER = struct.Struct("!BBI")
+FRAME_DATA = 0
+FRAME_WINDOW_UPDATE = 1  # The peer may send the increment more bytes on the stream
+FRAME_SETTINGS = 2  # Sent once per connection: the initial window of every stream, for data sent to its sender
+FLAG_END = 0x01  # Last frame of the stream in this direction
+WINDOW_FIELD = struct.Struct("!I")
+# NOTE: Every stream starts with this send window until the SETTINGS of the peer arrive
+INITIAL_WINDOW = 2**16
+DEFAULT_WINDOW = 2**18
+MAX_WINDOW = 2**31 - 1
+MAX_FRAME_SIZE = 2**24
+# NOTE: Also the TCP_NOTSENT_LOWAT of the connection. Chunks of a few MSS cost more CPU per byte than they save in
+#       latency: with 64 KiB chunks, an urgent message still only waits for about one chunk on a fast link
+DEFAULT_CHUNK_SIZE = 2**16
+MAX_STREAM_ID = 2**32 - 1
+DEFAULT_PRIORITY = 0
+DEFAULT_WEIGHT = 16
+# NOTE: Linux TCP_NOTSENT_LOWAT, limits the bytes queued in the kernel that have not been sent yet
+TCP_NOTSENT_LOWAT = 25
+
+
+class StreamScheduler:
+    """
+    Picks the stream that sends the next chunk: streams of the most urgent priority (the lowest value) always go
+    first, and streams of the same priority share the connection in proportion to their weight (start-time fair
+    queuing, each stream is charged size / weight of virtual time per chunk sent)
+    """
+
+    _finish: dict[int, float]  # Virtual time a stream has used up its share at
+    _virtual_time: dict[int, float]  # Virtual time of the last stream picked
+
+    def __init__(self):
+        self._finish = {}
+        self._virtual_time = {}
+
+    def select(self, ready: list) -> Optional["Stream"]:
+        """
+        Returns the stream of ready (streams with something to send) that sends next, or None if ready is empty
+        """
+        if len(ready) == 0:
+            return None
+        priority = min(stream.priority for stream in ready)
+        virtual_time = self._virtual_time.get(priority, 0.0)
+        selected = None
+        for stream in ready:
+            if stream.priority != priority:
+                continue
+            # NOTE: A stream that had nothing to send does not save up its share for later
+            finish = max(self._finish.get(stream.stream_id, 0.0), virtual_time)
+            self._finish[stream.stream_id] = finish
+            if selected == None or finish < self._finish[selected.stream_id]:
+                selected = stream
+        self._virtual_time[priority] = self._finish[selected.stream_id]
+        return selected
+
+    def charge(self, stream: "Stream", size: int) -> None:
+        """
+        Accounts for size bytes sent by stream
+        """
+        self._finish[stream.stream_id] = (
+            self._finish.get(stream.stream_id, 0.0) + size / stream.weight
+        )
+
+    def forget(self, stream_id: int) -> None:
+        self._finish.pop(stream_id, None)
+
+
+class Stream:
+    """
+    A logical byte stream of a Multiplexer, in both directions, with its own priority, weight and flow control
+    """
+
+    stream_id: int
+    priority: int
+    weight: int
+    timeout: Optional[float]  # For recv, None blocks
+    _mux: "Multiplexer"
+    _send_queue: collections.deque  # memoryviews written with sendall and not sent yet
+    _queued: int  # Bytes written with sendall in total
+    _sent: int  # Bytes sent in total
+    _send_window: int  # Bytes the peer accepts before its next WINDOW_UPDATE
+    _send_closed: bool  # close was called, the end of the stream is sent after the data queued
+    _end_sent: bool
+    _received: collections.deque  # memoryviews received and not read yet
+    _received_size: int
+    _recv_window: int  # Bytes the peer may still send
+    _consumed: int  # Bytes read since the last WINDOW_UPDATE sent
+    _end_received: bool
+
+    def __init__(
+        self,
+        mux: "Multiplexer",
+        stream_id: int,
+        priority: int,
+        weight: int,
+        send_window: int,
+    ):
+        self.stream_id = stream_id
+        self.set_priority(priority, weight)
+        self.timeout = None
+        self._mux = mux
+        self._send_queue = collections.deque()
+        self._queued = 0
+        self._sent = 0
+        self._send_window = send_window
+        self._send_closed = False
+        self._end_sent = False
+        self._received = collections.deque()
+        self._received_size = 0
+        self._recv_window = mux.window
+        self._consumed = 0
+        self._end_received = False
+
+    def set_priority(self, priority: int, weight: int = DEFAULT_WEIGHT) -> None:
+        """
+        Sets the priority (0 is the most urgent) and the weight (share of the connection among streams of the same
+        priority) of the data sent on the stream
+        """
+        if priority < 0 or weight < 1:
+            raise ValueError("Priority must be at least 0 and weight at least 1")
+        self.priority = priority
+        self.weight = weight
+
+    def settimeout(self, timeout_s: Optional[float]) -> None:
+        """
+        Sets the timeout of recv, None blocks until data arrives
+        """
+        self.timeout = timeout_s
+
+    def gettimeout(self) -> Optional[float]:
+        return self.timeout
+
+    def sendall(self, data) -> None:
+        """
+        Sends all of data (any object supporting the buffer protocol), interleaved with the other streams in chunks.
+        data is not copied, this returns once all of it has been written to the connection. Blocks while the peer has
+        not read earlier data on the stream (flow control)
+        """
+        data = memoryview(data).cast("B")
+        mux = self._mux
+        with mux._condition:
+            mux._check_open()
+            if self._send_closed:
+                raise BrokenPipeError("Stream was closed for sending")
+            if len(data) == 0:
+                return
+            self._send_queue.append(data)
+            self._queued += len(data)
+            end = self._queued
+            mux._condition.notify_all()
+            mux._condition.wait_for(lambda: self._sent >= end or mux._error != None)
+            if self._sent < end:
+                mux._check_open()
+
+    def recv(self, buffer_size: int) -> bytes:
+        """
+        Returns up to buffer_size bytes received on the stream, waiting for data according to the timeout. Returns b""
+        once the peer has closed the stream and everything was read. Raises ConnectionError if the connection failed
+        before that
+        """
+        mux = self._mux
+        with mux._condition:
+            ready = mux._condition.wait_for(
+                lambda: self._received_size > 0
+                or self._end_received
+                or mux._error != None,
+                self.timeout,
+            )
+            if not ready:
+                raise TimeoutError("Timed out waiting for data on the stream")
+            if self._received_size == 0:
+                if self._end_received:
+                    return b""
+                mux._check_open()
+
+            chunks = []
+            size = 0
+            while self._received and size < buffer_size:
+                chunk = self._received.popleft()
+                if size + len(chunk) > buffer_size:
+                    self._received.appendleft(chunk[buffer_size - size :])
+                    chunk = chunk[: buffer_size - size]
+                chunks.append(chunk)
+                size += len(chunk)
+            self._received_size -= size
+            self._consumed += size
+            # NOTE: Credit is returned in batches of half the window, not for every read
+            if self._consumed >= mux.window // 2 and not self._end_received:
+                mux._queue_frame(
+                    FRAME_WINDOW_UPDATE,
+                    0,
+                    self.stream_id,
+                    [WINDOW_FIELD.pack(self._consumed)],
+                )
+                self._recv_window += self._consumed
+                self._consumed = 0
+            return b"".join(chunks)
+
+    def close(self) -> None:
+        """
+        Closes the stream for sending, the peer receives b"" after the data sent before. Data can still be received
+        """
+        with self._mux._condition:
+            if not self._send_closed:
+                self._send_closed = True
+                self._mux._condition.notify_all()
+
+    def _sendable(self) -> bool:
+        if len(self._send_queue) > 0:
+            return self._send_window > 0
+        return self._send_closed and not self._end_sent
+
+
+class Multiplexer:
+    """
+    Carries many logical streams over one MiddlewareReliable connection, both ends of which must be wrapped in a
+    Multiplexer. A writer thread sends the data written to the streams in chunks of at most chunk_size bytes,
+    interleaved by priority and weight (see StreamScheduler), so that a large transfer delays an urgent message by
+    about a chunk instead of the whole transfer. Every stream has its own flow control window of window bytes, so a
+    stream whose reader falls behind stops being sent without holding up the others. A reader thread receives for all
+    streams, the connection must not be used directly any more
+    """
+
+    chunk_size: int
+    window: int  # Bytes buffered per stream for data received and not read yet
+    _conn: MiddlewareReliable
+    _condition: threading.Condition
+    _streams: dict[int, Stream]
+    _accept_queue: collections.deque  # Streams opened by the peer, not returned by accept_stream yet
+    _control: collections.deque  # Frames sent before any data (window updates, settings and ends)
+    _scheduler: StreamScheduler
+    _peer_window: int  # Initial send window of new streams
+    _error: Optional[Exception]  # Why the connection can not be used any more
+    _closing: bool
+    _writer: threading.Thread
+    _reader: threading.Thread
+
+    def __init__(
+        self,
+        conn: MiddlewareReliable,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        window: int = DEFAULT_WINDOW,
+    ):
+        """
+        Smaller chunks delay urgent data less on slow links, larger ones cost less CPU per byte. window must be at
+        least INITIAL_WINDOW
+        """
+        if window < INITIAL_WINDOW or window > MAX_WINDOW:
+            raise ValueError(
+                "Window must be between {} and {} bytes".format(
+                    INITIAL_WINDOW, MAX_WINDOW
+                )
+            )
+        self.chunk_size = chunk_size
+        if self.chunk_size < 1 or self.chunk_size > MAX_FRAME_SIZE:
+            raise ValueError(
+                "Chunk size must be between 1 and {} bytes".format(MAX_FRAME_SIZE)
+            )
+        self.window = window
+        self._conn = conn
+        self._condition = threading.Condition()
+        self._streams = {}
+        self._accept_queue = collections.deque()
+        self._control = collections.deque()
+        self._scheduler = StreamScheduler()
+        self._peer_window = INITIAL_WINDOW
+        self._error = None
+        self._closing = False
+
+        conn.settimeout(None)
+        if sys.platform == "linux":
+            # NOTE: Keeps about a chunk of unsent data in the kernel, so the next chunk is picked when it is about to
+            #       be sent. Otherwise a transfer fills the socket buffer, and an urgent message waits behind all of it
+            try:
+                conn._socko.setsockopt(IPPROTO_TCP, TCP_NOTSENT_LOWAT, self.chunk_size)
+            except OSError:
+                pass
+        self._control.append(
+            self._frame(FRAME_SETTINGS, 0, 0, [WINDOW_FIELD.pack(window)])
+        )
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._writer.start()
+        self._reader.start()
+
+    def open_stream(
+        self,
+        stream_id: int,
+        priority: int = DEFAULT_PRIORITY,
+        weight: int = DEFAULT_WEIGHT,
+    ) -> Stream:
+        """
+        Returns the stream with stream_id (0 to 2**32 - 1, chosen by the application, e.g. one per traffic class),
+        with the given priority and weight. Streams are opened by both ends implicitly: the stream is created unless
+        it is already open, e.g. because the peer sent on it first
+        """
+        if stream_id < 0 or stream_id > MAX_STREAM_ID:
+            raise ValueError("Stream id must be between 0 and {}".format(MAX_STREAM_ID))
+        with self._condition:
+            self._check_open()
+            stream = self._streams.get(stream_id)
+            if stream == None:
+                return self._open_locked(stream_id, priority, weight)
+            if stream in self._accept_queue:
+                self._accept_queue.remove(stream)
+            stream.set_priority(priority, weight)
+            return stream
+
+    def accept_stream(self, timeout: Optional[float] = None) -> Stream:
+        """
+        Returns the next stream opened by the peer (and not with open_stream locally), with the default priority and
+        weight. Raises TimeoutError if there is none within timeout seconds
+        """
+        with self._condition:
+            ready = self._condition.wait_for(
+                lambda: len(self._accept_queue) > 0 or self._error != None, timeout
+            )
+            if not ready:
+                raise TimeoutError("Timed out waiting for a stream")
+            if len(self._accept_queue) == 0:
+                self._check_open()
+            return self._accept_queue.popleft()
+
+    def close(self) -> None:
+        """
+        Sends what is left to send (except data blocked by flow control) and closes the connection
+        """
+        with self._condition:
+            if self._closing:
+                return
+            self._closing = True
+            self._condition.notify_all()
+        self._writer.join()
+        with self._condition:
+            if self._error == None:
+                self._error = ConnectionError("Multiplexer was closed")
+            self._condition.notify_all()
+        try:
+            self._conn._socko.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+        self._reader.join()
+        self._conn.close()
+
+    def _check_open(self) -> None:
+        """
+        Raises ConnectionError if the connection can not be used any more. Called with the lock held
+        """
+        if self._error != None:
+            raise ConnectionError(
+                "Multiplexed connection failed: {}".format(self._error)
+            )
+
+    def _open_locked(self, stream_id: int, priority: int, weight: int) -> Stream:
+        stream = Stream(self, stream_id, priority, weight, self._peer_window)
+        self._streams[stream_id] = stream
+        return stream
+
+    def _forget_locked(self, stream: Stream) -> None:
+        """
+        Drops a stream once it has ended in both directions, its id can be opened again
+        """
+        if stream._end_sent and stream._end_received:
+            if self._streams.get(stream.stream_id) is stream:
+                del self._streams[stream.stream_id]
+            self._scheduler.forget(stream.stream_id)
+
+    def _queue_frame(
+        self, kind: int, flags: int, stream_id: int, payload: list
+    ) -> None:
+        """
+        Queues a frame to be sent before any data. Called with the lock held
+        """
+        self._control.append(self._frame(kind, flags, stream_id, payload))
+        self._condition.notify_all()
+
+    def _frame(self, kind: int, flags: int, stream_id: int, payload: list) -> list:
+        """
+        Returns the buffers of a frame
+        """
+        size = FRAME_HEADER.size + sum(len(buffer) for buffer in payload)
+        return [
+            _framing.MESSAGE_LENGTH.pack(size),
+            FRAME_HEADER.pack(kind, flags, stream_id),
+        ] + payload
+
+    def _next_frame_locked(self) -> tuple[Optional[list], Optional[Stream], int]:
+        """
+        Returns the buffers of the next frame to send, the stream and the number of bytes of its data they carry, or
+        None if there is nothing to send
+        """
+        if len(self._control) > 0:
+            return self._control.popleft(), None, 0
+
+        ready = [stream for stream in self._streams.values() if stream._sendable()]
+        stream = self._scheduler.select(ready)
+        if stream == None:
+            return None, None, 0
+
+        payload = []
+        size = 0
+        limit = min(self.chunk_size, stream._send_window)
+        while stream._send_queue and size < limit:
+            data = stream._send_queue.popleft()
+            if size + len(data) > limit:
+                stream._send_queue.appendleft(data[limit - size :])
+                data = data[: limit - size]
+            payload.append(data)
+            size += len(data)
+        stream._send_window -= size
+        self._scheduler.charge(stream, max(size, 1))
+
+        flags = 0
+        if stream._send_closed and len(stream._send_queue) == 0:
+            flags = FLAG_END
+            stream._end_sent = True
+            self._forget_locked(stream)
+        return self._frame(FRAME_DATA, flags, stream.stream_id, payload), stream, size
+
+    def _write_loop(self) -> None:
+        unflushed = False
+        try:
+            while True:
+                with self._condition:
+                    frame, stream, size = self._next_frame_locked()
+                    while frame == None and not unflushed:
+                        if self._closing or self._error != None:
+                            return
+                        self._condition.wait()
+                        frame, stream, size = self._next_frame_locked()
+
+                if frame == None:
+                    # NOTE: Nothing left to send for now, writes held by the write mode of the connection go out
+                    self._conn.flush()
+                    unflushed = False
+                    continue
+                self._conn._coalescer.send_buffers(frame)
+                unflushed = True
+                if stream != None:
+                    with self._condition:
+                        stream._sent += size
+                        self._condition.notify_all()
+        except OSError as e:
+            with self._condition:
+                if self._error == None:
+                    self._error = e
+                self._condition.notify_all()
+
+    def _read_loop(self) -> None:
+        reader = _framing.MessageReader()
+        try:
+            while True:
+                frame = reader.read(
+                    self._conn._socko, FRAME_HEADER.size + MAX_FRAME_SIZE
+                )
+                if frame == None:
+                    raise ConnectionError("Connection closed by the peer")
+                if len(frame) < FRAME_HEADER.size:
+                    raise ValueError(
+                        "Frame of {} bytes is too short".format(len(frame))
+                    )
+                kind, flags, stream_id = FRAME_HEADER.unpack_from(frame)
+                payload = memoryview(frame)[FRAME_HEADER.size :]
+                with self._condition:
+                    if kind == FRAME_DATA:
+                        self._receive_data_locked(stream_id, flags, payload)
+                    elif kind == FRAME_WINDOW_UPDATE:
+                        (increment,) = WINDOW_FIELD.unpack(payload)
+                        # NOTE: Updates for streams that have ended are of no use any more
+                        stream = self._streams.get(stream_id)
+                        if stream != None:
+                            stream._send_window += increment
+                    elif kind == FRAME_SETTINGS:
+                        (window,) = WINDOW_FIELD.unpack(payload)
+                        for stream in self._streams.values():
+                            stream._send_window += window - self._peer_window
+                        self._peer_window = window
+                    # NOTE: Unknown frame types are ignored, for newer peers
+                    self._condition.notify_all()
+        except (OSError, ValueError, struct.error) as e:
+            with self._condition:
+                if self._error == None:
+                    self._error = e
+                self._condition.notify_all()
+
+    def _receive_data_locked(
+        self, stream_id: int, flags: int, payload: memoryview
+    ) -> None:
+        stream = self._streams.get(stream_id)
+        if stream == None:
+            stream = self._open_locked(stream_id, DEFAULT_PRIORITY, DEFAULT_WEIGHT)
+            self._accept_queue.append(stream)
+        if stream._end_received:
+            raise ValueError(
+                "Data received after the end of stream {}".format(stream_id)
+            )
+        if len(payload) > stream._recv_window:
+            raise ValueError(
+                "Stream {} exceeded its flow control window".format(stream_id)
+            )
+
+        stream._recv_window -= len(payload)
+        if len(payload) > 0:
+            stream._received.append(payload)
+            stream._received_size += len(payload)
+        if flags & FLAG_END:
+            stream._end_received = True
+            self._forget_locked(stream)
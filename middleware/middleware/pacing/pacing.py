@@ -0,0 +1,130 @@
+from typing import Optional
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Allows rate bytes per second on average, in bursts of at most burst bytes. A packet is allowed once the bucket
+    holds enough tokens for it (or is full, for packets larger than burst), and its size is then taken from the
+    bucket, which may leave it in debt
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    rate: float
+    burst: float
+    tokens: float
+    updated: float  # time.monotonic of the last refill
+
+    def __init__(self, rate: float, burst: float):
+        if rate <= 0 or burst <= 0:
+            raise ValueError("Pacing rate and burst must be positive")
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, size: int, now: float) -> float:
+        """
+        Returns the number of seconds until a packet of size bytes is allowed, 0 if it is allowed now
+        """
+        self._refill(now)
+        missing = min(size, self.burst) - self.tokens
+        return max(missing / self.rate, 0.0)
+
+    def take(self, size: int) -> None:
+        self.tokens -= size
+
+
+class Pacer:
+    """
+    Token bucket pacing for the packets sent by a socket: an optional bucket for all packets, and optional buckets for
+    the packets to each destination. A packet is only allowed when every bucket that applies to it allows it.
+    Thread-safe, as packets can be sent by the deadline scheduler thread (aggregation) and the socket's users at once
+    """
+
+    socket_bucket: Optional[TokenBucket]
+    destination_buckets: dict[tuple[str, int], TokenBucket]
+    lock: threading.Lock
+
+    def __init__(self):
+        self.socket_bucket = None
+        self.destination_buckets = {}
+        self.lock = threading.Lock()
+
+    def set_rate(
+        self, rate: float, burst: float, address: Optional[tuple[str, int]] = None
+    ) -> None:
+        """
+        Limits the packets sent to address (all packets if address is None) to rate bytes per second, in bursts of at
+        most burst bytes. A rate of 0 removes the limit
+        """
+        bucket = TokenBucket(rate, burst) if rate > 0 else None
+        with self.lock:
+            if address == None:
+                self.socket_bucket = bucket
+            elif bucket == None:
+                self.destination_buckets.pop(address, None)
+            else:
+                self.destination_buckets[address] = bucket
+
+    def is_active(self, address: tuple[str, int]) -> bool:
+        """
+        Returns True if any bucket applies to the packets sent to address
+        """
+        return self.socket_bucket != None or address in self.destination_buckets
+
+    def _buckets(self, address: tuple[str, int]) -> list[TokenBucket]:
+        buckets = [self.destination_buckets.get(address), self.socket_bucket]
+        return [bucket for bucket in buckets if bucket != None]
+
+    def delay(self, address: tuple[str, int], size: int) -> float:
+        """
+        Returns the number of seconds until a packet of size bytes to address is allowed, 0 if it is allowed now
+        """
+        with self.lock:
+            return self._delay(address, size)
+
+    def _delay(self, address: tuple[str, int], size: int) -> float:
+        now = time.monotonic()
+        return max(
+            [bucket.delay(size, now) for bucket in self._buckets(address)], default=0.0
+        )
+
+    def take(self, address: tuple[str, int], sizes: list[int]) -> int:
+        """
+        Takes the tokens for as many of the packets (by size, in order) to address as are allowed now, and returns
+        how many that is
+        """
+        with self.lock:
+            buckets = self._buckets(address)
+            now = time.monotonic()
+            for count, size in enumerate(sizes):
+                if any(bucket.delay(size, now) > 0 for bucket in buckets):
+                    return count
+                for bucket in buckets:
+                    bucket.take(size)
+            return len(sizes)
+
+    def take_all(self, address: tuple[str, int], sizes: list[int]) -> float:
+        """
+        Takes the tokens for all of the packets (by size) to address at once if they are allowed now, and returns 0.
+        Else nothing is taken, and the number of seconds until they are allowed is returned. Raises ValueError if
+        several packets add up to more than the burst of a bucket, as they could never be sent back to back
+        """
+        size = sum(sizes)
+        with self.lock:
+            buckets = self._buckets(address)
+            if len(sizes) > 1 and any(size > bucket.burst for bucket in buckets):
+                raise ValueError("Packets exceed the pacing burst")
+
+            delay = self._delay(address, size)
+            if delay == 0:
+                for bucket in buckets:
+                    bucket.take(size)
+            return delay
@@ -0,0 +1,115 @@
+from socket import *
+from middleware.configuration.config import config as _config
+from typing import Optional
+import sys
+import threading
+import time
+
+# NOTE: Linux socket options. With IP_PMTUDISC_DO, packets are sent with the don't fragment bit set: the kernel never
+#       fragments them, routers drop packets larger than their link MTU and report their MTU with an ICMP
+#       "fragmentation needed" message, which lowers the path MTU of the route. Sends larger than the known path MTU
+#       fail with EMSGSIZE. IP_MTU reads the path MTU of the destination of a connected socket
+IP_MTU_DISCOVER = 10
+IP_PMTUDISC_DO = 2
+IP_MTU = 14
+PMTU_AVAILABLE = sys.platform == "linux"
+
+
+class PathMtuCache:
+    """
+    Path MTUs per destination host, shared by all sockets. Every entry expires after expiry seconds, after which the
+    path MTU is read from the kernel again, so that a path whose MTU has grown back is used fully again
+    """
+
+    expiry: float
+    _entries: dict[
+        str, tuple[int, float]
+    ]  # Path MTU and the time.monotonic it expires at, by host
+    _lock: threading.Lock
+
+    def __init__(self, expiry: float = _config.pmtu_expiry):
+        self.expiry = expiry
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str) -> Optional[int]:
+        """
+        Returns the path MTU cached for host, or None if there is none or it has expired
+        """
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry == None:
+                return None
+            mtu, expires = entry
+            if time.monotonic() >= expires:
+                del self._entries[host]
+                return None
+            return mtu
+
+    def set(self, host: str, mtu: int) -> None:
+        with self._lock:
+            self._entries[host] = (mtu, time.monotonic() + self.expiry)
+
+    def invalidate(self, host: str) -> None:
+        """
+        Drops the path MTU cached for host, e.g. after a send failed because it was too large
+        """
+        with self._lock:
+            self._entries.pop(host, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+path_mtu_cache = PathMtuCache()
+
+
+def enable_discovery(sock: socket) -> bool:
+    """
+    Enables path MTU discovery on sock (IP_PMTUDISC_DO), returns False where it is not supported
+    """
+    if not PMTU_AVAILABLE:
+        return False
+    try:
+        sock.setsockopt(IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+        return True
+    except OSError:
+        return False
+
+
+def connected_path_mtu(sock: socket) -> Optional[int]:
+    """
+    Returns the path MTU of the destination of a connected socket, or None where it is not supported
+    """
+    if not PMTU_AVAILABLE:
+        return None
+    try:
+        return sock.getsockopt(IPPROTO_IP, IP_MTU)
+    except OSError:
+        return None
+
+
+def path_mtu(address: tuple[str, int], refresh: bool = False) -> Optional[int]:
+    """
+    Returns the path MTU to address from the cache, or from the kernel if it is not cached (or refresh is set):
+    the MTU of the route, lowered by the ICMP messages received for it. Returns None where it is not supported
+    """
+    host = address[0]
+    if not refresh:
+        mtu = path_mtu_cache.get(host)
+        if mtu != None:
+            return mtu
+    if not PMTU_AVAILABLE:
+        return None
+
+    try:
+        # NOTE: Connecting a UDP socket only looks up the route, nothing is sent
+        with socket(AF_INET, SOCK_DGRAM) as probe:
+            probe.setsockopt(IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+            probe.connect(address)
+            mtu = probe.getsockopt(IPPROTO_IP, IP_MTU)
+    except OSError:
+        return None
+    path_mtu_cache.set(host, mtu)
+    return mtu
@@ -0,0 +1,288 @@
+from socket import *
+from middleware.configuration.config import config as _config
+from middleware.middlewareAPI import MiddlewareReliable
+from typing import Optional
+import collections
+import contextlib
+import select
+import threading
+import time
+
+
+class _IdleConnection:
+    __slots__ = ("conn", "idle_since")
+
+    conn: MiddlewareReliable
+    idle_since: float  # time.monotonic the connection was checked in
+
+    def __init__(self, conn: MiddlewareReliable, idle_since: float):
+        self.conn = conn
+        self.idle_since = idle_since
+
+
+def _is_healthy(conn: MiddlewareReliable) -> bool:
+    """
+    Returns whether an idle connection can still be used: it has no pending socket error and nothing to read, as
+    anything readable on an idle connection is either the peer closing it or data nobody asked for
+    """
+    sock = conn._socko
+    if sock.fileno() == -1:
+        return False
+    try:
+        if sock.getsockopt(SOL_SOCKET, SO_ERROR) != 0:
+            return False
+        if hasattr(select, "poll"):
+            poller = select.poll()
+            poller.register(sock, select.POLLIN | select.POLLERR | select.POLLHUP)
+            return len(poller.poll(0)) == 0
+        readable, _, _ = select.select([sock], [], [], 0)
+        return len(readable) == 0
+    except OSError:
+        return False
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of client MiddlewareReliable connections, keyed by destination address, MTU, TOS and congestion
+    algorithm, so that short exchanges do not pay the TCP handshake for every request. Connections are created with
+    the socket options of their key (and the MiddlewareReliable options given to the pool) already applied.
+    Idle connections are health checked on checkout and closed once idle for longer than idle_timeout
+    """
+
+    max_size: int  # Open connections per key, checked out or idle
+    max_idle: int  # Idle connections kept per key
+    idle_timeout: float
+    connect_timeout: Optional[float]
+    options: dict  # Keyword arguments for MiddlewareReliable
+    connections_opened: int
+    connections_reused: int
+    _lock: threading.Lock
+    # NOTE: Notified when a connection is closed or checked in, all waiters are woken as they may wait for other keys
+    _released: threading.Condition
+    _idle: dict[
+        tuple, collections.deque
+    ]  # Idle connections of a key, the most recently checked in last
+    _open: collections.Counter  # Open connections of a key
+    _checked_out: dict[int, tuple]  # Key of every checked out connection, by id
+    _closed: bool
+
+    def __init__(
+        self,
+        max_size: int = _config.pool_max_size,
+        max_idle: int = _config.pool_max_idle,
+        idle_timeout: float = _config.pool_idle_timeout,
+        connect_timeout: Optional[float] = None,
+        **options,
+    ):
+        """
+        options are passed on to every MiddlewareReliable created (e.g. write_mode). connect_timeout limits the
+        connection handshake, None waits as long as the kernel does
+        """
+        if max_size < 1 or max_idle < 0:
+            raise ValueError("max_size must be at least 1 and max_idle at least 0")
+
+        self.max_size = max_size
+        self.max_idle = min(max_idle, max_size)
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.options = options
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._idle = {}
+        self._open = collections.Counter()
+        self._checked_out = {}
+        self._closed = False
+
+    def checkout(
+        self,
+        address: tuple[str, int],
+        mtu: int = _config.mtu,
+        tos: int = 0,
+        congestion_algorithm: str = _config.congestion_algorithm,
+        timeout: Optional[float] = None,
+    ) -> MiddlewareReliable:
+        """
+        Returns a connected MiddlewareReliable for address with the given MTU, TOS and congestion algorithm, reusing
+        an idle one if possible. If max_size connections of that key are checked out, waits for one to be returned,
+        for at most timeout seconds (forever if None) before raising TimeoutError. The connection must be given back
+        with checkin, or discard if its state is unknown (e.g. after an error)
+        """
+        key = (address, mtu, tos, congestion_algorithm)
+        deadline = None if timeout == None else time.monotonic() + timeout
+        unhealthy = []
+        conn = None
+        try:
+            with self._lock:
+                while True:
+                    if self._closed:
+                        raise ValueError("Connection pool is closed")
+                    unhealthy += self._evict_idle_locked(time.monotonic())
+                    idle = self._idle.get(key)
+                    while idle and conn == None:
+                        candidate = idle.pop().conn
+                        if _is_healthy(candidate):
+                            conn = candidate
+                        else:
+                            self._open[key] -= 1
+                            unhealthy.append(candidate)
+                    if conn != None:
+                        self.connections_reused += 1
+                        self._checked_out[id(conn)] = key
+                        return conn
+                    if self._open[key] < self.max_size:
+                        # NOTE: The slot is reserved before connecting, the handshake happens outside the lock
+                        self._open[key] += 1
+                        break
+                    remaining = (
+                        None if deadline == None else deadline - time.monotonic()
+                    )
+                    if remaining != None and remaining <= 0:
+                        raise TimeoutError(
+                            "No connection to {} available within the timeout".format(
+                                address
+                            )
+                        )
+                    self._released.wait(remaining)
+        finally:
+            for candidate in unhealthy:
+                candidate.close()
+        return self._connect(key)
+
+    def _connect(self, key: tuple) -> MiddlewareReliable:
+        address, mtu, tos, congestion_algorithm = key
+        conn = None
+        try:
+            conn = MiddlewareReliable(
+                mtu, congestion_algorithm=congestion_algorithm, **self.options
+            )
+            conn.set_tos(tos)
+            conn.settimeout(self.connect_timeout)
+            conn.connect(address)
+            conn.settimeout(None)
+        except BaseException:
+            if conn != None:
+                conn.close()
+            self._release(key)
+            raise
+
+        with self._lock:
+            self.connections_opened += 1
+            self._checked_out[id(conn)] = key
+        return conn
+
+    def checkin(self, conn: MiddlewareReliable) -> None:
+        """
+        Returns a connection taken with checkout to the pool. Writes still held by the write mode are sent first.
+        The connection is closed instead if it has unread data, is not healthy, or max_idle connections of its key
+        are already idle
+        """
+        with self._lock:
+            key = self._checked_out.pop(id(conn), None)
+        if key == None:
+            raise ValueError("Connection was not checked out from this pool")
+
+        keep = False
+        try:
+            conn.flush()
+            # NOTE: Restores the options of the key, which may have been changed while checked out
+            conn.set_tos(key[2])
+            conn.settimeout(None)
+            keep = (
+                conn._message_reader == None or conn._message_reader.pending() == 0
+            ) and _is_healthy(conn)
+        except OSError:
+            pass
+
+        if keep:
+            with self._lock:
+                idle = self._idle.setdefault(key, collections.deque())
+                if not self._closed and len(idle) < self.max_idle:
+                    idle.append(_IdleConnection(conn, time.monotonic()))
+                    self._released.notify_all()
+                    return
+        conn.close()
+        self._release(key)
+
+    def discard(self, conn: MiddlewareReliable) -> None:
+        """
+        Closes a connection taken with checkout instead of returning it to the pool
+        """
+        with self._lock:
+            key = self._checked_out.pop(id(conn), None)
+        if key == None:
+            raise ValueError("Connection was not checked out from this pool")
+        conn.close()
+        self._release(key)
+
+    @contextlib.contextmanager
+    def connection(
+        self,
+        address: tuple[str, int],
+        mtu: int = _config.mtu,
+        tos: int = 0,
+        congestion_algorithm: str = _config.congestion_algorithm,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Context manager checking out a connection (see checkout), which is checked in on exit, or discarded if the
+        block raised an exception
+        """
+        conn = self.checkout(address, mtu, tos, congestion_algorithm, timeout)
+        try:
+            yield conn
+        except BaseException:
+            self.discard(conn)
+            raise
+        self.checkin(conn)
+
+    def evict_idle(self) -> int:
+        """
+        Closes the connections idle for longer than idle_timeout, and returns how many were closed. This also happens
+        on every checkout
+        """
+        with self._lock:
+            evicted = self._evict_idle_locked(time.monotonic())
+        for conn in evicted:
+            conn.close()
+        return len(evicted)
+
+    def _evict_idle_locked(self, now: float) -> list:
+        """
+        Removes the idle connections past idle_timeout and returns them, to be closed outside the lock
+        """
+        evicted = []
+        for key, idle in self._idle.items():
+            while idle and now - idle[0].idle_since > self.idle_timeout:
+                evicted.append(idle.popleft().conn)
+                self._open[key] -= 1
+        if len(evicted) > 0:
+            self._released.notify_all()
+        return evicted
+
+    def _release(self, key: tuple) -> None:
+        with self._lock:
+            self._open[key] -= 1
+            self._released.notify_all()
+
+    def idle_count(self) -> int:
+        """
+        Returns the number of idle connections in the pool
+        """
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values())
+
+    def close(self) -> None:
+        """
+        Closes every idle connection. Connections checked out are closed when they are checked in
+        """
+        with self._lock:
+            self._closed = True
+            idle = [entry.conn for queue in self._idle.values() for entry in queue]
+            for key, queue in self._idle.items():
+                self._open[key] -= len(queue)
+                queue.clear()
+            self._released.notify_all()
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,45 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class DeadlineScheduler:
+    """
+    A single background thread calling _expire(deadline) on the objects whose deadline (time.monotonic) has passed.
+    Shared by the write coalescing of MiddlewareReliable (releasing corks once max_delay has passed) and the
+    aggregation of MiddlewareUnreliable (sending held datagrams once their hold time has passed). Starting a timer
+    thread per corked write or held datagram would cost more than the write
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.deadlines = []  # Heap of (deadline, sequence number, target)
+        self.sequence = itertools.count()
+        self.thread = None
+
+    def schedule(self, target, deadline: float) -> None:
+        with self.condition:
+            heapq.heappush(self.deadlines, (deadline, next(self.sequence), target))
+            if self.thread == None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            elif self.deadlines[0][2] is target:
+                self.condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                while len(self.deadlines) == 0:
+                    self.condition.wait()
+                deadline, _, target = self.deadlines[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.deadlines)
+            # NOTE: Outside of the scheduler lock, which is never held together with the lock of a target
+            target._expire(deadline)
+
+
+deadline_scheduler = DeadlineScheduler()
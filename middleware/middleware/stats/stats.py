@@ -0,0 +1,266 @@
+from socket import *
+from middleware.configuration.config import config as _config
+from typing import Optional, TextIO
+import collections
+import csv
+import struct
+import sys
+import threading
+import time
+
+# NOTE: Layout of the Linux struct tcp_info (include/uapi/linux/tcp.h) up to tcpi_snd_wnd (Linux 5.4). Older kernels
+#       return a shorter struct, the fields they do not know are decoded as 0. The 7th byte holds the bit fields
+#       snd_wscale:4, rcv_wscale:4 and the 8th delivery_rate_app_limited:1, fastopen_client_fail:2
+_TCP_INFO = struct.Struct("=8B24I4Q2I4IQ3Q2I2Q2I2I")
+STATS_AVAILABLE = sys.platform == "linux"
+
+
+class TcpInfo:
+    """
+    The TCP_INFO statistics of a connection at one point in time, as reported by `ss -ti`. Times are in microseconds,
+    rates in bytes per second
+    """
+
+    __slots__ = (
+        "timestamp",
+        "state",
+        "ca_state",
+        "retransmits",
+        "probes",
+        "backoff",
+        "rto",
+        "snd_mss",
+        "rcv_mss",
+        "unacked",
+        "sacked",
+        "lost",
+        "retrans",
+        "pmtu",
+        "rtt",
+        "rttvar",
+        "snd_ssthresh",
+        "snd_cwnd",
+        "reordering",
+        "total_retrans",
+        "pacing_rate",
+        "max_pacing_rate",
+        "bytes_acked",
+        "bytes_received",
+        "segs_out",
+        "segs_in",
+        "notsent_bytes",
+        "min_rtt",
+        "delivery_rate",
+        "delivery_rate_app_limited",
+        "busy_time",
+        "rwnd_limited",
+        "sndbuf_limited",
+        "bytes_sent",
+        "bytes_retrans",
+    )
+
+    timestamp: float  # time.monotonic the statistics were read at
+    state: int  # TCP state, 1 is ESTABLISHED
+    ca_state: int  # Congestion avoidance state: 0 open, 1 disorder, 2 CWR, 3 recovery, 4 loss
+    retransmits: int  # Consecutive retransmissions of the unacknowledged segment
+    probes: int  # Unanswered zero window probes
+    backoff: int  # Exponential backoff of the retransmission timer
+    rto: int  # Retransmission timeout
+    snd_mss: int
+    rcv_mss: int
+    unacked: int  # Segments in flight
+    sacked: int
+    lost: int  # Segments in flight considered lost
+    retrans: int  # Segments in flight that were retransmitted
+    pmtu: int  # Path MTU
+    rtt: int  # Smoothed RTT
+    rttvar: int  # RTT variance
+    snd_ssthresh: int  # Slow start threshold in segments, 2147483647 while still in the initial slow start
+    snd_cwnd: int  # Congestion window in segments
+    reordering: int
+    total_retrans: int  # Segments retransmitted over the lifetime of the connection
+    pacing_rate: int
+    max_pacing_rate: int
+    bytes_acked: int
+    bytes_received: int
+    segs_out: int
+    segs_in: int
+    notsent_bytes: int  # Bytes written but not sent yet
+    min_rtt: int
+    delivery_rate: int  # Recent goodput, as estimated by the kernel
+    delivery_rate_app_limited: bool  # The delivery rate was limited by the application, not the network
+    busy_time: int  # Time with data in flight
+    rwnd_limited: int  # Time limited by the receive window of the peer
+    sndbuf_limited: int  # Time limited by the send buffer
+    bytes_sent: int  # Bytes sent, retransmissions included
+    bytes_retrans: int
+
+    def __init__(self, raw: bytes, timestamp: float):
+        raw = bytes(raw).ljust(_TCP_INFO.size, b"\0")
+        (
+            self.state,
+            self.ca_state,
+            self.retransmits,
+            self.probes,
+            self.backoff,
+            _options,
+            _wscale,
+            app_limited,
+            self.rto,
+            _ato,
+            self.snd_mss,
+            self.rcv_mss,
+            self.unacked,
+            self.sacked,
+            self.lost,
+            self.retrans,
+            _fackets,
+            _last_data_sent,
+            _last_ack_sent,
+            _last_data_recv,
+            _last_ack_recv,
+            self.pmtu,
+            _rcv_ssthresh,
+            self.rtt,
+            self.rttvar,
+            self.snd_ssthresh,
+            self.snd_cwnd,
+            _advmss,
+            self.reordering,
+            _rcv_rtt,
+            _rcv_space,
+            self.total_retrans,
+            self.pacing_rate,
+            self.max_pacing_rate,
+            self.bytes_acked,
+            self.bytes_received,
+            self.segs_out,
+            self.segs_in,
+            self.notsent_bytes,
+            self.min_rtt,
+            _data_segs_in,
+            _data_segs_out,
+            self.delivery_rate,
+            self.busy_time,
+            self.rwnd_limited,
+            self.sndbuf_limited,
+            _delivered,
+            _delivered_ce,
+            self.bytes_sent,
+            self.bytes_retrans,
+            _dsack_dups,
+            _reord_seen,
+            _rcv_ooopack,
+            _snd_wnd,
+        ) = _TCP_INFO.unpack_from(raw)
+        self.delivery_rate_app_limited = bool(app_limited & 1)
+        self.timestamp = timestamp
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        return "TcpInfo(rtt={}, rttvar={}, snd_cwnd={}, snd_ssthresh={}, total_retrans={}, lost={}, delivery_rate={})".format(
+            self.rtt,
+            self.rttvar,
+            self.snd_cwnd,
+            self.snd_ssthresh,
+            self.total_retrans,
+            self.lost,
+            self.delivery_rate,
+        )
+
+
+def read_tcp_info(sock: socket) -> Optional[TcpInfo]:
+    """
+    Reads and decodes the TCP_INFO of sock, returns None where it is not supported
+    """
+    if not STATS_AVAILABLE:
+        return None
+    return TcpInfo(
+        sock.getsockopt(IPPROTO_TCP, TCP_INFO, _TCP_INFO.size), time.monotonic()
+    )
+
+
+class StatsSampler:
+    """
+    Records the statistics of a MiddlewareReliable connection (anything with a get_stats method) every interval
+    seconds in a background thread. The samples are kept in a ring buffer of capacity samples, so a sampler can be
+    left running for the lifetime of the connection, and the most recent ones can be exported at any time
+    """
+
+    interval: float
+    _conn: object
+    _samples: collections.deque[TcpInfo]
+    _stopped: threading.Event
+    _thread: Optional[threading.Thread]
+
+    def __init__(
+        self,
+        conn,
+        interval: float = _config.stats_interval,
+        capacity: int = _config.stats_capacity,
+    ):
+        if interval <= 0 or capacity <= 0:
+            raise ValueError("interval and capacity must be positive")
+        self.interval = interval
+        self._conn = conn
+        self._samples = collections.deque(maxlen=capacity)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> "StatsSampler":
+        if self._thread != None:
+            raise RuntimeError("StatsSampler already started")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread != None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def sample(self) -> Optional[TcpInfo]:
+        """
+        Records a sample right away, returns None if the connection has no statistics (or is closed)
+        """
+        try:
+            stats = self._conn.get_stats()
+        except OSError:
+            return None
+        if stats != None:
+            # NOTE: deque.append is atomic, samples can be read while the sampler runs
+            self._samples.append(stats)
+        return stats
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            if self.sample() == None:
+                # NOTE: The connection was closed, or its platform has no TCP_INFO
+                return
+            self._stopped.wait(self.interval)
+
+    def samples(self) -> list[TcpInfo]:
+        """
+        Returns the recorded samples, oldest first
+        """
+        return list(self._samples)
+
+    def export_csv(self, file: TextIO) -> int:
+        """
+        Writes the recorded samples to file as CSV, one row per sample with a header row of the field names, returns
+        the number of samples written
+        """
+        samples = self.samples()
+        writer = csv.writer(file)
+        writer.writerow(TcpInfo.__slots__)
+        for sample in samples:
+            writer.writerow([getattr(sample, name) for name in TcpInfo.__slots__])
+        return len(samples)
+
+    def __enter__(self) -> "StatsSampler":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
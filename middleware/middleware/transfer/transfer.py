@@ -0,0 +1,152 @@
+from socket import *
+import errno
+import mmap
+import os
+import select
+import struct
+import sys
+
+# NOTE: Linux MSG_ZEROCOPY (4.14+). Pages of a buffer sent with it are pinned and sent by the NIC directly, and the
+#       kernel reports on the socket's error queue once it no longer needs them, so the buffer must not be modified
+#       until then. Below ZEROCOPY_MIN_SIZE, pinning pages and reading notifications costs more than copying
+SO_ZEROCOPY = 60
+MSG_ZEROCOPY = 0x4000000
+SO_EE_ORIGIN_ZEROCOPY = 5
+IP_RECVERR = 11
+# NOTE: struct sock_extended_err: errno, origin, type, code, pad, info and data. For zero-copy notifications, info
+#       and data are the first and last send call (counted from 0) whose buffers have been released
+SOCK_EXTENDED_ERR = struct.Struct("=IBBBBII")
+ZEROCOPY_MIN_SIZE = 2**14
+# NOTE: Size of the file mappings recv_into_file receives into, so that huge transfers do not map the whole file
+RECV_FILE_WINDOW = 2**26
+
+
+def recv_into_file(
+    sock: socket, file, count: int, offset: int = 0, prefix: bytes = b""
+) -> int:
+    """
+    Receives count bytes from sock directly into file (opened for reading and writing, e.g. "r+b" or "w+b") at offset,
+    through a memory mapping of the file, so that bytes are only copied from the socket to the page cache. The file is
+    extended to offset + count first (preallocated where supported). Returns the number of bytes received, fewer than
+    count if the connection was closed, in which case the file is shrunk back to the data received. prefix holds
+    bytes already received from sock (at most count), which are written first
+    """
+    if count <= 0:
+        return 0
+
+    if hasattr(file, "flush"):
+        file.flush()
+    fd = file.fileno()
+    size = os.fstat(fd).st_size
+    end = offset + count
+    if size < end:
+        try:
+            os.posix_fallocate(fd, size, end - size)
+        except (AttributeError, OSError):
+            # NOTE: Not supported by the platform or file system, the file is extended without allocating blocks
+            os.ftruncate(fd, end)
+
+    position = offset
+    if len(prefix) > 0:
+        os.pwrite(fd, prefix, offset)
+        position += len(prefix)
+    try:
+        while position < end:
+            map_start = position - position % mmap.ALLOCATIONGRANULARITY
+            map_end = min(end, map_start + RECV_FILE_WINDOW)
+            with mmap.mmap(fd, map_end - map_start, offset=map_start) as mapping:
+                with memoryview(mapping) as view:
+                    while position < map_end:
+                        with view[position - map_start :] as target:
+                            received = sock.recv_into(target)
+                        if received == 0:
+                            return position - offset
+                        position += received
+        return count
+    finally:
+        if position < end and size < end:
+            os.ftruncate(fd, max(size, position))
+
+
+class ZeroCopySender:
+    """
+    Sends large buffers on a stream socket with MSG_ZEROCOPY, waiting for the kernel to release them before returning
+    (see SO_ZEROCOPY). Without kernel support, enabled is False and buffers are sent with sendall
+    """
+
+    sock: socket
+    enabled: bool
+    sent_calls: int  # Send calls made with MSG_ZEROCOPY, each has a sequence number
+    released_calls: int  # Send calls whose buffers have been released by the kernel
+    copied_calls: int  # Released send calls for which the kernel copied the buffer after all (e.g. loopback)
+
+    def __init__(self, sock: socket):
+        self.sock = sock
+        self.sent_calls = 0
+        self.released_calls = 0
+        self.copied_calls = 0
+        self.enabled = sys.platform == "linux"
+        if self.enabled:
+            try:
+                sock.setsockopt(SOL_SOCKET, SO_ZEROCOPY, 1)
+            except OSError:
+                self.enabled = False
+
+    def sendall(self, data) -> None:
+        """
+        Sends all of data like socket.sendall. Buffers of at least ZEROCOPY_MIN_SIZE bytes are sent without being
+        copied, and this returns once the kernel has released them, so data can be modified afterwards. Raises
+        TimeoutError if that takes longer than the socket timeout
+        """
+        data = memoryview(data).cast("B")
+        if not self.enabled or len(data) < ZEROCOPY_MIN_SIZE:
+            self.sock.sendall(data)
+            return
+
+        sent = 0
+        while sent < len(data):
+            try:
+                sent += self.sock.send(data[sent:], MSG_ZEROCOPY)
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                if self.released_calls == self.sent_calls:
+                    # NOTE: Nothing of this socket is pinned, the limit is used up by others. The rest is copied
+                    self.sock.sendall(data[sent:])
+                    break
+                # NOTE: Too many buffers pinned (optmem limit), wait for one to be released
+                self._wait_released(self.released_calls + 1)
+                continue
+            self.sent_calls += 1
+        self._wait_released(self.sent_calls)
+
+    def _wait_released(self, calls: int) -> None:
+        """
+        Reads release notifications from the error queue until the buffers of the first calls send calls are released
+        """
+        poller = select.poll()
+        poller.register(self.sock, select.POLLERR)
+        timeout = self.sock.gettimeout()
+        while self.released_calls < calls:
+            # NOTE: The error queue is only read once it is known to hold a notification, as a socket with a timeout
+            #       would otherwise wait for data to arrive instead of failing right away when the queue is empty
+            if not poller.poll(-1 if timeout == None else timeout * 1000):
+                raise TimeoutError(
+                    "Timed out waiting for zero-copy buffers to be released"
+                )
+            error = self.sock.getsockopt(SOL_SOCKET, SO_ERROR)
+            if error != 0:
+                raise OSError(error, os.strerror(error))
+            self._read_notification()
+
+    def _read_notification(self) -> None:
+        _, ancdata, _, _ = self.sock.recvmsg(0, 256, MSG_ERRQUEUE)
+        for level, kind, payload in ancdata:
+            if level != SOL_IP or kind != IP_RECVERR:
+                continue
+            _, origin, _, code, _, first, last = SOCK_EXTENDED_ERR.unpack_from(payload)
+            if origin != SO_EE_ORIGIN_ZEROCOPY:
+                continue
+            self.released_calls += last - first + 1
+            if code & 1:  # SO_EE_CODE_ZEROCOPY_COPIED
+                self.copied_calls += last - first + 1
@@ -1,4 +1,5 @@
 from middleware.middlewareAPI import *
+from typing import Optional
 import threading
 
 
@@ -55,8 +56,9 @@ class ChatService:
         print(f"\n{addr[0]}:{addr[1]} joined the chat\n")
         while True:
             try:
-                data = conn.recv(1024).decode("utf-8")
-            except ConnectionResetError:
+                # NOTE: Messages are framed, a single recv could return part of a message or several messages
+                message = conn.recv_message()
+            except ConnectionError:
                 self.hostConnections.remove(conn)
                 self.distributeData(
                     conn,
@@ -66,9 +68,9 @@ class ChatService:
                 )
                 conn.close()
                 break
-            if data != "":
-                print(data)
-                self.distributeData(conn, data.encode("utf-8"))
+            if message != None:
+                print(message.decode("utf-8"))
+                self.distributeData(conn, message)
             else:
                 self.hostConnections.remove(conn)
                 self.distributeData(
@@ -93,14 +95,14 @@ class ChatService:
                 if message == "exit":
                     self.active = False
                     for conn in self.hostConnections:
-                        conn.send("Chat ended".encode("utf-8"))
+                        conn.send_message("Chat ended".encode("utf-8"))
                         conn.close()
                     self.mw.close()
                     exit()
                 else:
                     print("\n" + self.name + ": " + message)
                     for conn in self.hostConnections:
-                        conn.send(
+                        conn.send_message(
                             ("\n" + self.name + "(you): " + message).encode("utf-8")
                         )
             except Exception as e:
@@ -114,7 +116,7 @@ class ChatService:
 
         for conn in self.hostConnections:
             if conn != senderConn:
-                conn.send(data)
+                conn.send_message(data)
 
     def connectToChat(self, address: tuple[str, int]) -> None:
         """
@@ -139,26 +141,30 @@ class ChatService:
             try:
                 if message == "exit":
                     self.active = False
-                    self.mw.send(f"{self.address} left the chat".encode("utf-8"))
+                    self.mw.send_message(
+                        f"{self.address} left the chat".encode("utf-8")
+                    )
                     print("Chat ended")
                     self.mw.close()
                     exit()
                 else:
                     print("\n" + self.name + ": " + message)
-                    self.mw.send(("\n" + self.name + ": " + message).encode("utf-8"))
+                    self.mw.send_message(
+                        ("\n" + self.name + ": " + message).encode("utf-8")
+                    )
             except Exception as e:
                 print(e)
                 break
 
-    def receiveData(self) -> bytes:
+    def receiveData(self) -> Optional[bytes]:
         """
-        Receives data from the host
+        Receives a message from the host, None once the connection is closed
         """
         try:
-            data = self.mw.recv(1024)
-            return data
-        except ConnectionResetError:
+            return self.mw.recv_message()
+        except ConnectionError:
             self.close()
+            return None
 
     def printMessage(self, message: str) -> None:
         """
@@ -172,13 +178,11 @@ class ChatService:
         """
         while self.active:
             data = self.receiveData()
-            message = data.decode("utf-8")
-            if message != "":
-                self.printMessage(message)
-            elif data == "\nChat ended\n":
+            if data == None:
                 self.close()
                 self.active = False
                 break
+            self.printMessage(data.decode("utf-8"))
 
     def close(self) -> None:
         """
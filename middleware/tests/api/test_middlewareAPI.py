@@ -1,9 +1,11 @@
 import pytest
 import threading
 import random
+import time
 from socket import *
 from middleware.middlewareAPI import *
 import middleware.fragmentation.fragmentation as fragmentation
+import middleware.pmtu.pmtu as pmtu
 from middleware.configuration.config import config
 
 
@@ -61,6 +63,99 @@ def test_send_and_receive_reliable():
     mwSend.close()
 
 
+def test_send_and_receive_reliable_messages():
+    messages = [b"Hello there", b"", random.randbytes(200000)] + [b"x"] * 100
+
+    def echoMessages(mwSocket):
+        conn, addr = mwSocket.accept()
+        received = [conn.recv_message() for _ in messages]
+        conn.send_messages(received)
+        assert conn.recv_message() == None
+        conn.close()
+
+    mwReceive = MiddlewareReliable()
+    mwSend = MiddlewareReliable()
+    mwReceive._socko.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    mwReceive.bind(("", 5025))
+    mwReceive.listen()
+    thread = threading.Thread(target=echoMessages, args=(mwReceive,))
+    thread.start()
+
+    mwSend.connect(("localhost", 5025))
+    mwSend.settimeout(5)
+    for message in messages:
+        mwSend.send_message(message)
+    for message in messages:
+        assert mwSend.recv_message() == message
+    mwSend.close()
+
+    thread.join()
+    mwReceive.close()
+
+
+@pytest.mark.parametrize("write_mode", ["nodelay", "cork", "buffered"])
+def test_send_and_receive_reliable_write_modes(write_mode):
+    def echo(mwSocket):
+        conn, addr = mwSocket.accept()
+        for _ in range(3):
+            conn.send_message(conn.recv_message())
+        conn.close()
+
+    mwReceive = MiddlewareReliable(write_mode=write_mode)
+    mwSend = MiddlewareReliable(write_mode=write_mode, write_max_delay=60)
+    mwReceive._socko.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    mwReceive.bind(("", 5026))
+    mwReceive.listen()
+    thread = threading.Thread(target=echo, args=(mwReceive,))
+    thread.start()
+
+    mwSend.connect(("localhost", 5026))
+    mwSend.settimeout(5)
+    # NOTE: Held writes are flushed by the receive waiting for the reply
+    for message in [b"Hello there", b"x", bytes(100000)]:
+        mwSend.send_message(message)
+        assert mwSend.recv_message() == message
+
+    thread.join()
+    mwSend.close()
+    mwReceive.close()
+
+
+@pytest.mark.parametrize("write_mode", ["default", "buffered"])
+def test_sendfile_and_recv_into_file_reliable(tmp_path, write_mode):
+    source = tmp_path / "source"
+    source.write_bytes(random.randbytes(1000000))
+    target = tmp_path / "target"
+
+    def receive(mwSocket):
+        conn, addr = mwSocket.accept()
+        conn.settimeout(5)
+        assert conn.recv_message() == b"file"
+        with open(target, "w+b") as file:
+            assert conn.recv_into_file(file, 999000) == 999000
+        conn.close()
+
+    mwReceive = MiddlewareReliable()
+    mwSend = MiddlewareReliable(write_mode=write_mode, zero_copy=True)
+    mwReceive._socko.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    mwReceive.bind(("", 5027))
+    mwReceive.listen()
+    thread = threading.Thread(target=receive, args=(mwReceive,))
+    thread.start()
+
+    mwSend.connect(("localhost", 5027))
+    mwSend.settimeout(5)
+    # NOTE: Buffered writes are sent before the file
+    mwSend.send_message(b"file")
+    with open(source, "rb") as file:
+        assert mwSend.sendfile(file, 1000) == 999000
+    thread.join()
+    mwSend.close()
+    mwReceive.close()
+
+    assert target.read_bytes() == source.read_bytes()[1000:]
+
+
 def test_sending_and_receiving_large_file_reliable():
     testGif = open("tests/api/among-us-dance.gif", "rb")
     gifData = testGif.read()
@@ -98,7 +193,7 @@ def test_sending_and_receiving_large_file_unreliable():
     gifData = testGif.read()
     testGif.close()
 
-    max_payload_size = MiddlewareUnreliable.get_max_payload_size()
+    max_payload_size = mwSend.get_max_payload_size()
     gif_data_payloads = [
         gifData[i * max_payload_size : (i + 1) * max_payload_size]
         for i in range(
@@ -257,3 +352,484 @@ def test_settimeout_reliable():
         assert abs((end_accept - start_accept) - timeout) <= timeout
 
     receiver.close()
+
+
+def test_send_and_receive_unreliable_batched():
+    mwSend = MiddlewareUnreliable(batched_io=True)
+    mwReceive = MiddlewareUnreliable(batched_io=True)
+    mwReceive.bind(("", 5006))
+    mwReceive.settimeout(5)
+
+    for size in [1, 1000, 60000]:
+        payload = random.randbytes(size)
+        mwSend.sendto(payload, ("localhost", 5006))
+        data, address = mwReceive.recvfrom()
+        assert data == payload
+        assert address[0] == "127.0.0.1"
+
+    mwSend.close()
+    mwReceive.close()
+
+
+def test_batched_unreliable_timeout():
+    sock = MiddlewareUnreliable(batched_io=True)
+    sock.bind(("", 5007))
+
+    sock.settimeout(0)
+    with pytest.raises(BlockingIOError):
+        sock.recvfrom()
+
+    sock.settimeout(0.1)
+    with pytest.raises(TimeoutError):
+        sock.recvfrom()
+
+    sock.close()
+
+
+def test_batched_io_fallback(monkeypatch):
+    import middleware.batching.batching as batching
+
+    monkeypatch.setattr(batching, "BATCHED_IO_AVAILABLE", False)
+
+    sender = socket(AF_INET, SOCK_DGRAM)
+    receiver = socket(AF_INET, SOCK_DGRAM)
+    receiver.bind(("", 5008))
+
+    sent = batching.sendmmsg(sender, [b"abc", [b"de", b"f"]], ("localhost", 5008))
+    assert sent == 6
+    assert batching.ReceiveBatch(batch_size=2).recv(receiver)[0][0] == b"abc"
+    assert batching.ReceiveBatch(batch_size=2).recv(receiver)[0][0] == b"def"
+
+    sender.close()
+    receiver.close()
+
+
+def test_segment_groups():
+    import middleware.batching.batching as batching
+
+    messages = [b"a" * 10] * 3 + [b"b" * 4, b"c" * 10, [b"d" * 2, b"e" * 10], b""]
+    groups = batching.segment_groups(messages)
+    assert [(size, len(group)) for size, group in groups] == [
+        (10, 4),
+        (10, 1),
+        (12, 1),
+        (1, 1),
+    ]
+    assert [len(group) for _, group in batching.segment_groups([b"x"] * 100)] == [
+        batching.UDP_MAX_SEGMENTS,
+        100 - batching.UDP_MAX_SEGMENTS,
+    ]
+
+
+def test_segmentation_offload_fallback():
+    import errno
+    import middleware.batching.batching as batching
+
+    class RejectingSocket:
+        def sendmsg(self, buffers, ancdata, flags, address):
+            raise OSError(errno.EIO, "no checksum offload")
+
+    offload = batching.SegmentationOffload(socket(AF_INET, SOCK_DGRAM))
+    offload.enabled = True
+    fallback = []
+    sent = offload.send(
+        RejectingSocket(),
+        [b"abc", b"def", b"g"],
+        ("localhost", 5022),
+        lambda group, address: fallback.append(group) or 7,
+    )
+    assert (sent, fallback, offload.enabled) == (7, [[b"abc", b"def", b"g"]], False)
+
+
+@pytest.mark.parametrize("fec_data_fragments", [0, 4])
+def test_send_and_receive_unreliable_offload(fec_data_fragments):
+    mwSend = MiddlewareUnreliable(offload=True, fec_data_fragments=fec_data_fragments)
+    mwReceive = MiddlewareUnreliable(offload=True)
+    mwReceive._socko.setsockopt(SOL_SOCKET, SO_RCVBUF, 2**22)
+    mwReceive.bind(("", 5022))
+    mwReceive.settimeout(5)
+
+    for size in [1, 1000, 60000, 200000]:
+        payload = random.randbytes(size)
+        mwSend.sendto(payload, ("localhost", 5022))
+        assert mwReceive.recvfrom()[0] == payload
+
+    mwSend.close()
+    mwReceive.close()
+
+    with pytest.raises(ValueError):
+        MiddlewareUnreliable(offload=True, in_place_reassembly=True)
+
+
+@pytest.mark.parametrize("batched_io", [False, True])
+def test_send_and_receive_unreliable_zero_copy(batched_io):
+    import array
+    import mmap
+
+    mwSend = MiddlewareUnreliable(zero_copy=True, batched_io=batched_io)
+    mwReceive = MiddlewareUnreliable()
+    mwReceive.bind(("", 5009))
+    mwReceive.settimeout(5)
+
+    data = random.randbytes(5000)
+    mapped = mmap.mmap(-1, len(data))
+    mapped.write(data)
+    words = array.array("i", data[:4000])
+
+    for buffer in [data, bytearray(data), memoryview(data)[100:], mapped, words]:
+        mwSend.sendto(buffer, ("localhost", 5009))
+        assert mwReceive.recvfrom()[0] == memoryview(buffer).cast("B")
+
+    mapped.close()
+    mwSend.close()
+    mwReceive.close()
+
+
+def test_send_and_receive_unreliable_in_place():
+    mwSend = MiddlewareUnreliable()
+    mwReceive = MiddlewareUnreliable(in_place_reassembly=True)
+    mwReceive.bind(("", 5010))
+    mwReceive.settimeout(5)
+
+    for size in [1, 1000, 60000]:
+        payload = random.randbytes(size)
+        mwSend.sendto(payload, ("localhost", 5010))
+        assert mwReceive.recvfrom()[0] == payload
+
+    # NOTE: Fragments too short to hold a header are dropped
+    mwSend._socko.sendto(b"abc", ("localhost", 5010))
+    mwSend.sendto(b"Hello", ("localhost", 5010))
+    assert mwReceive.recvfrom()[0] == b"Hello"
+
+    mwSend.close()
+    mwReceive.close()
+
+    with pytest.raises(ValueError):
+        MiddlewareUnreliable(batched_io=True, in_place_reassembly=True)
+
+
+@pytest.mark.parametrize("in_place_reassembly", [False, True])
+def test_send_and_receive_unreliable_compact_headers(in_place_reassembly):
+    mwSend = MiddlewareUnreliable(compact_headers=True)
+    mwReceive = MiddlewareUnreliable(
+        compact_headers=True, in_place_reassembly=in_place_reassembly
+    )
+    mwReceive.bind(("", 5020))
+    mwReceive.settimeout(5)
+
+    for size in [1, 1000, 60000]:
+        payload = random.randbytes(size)
+        mwSend.sendto(payload, ("localhost", 5020))
+        assert mwReceive.recvfrom()[0] == payload
+
+    # NOTE: Legacy fragments are dropped
+    mwLegacy = MiddlewareUnreliable()
+    mwLegacy.sendto(b"legacy", ("localhost", 5020))
+    mwSend.sendto(b"compact", ("localhost", 5020))
+    assert mwReceive.recvfrom()[0] == b"compact"
+    mwLegacy.close()
+
+    mwSend.close()
+    mwReceive.close()
+
+
+def test_send_and_receive_unreliable_aggregation():
+    mwSend = MiddlewareUnreliable(aggregation=True, aggregation_hold_time=60)
+    mwReceive = MiddlewareUnreliable()
+    mwReceive.bind(("", 5021))
+    mwReceive.settimeout(0.2)
+
+    payloads = [random.randbytes(size) for size in [1, 10, 100]]
+    for payload in payloads:
+        mwSend.sendto(payload, ("localhost", 5021))
+    with pytest.raises(TimeoutError):
+        mwReceive.recvfrom()
+
+    # NOTE: A datagram too large to be held sends the held datagrams first
+    payloads.append(random.randbytes(5000))
+    mwSend.sendto(payloads[-1], ("localhost", 5021))
+    for payload in payloads:
+        assert mwReceive.recvfrom()[0] == payload
+
+    mwSend.sendto(b"Hello", ("localhost", 5021))
+    mwSend.flush()
+    assert mwReceive.recvfrom()[0] == b"Hello"
+
+    mwSend.close()
+    mwReceive.close()
+
+
+def test_aggregated_datagram_sent_without_further_calls():
+    mwSend = MiddlewareUnreliable(aggregation=True, aggregation_hold_time=0.05)
+    mwReceive = MiddlewareUnreliable()
+    mwReceive.bind(("127.0.0.1", 0))
+    mwReceive.settimeout(5)
+    address = mwReceive._socko.getsockname()
+
+    # NOTE: Nothing calls into the sending socket again, the held datagram is sent once its hold time has passed
+    for payload in [b"Hello", b"there"]:
+        start = time.monotonic()
+        assert mwSend.sendto(payload, address) == 0
+        assert mwReceive.recvfrom()[0] == payload
+        assert 0.04 < time.monotonic() - start < 1
+    assert mwSend._aggregator.next_deadline() == None
+
+    mwSend.close()
+    mwReceive.close()
+
+
+def test_send_and_receive_unreliable_paced():
+    mwSend = MiddlewareUnreliable(pacing_rate=100000, pacing_burst=10000)
+    mwReceive = MiddlewareUnreliable()
+    mwReceive.bind(("", 5023))
+    mwReceive.settimeout(5)
+
+    payload = random.randbytes(30000)
+    start = time.monotonic()
+    mwSend.sendto(payload, ("localhost", 5023))
+    # NOTE: The first 10000 bytes are a burst, the rest is paced to 100000 bytes/s
+    assert time.monotonic() - start > 0.15
+    assert mwReceive.recvfrom()[0] == payload
+
+    # NOTE: The bucket is empty after sendto, and the fragments of a datagram are never sent past the burst
+    assert mwSend.try_sendto(payload[:5000], ("localhost", 5023)) > 0.04
+    with pytest.raises(ValueError):
+        mwSend.try_sendto(payload, ("localhost", 5023))
+    time.sleep(0.1)
+    assert mwSend.try_sendto(b"Hello", ("localhost", 5023)) == 0
+    assert mwReceive.recvfrom()[0] == b"Hello"
+
+    mwSend.close()
+    mwReceive.close()
+
+
+@pytest.mark.parametrize("in_place_reassembly", [False, True])
+def test_send_and_receive_unreliable_compressed(in_place_reassembly):
+    mwSend = MiddlewareUnreliable(compression_codec="zlib", nack_rounds=1)
+    mwReceive = MiddlewareUnreliable(in_place_reassembly=in_place_reassembly)
+    mwReceive.bind(("", 5024))
+    mwReceive.settimeout(5)
+
+    for payload in [
+        b"Hello",
+        b"status ok " * 100,
+        random.randbytes(5000).hex().encode(),
+    ]:
+        mwSend.sendto(payload, ("localhost", 5024))
+        assert mwReceive.recvfrom()[0] == payload
+
+    mwSend.close()
+    mwReceive.close()
+
+
+def test_max_payload_size_unreliable():
+    small = MiddlewareUnreliable(mtu=512)
+    large = MiddlewareUnreliable(mtu=1500)
+
+    assert small.get_max_payload_size() == small.get_mss() * 2048
+    assert large.get_max_payload_size() == large.get_mss() * 2048
+
+    # NOTE: Sockets with different MTUs can still exchange datagrams
+    large.bind(("", 5011))
+    large.settimeout(5)
+    payload = random.randbytes(10000)
+    small.sendto(payload, ("localhost", 5011))
+    assert large.recvfrom()[0] == payload
+
+    with pytest.raises(ValueError):
+        small.sendto(bytes(small.get_max_payload_size() + 1), ("localhost", 5011))
+
+    small.close()
+    large.close()
+
+    with pytest.raises(ValueError):
+        MiddlewareUnreliable(mtu=32)
+
+
+def test_send_and_receive_unreliable_fec():
+    mwSend = MiddlewareUnreliable(fec_data_fragments=8, fec_repair_fragments=2)
+    mwReceive = MiddlewareUnreliable(in_place_reassembly=True)
+    mwReceive.bind(("", 5012))
+    mwReceive.settimeout(5)
+
+    assert mwSend.get_mss() < mwReceive.get_mss()
+    for size in [1, 1000, 30000]:
+        payload = random.randbytes(size)
+        mwSend.sendto(payload, ("localhost", 5012))
+        assert mwReceive.recvfrom()[0] == payload
+
+    mwSend.close()
+    mwReceive.close()
+
+
+class LossySocket:
+    """
+    Wraps a socket and drops every fragment sent with sendto whose number is in lost
+    """
+
+    def __init__(self, socko, lost):
+        self._socko = socko
+        self._lost = lost
+        self._count = 0
+
+    def sendto(self, data, address):
+        self._count += 1
+        if self._count in self._lost:
+            return len(data)
+        return self._socko.sendto(data, address)
+
+    def __getattr__(self, name):
+        return getattr(self._socko, name)
+
+
+def test_send_and_receive_unreliable_nack():
+    mwSend = MiddlewareUnreliable(nack_rounds=3)
+    mwReceive = MiddlewareUnreliable(nack_rounds=3, nack_interval=0.05)
+    mwReceive.bind(("", 5013))
+    mwReceive.settimeout(5)
+    mwSend.settimeout(1)
+
+    # NOTE: Drops fragments of the first transmission, including its FIN fragment, and of the first repair round
+    payload = random.randbytes(mwSend.get_mss() * 20)
+    mwSend._socko = LossySocket(mwSend._socko, {2, 7, 8, 20, 21})
+
+    def serve_nacks():
+        try:
+            mwSend.recvfrom()
+        except TimeoutError:
+            pass
+
+    sender = threading.Thread(target=serve_nacks)
+    mwSend.sendto(payload, ("localhost", 5013))
+    sender.start()
+    assert mwReceive.recvfrom()[0] == payload
+    sender.join()
+
+    mwSend.close()
+    mwReceive.close()
+
+
+def test_poll_datagrams_unreliable():
+    mwSend = MiddlewareUnreliable()
+    mwReceive = MiddlewareUnreliable()
+    mwReceive.bind(("", 5016))
+    mwReceive.setblocking(False)
+
+    assert mwReceive.poll_datagrams() == []
+    with pytest.raises(BlockingIOError):
+        mwReceive.recvfrom()
+
+    payloads = [random.randbytes(size) for size in [1, 1000, 5000]]
+    for payload in payloads:
+        mwSend.sendto(payload, ("localhost", 5016))
+
+    datagrams = []
+    for _ in range(100):
+        datagrams += mwReceive.poll_datagrams()
+        if len(datagrams) == len(payloads):
+            break
+        time.sleep(0.01)
+    assert [data for data, _ in datagrams] == payloads
+
+    mwSend.close()
+    mwReceive.close()
+
+
+def test_poller():
+    mwSend = MiddlewareUnreliable()
+    mwReceives = [MiddlewareUnreliable(), MiddlewareUnreliable()]
+    mwListen = MiddlewareReliable()
+    mwConnect = MiddlewareReliable()
+    mwReceives[0].bind(("", 5017))
+    mwReceives[1].bind(("", 5018))
+    mwListen._socko.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    mwListen.bind(("", 5019))
+    mwListen.listen()
+
+    poller = MiddlewarePoller()
+    for mwSocket, name in zip(mwReceives + [mwListen], ["a", "b", "listen"]):
+        poller.register(mwSocket, name)
+
+    assert poller.poll(0.05) == []
+
+    payload = random.randbytes(3000)
+    mwSend.sendto(payload, ("localhost", 5018))
+    [(mwSocket, name, datagrams)] = poller.poll(5)
+    assert mwSocket is mwReceives[1] and name == "b"
+    assert [data for data, _ in datagrams] == [payload]
+
+    mwConnect.connect(("localhost", 5019))
+    [(mwSocket, name, datagrams)] = poller.poll(5)
+    assert mwSocket is mwListen and name == "listen" and datagrams == []
+    mwListen.accept()[0].close()
+
+    poller.unregister(mwReceives[1])
+    mwSend.sendto(payload, ("localhost", 5018))
+    assert poller.poll(0.05) == []
+
+    poller.close()
+    for mwSocket in [mwSend, mwConnect, mwListen] + mwReceives:
+        mwSocket.close()
+
+
+@pytest.mark.skipif(not pmtu.PMTU_AVAILABLE, reason="requires IP_MTU")
+def test_path_mtu_discovery_unreliable():
+    pmtu.path_mtu_cache.clear()
+    mwSend = MiddlewareUnreliable(
+        mtu=9000, pmtu_discovery=True, aggregation=True, aggregation_hold_time=60
+    )
+    receiver = socket(AF_INET, SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(5)
+    address = receiver.getsockname()
+
+    loopback_mtu = mwSend.get_mtu(address)
+    assert loopback_mtu == pmtu.path_mtu(address) >= 1500
+    assert mwSend.get_mtu() == 9000
+    assert MiddlewareUnreliable().get_mtu(address) == config.mtu
+
+    # NOTE: Datagrams and bundles are sized for the cached path MTU, not the MTU of the socket
+    pmtu.path_mtu_cache.set("127.0.0.1", 576)
+    assert mwSend.get_mtu(address) == 576
+    assert mwSend.get_max_payload_size(address) < mwSend.get_max_payload_size()
+    payloads = [random.randbytes(size) for size in [300, 300, 5000]]
+    for payload in payloads:
+        mwSend.sendto(payload, address)
+    mwSend.flush()
+
+    reassembler = fragmentation.Reassembler()
+    received = []
+    while len(received) < len(payloads):
+        frag = receiver.recv(2**16)
+        assert len(frag) <= 576 - fragmentation.UDP_IP_HEADER_SIZE
+        reassembler.add_fragment_to_datagram(frag, address)
+        completed = reassembler.check_for_completed_datagrams()
+        if completed != None:
+            received.append(bytes(completed[0]))
+    assert received == payloads
+
+    pmtu.path_mtu_cache.clear()
+    mwSend.close()
+    receiver.close()
+
+
+@pytest.mark.skipif(not pmtu.PMTU_AVAILABLE, reason="requires IP_MTU")
+def test_path_mtu_discovery_reliable():
+    pmtu.path_mtu_cache.clear()
+    listener = MiddlewareReliable(pmtu_discovery=True)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    client = MiddlewareReliable(pmtu_discovery=True)
+    client.connect(listener._socko.getsockname())
+    conn, _ = listener.accept()
+
+    # NOTE: The MTU of the socket is replaced by the path MTU of the connection
+    loopback_mtu = pmtu.path_mtu_cache.get("127.0.0.1")
+    assert loopback_mtu >= 1500
+    for mwSocket in [client, conn]:
+        assert mwSocket.get_mtu() == loopback_mtu
+        assert mwSocket.get_mss() == loopback_mtu - 40
+
+    pmtu.path_mtu_cache.clear()
+    for mwSocket in [listener, client, conn]:
+        mwSocket.close()
@@ -0,0 +1,138 @@
+import pytest
+import asyncio
+import random
+import time
+from middleware.middlewareAsyncAPI import *
+from middleware.middlewareAPI import MiddlewareReliable
+import middleware.coalescing.coalescing as coalescing
+from middleware.configuration.config import config
+
+
+def test_send_and_receive_unreliable_async():
+    async def run():
+        mwReceive = await open_unreliable_endpoint(("", 5014))
+        mwSend = await open_unreliable_endpoint()
+
+        for size in [1, 1000, 30000]:
+            payload = random.randbytes(size)
+            mwSend.sendto(payload, ("localhost", 5014))
+            data, address = await asyncio.wait_for(mwReceive.recvfrom(), 5)
+            assert data == payload
+            assert address[1] == mwSend.getsockname()[1]
+
+        mwSend.close()
+        mwReceive.close()
+
+    asyncio.run(run())
+
+
+def test_many_unreliable_endpoints_async():
+    async def echo(endpoint):
+        data, address = await endpoint.recvfrom()
+        endpoint.sendto(data, address)
+
+    async def run():
+        servers = [await open_unreliable_endpoint(("127.0.0.1", 0)) for _ in range(100)]
+        clients = [await open_unreliable_endpoint() for _ in range(100)]
+        echoes = [asyncio.create_task(echo(server)) for server in servers]
+
+        payloads = [random.randbytes(2000) for _ in servers]
+        for client, server, payload in zip(clients, servers, payloads):
+            client.sendto(payload, server.getsockname())
+        received = await asyncio.wait_for(
+            asyncio.gather(*(client.recvfrom() for client in clients)), 5
+        )
+
+        assert [data for data, _ in received] == payloads
+        await asyncio.gather(*echoes)
+        for endpoint in servers + clients:
+            endpoint.close()
+
+    asyncio.run(run())
+
+
+def test_close_wakes_unreliable_receiver_async():
+    async def run():
+        mwReceive = await open_unreliable_endpoint()
+        receive = asyncio.create_task(mwReceive.recvfrom())
+        await asyncio.sleep(0)
+        mwReceive.close()
+        with pytest.raises(ConnectionAbortedError):
+            await asyncio.wait_for(receive, 5)
+
+    asyncio.run(run())
+
+
+def test_send_and_receive_reliable_async():
+    payload = random.randbytes(100000)
+
+    async def echo(connection):
+        received = bytearray()
+        while len(received) < len(payload):
+            received += await connection.recv(65536)
+        await connection.sendall(received)
+        await connection.close()
+
+    async def run():
+        server = await start_reliable_server(echo, ("", 5015), mtu=1000)
+        client = await open_reliable_connection(("localhost", 5015), mtu=1000)
+
+        assert client.get_mtu() == 1000
+        assert client.get_mss() == 960
+        client.set_tos(0x10)
+        assert client.get_tos() == 0x10
+
+        await client.sendall(payload)
+        received = bytearray()
+        while len(received) < len(payload):
+            data = await asyncio.wait_for(client.recv(65536), 5)
+            assert data != b""
+            received += data
+        assert received == payload
+
+        await client.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(not coalescing.CORK_AVAILABLE, reason="requires TCP_CORK")
+def test_reliable_async_ignores_write_mode(monkeypatch):
+    # NOTE: As if write_mode = cork was configured. Nothing on the asyncio path flushes, so it must not be applied
+    monkeypatch.setitem(
+        MiddlewareReliable.__init__.__kwdefaults__, "write_mode", "cork"
+    )
+    monkeypatch.setattr(config, "write_mode", "cork")
+    corked = []
+
+    async def echo(connection):
+        corked.append(
+            connection.writer.get_extra_info("socket").getsockopt(
+                IPPROTO_TCP, coalescing.TCP_CORK
+            )
+        )
+        await connection.sendall(await connection.recv(100))
+        await connection.close()
+
+    async def run():
+        server = await start_reliable_server(echo, ("127.0.0.1", 0))
+        address = server.sockets[0].getsockname()
+        client = await open_reliable_connection(address)
+        corked.append(
+            client.writer.get_extra_info("socket").getsockopt(
+                IPPROTO_TCP, coalescing.TCP_CORK
+            )
+        )
+
+        start = time.monotonic()
+        await client.sendall(b"ping")
+        assert await asyncio.wait_for(client.recv(100), 5) == b"ping"
+        assert time.monotonic() - start < 0.1
+
+        await client.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(run())
+    assert corked == [0, 0]
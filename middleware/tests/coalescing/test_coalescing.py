@@ -0,0 +1,64 @@
+import pytest
+import time
+from socket import *
+import middleware.coalescing.coalescing as coalescing
+
+
+@pytest.fixture
+def connection(tcp_connection):
+    """
+    The shared tcp_connection, with a receiver that gives up quickly on data held back by a write mode
+    """
+    tcp_connection[1].settimeout(0.05)
+    return tcp_connection
+
+
+def test_invalid_write_mode(connection):
+    with pytest.raises(ValueError):
+        coalescing.WriteCoalescer(connection[0], "lazy", 0.1, 1024)
+
+
+def test_nodelay(connection):
+    sender, _ = connection
+    coalescing.WriteCoalescer(sender, "nodelay", 0.1, 1024)
+    assert sender.getsockopt(IPPROTO_TCP, TCP_NODELAY) != 0
+
+
+def test_buffered_writes(connection):
+    sender, receiver = connection
+    coalescer = coalescing.WriteCoalescer(sender, "buffered", 0.1, 10)
+
+    assert coalescer.send(b"abc") == 3
+    coalescer.send_buffers([b"de", memoryview(b"fg")])
+    assert coalescer.pending
+    with pytest.raises(TimeoutError):
+        receiver.recv(100)
+
+    coalescer.flush()
+    assert not coalescer.pending
+    assert receiver.recv(100) == b"abcdefg"
+
+    # NOTE: A full buffer is sent right away
+    coalescer.sendall(b"0123456789")
+    assert receiver.recv(100) == b"0123456789"
+    coalescer.close()
+
+
+@pytest.mark.skipif(not coalescing.CORK_AVAILABLE, reason="TCP_CORK is Linux only")
+def test_cork_is_released(connection):
+    sender, receiver = connection
+    coalescer = coalescing.WriteCoalescer(sender, "cork", 0.1, 1024)
+
+    coalescer.sendall(b"held")
+    with pytest.raises(TimeoutError):
+        receiver.recv(100)
+    coalescer.flush()
+    assert receiver.recv(100) == b"held"
+
+    # NOTE: Released by the timer well before the kernel's own 200 ms limit
+    start = time.monotonic()
+    coalescer.send(b"timer")
+    receiver.settimeout(1)
+    assert receiver.recv(100) == b"timer"
+    assert 0.05 < time.monotonic() - start < 0.19
+    coalescer.close()
@@ -26,16 +26,40 @@ def test_set_get():
     assert test_config.congestion_algorithm == "reno"
 
 
-def test_save_to_file():
-    test_config.save_to_file("tests/configuration/test_config_out.ini")
+def test_save_to_file(tmp_path):
+    test_config.save_to_file(str(tmp_path / "test_config_out.ini"))
 
     expected_content = """[middleware_configuration]
 mtu = 200
 fragment_timeout = 10
+fec_data_fragments = 0
+fec_repair_fragments = 1
+nack_interval = 0.5
+reassembly_max_bytes = 67108864
+reassembly_max_peer_bytes = 16777216
+reassembly_max_peer_datagrams = 1024
+reassembly_eviction_policy = lru
+compact_headers = False
+aggregation_hold_time = 0.002
+pacing_rate = 0
+pacing_burst = 16384
+compression_codec = none
+compression_threshold = 64
+write_mode = default
+write_max_delay = 0.02
+write_buffer_size = 16384
+max_message_size = 16777216
+pool_max_size = 8
+pool_max_idle = 4
+pool_idle_timeout = 60.0
+pmtu_discovery = False
+pmtu_expiry = 600.0
+stats_interval = 1.0
+stats_capacity = 3600
 congestion_algorithm = reno
 echo_config_path = True
 
 """
 
-    with open("tests/configuration/test_config_out.ini", "r") as reader:
+    with open(tmp_path / "test_config_out.ini", "r") as reader:
         assert reader.read(-1) == expected_content
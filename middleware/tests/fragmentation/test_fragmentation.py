@@ -0,0 +1,751 @@
+import pytest
+import random
+import tracemalloc
+import middleware.fragmentation.fragmentation as fragmentation
+import middleware.fragmentation.compression as compression
+
+ADDR = ("127.0.0.1", 5000)
+MAX_FRAG_PAYLOAD = fragmentation.Fragmenter().max_frag_payload
+MAX_DGRAM_PAYLOAD = fragmentation.Fragmenter().max_dgram_payload
+
+
+def reassemble(reassembler, fragments, addr=ADDR):
+    for frag in fragments:
+        reassembler.add_fragment_to_datagram(bytes(frag), addr)
+    return reassembler.check_for_completed_datagrams()
+
+
+def test_fragment_and_reassemble():
+    fragmenter = fragmentation.Fragmenter()
+    reassembler = fragmentation.Reassembler()
+
+    for size in [1, MAX_FRAG_PAYLOAD, MAX_DGRAM_PAYLOAD]:
+        data = random.randbytes(size)
+        fragments = fragmenter.fragment(data)
+        random.shuffle(fragments)
+
+        assert reassemble(reassembler, fragments) == (data, ADDR)
+
+
+def test_fragment_too_large():
+    with pytest.raises(ValueError):
+        fragmentation.Fragmenter().fragment(bytes(MAX_DGRAM_PAYLOAD + 1))
+
+
+def test_fragment_iovecs_matches_fragment():
+    data = random.randbytes(MAX_FRAG_PAYLOAD * 3 + 7)
+
+    fragmenter = fragmentation.Fragmenter()
+    other = fragmentation.Fragmenter()
+    other.current_dgram_id = fragmenter.current_dgram_id
+    fragments = fragmenter.fragment(data)
+    iovecs = other.fragment_iovecs(bytearray(data))
+
+    assert len(fragments) == len(iovecs)
+    for fragment, (header, payload) in zip(fragments, iovecs):
+        assert isinstance(payload, memoryview)
+        assert bytes(fragment) == header + payload
+
+
+@pytest.mark.parametrize("size", [1, MAX_FRAG_PAYLOAD])
+def test_single_fragment_fast_path(size):
+    data = random.randbytes(size)
+    fragmenter = fragmentation.Fragmenter()
+    other = fragmentation.Fragmenter()
+    dgram_id = other.current_dgram_id = fragmenter.current_dgram_id
+    (fragment,) = fragmenter.fragment(data)
+    ((header, payload),) = other.fragment_iovecs(data)
+    assert bytes(fragment) == header + payload
+    assert fragmentation.parse_header(fragment[:5]) == (dgram_id, True, 0)
+
+    reassembler = fragmentation.Reassembler()
+    assert reassembler.reserve_fragment(fragment[:5], size, ADDR) == None
+    assert reassembler.add_fragment_to_datagram(bytes(fragment), ADDR)
+    assert len(reassembler.datagrams) == 0
+    assert reassembler.check_for_completed_datagrams() == (data, ADDR)
+
+
+def test_single_fragment_fec_repair_is_ignored():
+    fragmenter = fragmentation.Fragmenter(fec_data_fragments=4, fec_repair_fragments=1)
+    reassembler = fragmentation.Reassembler()
+
+    data = random.randbytes(100)
+    fragment, repair = fragmenter.fragment(data)
+    assert reassembler.add_fragment_to_datagram(bytes(fragment), ADDR)
+    assert not reassembler.add_fragment_to_datagram(bytes(repair), ADDR)
+    assert reassembler.check_for_completed_datagrams() == (data, ADDR)
+    assert reassembler.check_for_completed_datagrams() == None
+    assert len(reassembler.datagrams) == 0
+
+
+def test_completion_reported_by_add_fragment():
+    fragmenter = fragmentation.Fragmenter()
+    reassembler = fragmentation.Reassembler()
+
+    data = random.randbytes(MAX_FRAG_PAYLOAD * 2 + 1)
+    first, second, fin = fragmenter.fragment(data)
+
+    assert not reassembler.add_fragment_to_datagram(bytes(fin), ADDR)
+    assert not reassembler.add_fragment_to_datagram(bytes(first), ADDR)
+    # NOTE: A duplicate must not be counted as a new fragment
+    assert not reassembler.add_fragment_to_datagram(bytes(first), ADDR)
+    assert reassembler.check_for_completed_datagrams() == None
+    assert reassembler.add_fragment_to_datagram(bytes(second), ADDR)
+
+    assert reassembler.check_for_completed_datagrams() == (data, ADDR)
+    assert len(reassembler.datagrams) == 0
+
+
+def test_several_completed_datagrams_are_queued():
+    fragmenter = fragmentation.Fragmenter()
+    reassembler = fragmentation.Reassembler()
+
+    payloads = [random.randbytes(100 * i + 1) for i in range(5)]
+    for payload in payloads:
+        for frag in fragmenter.fragment(payload):
+            reassembler.add_fragment_to_datagram(bytes(frag), ADDR)
+
+    for payload in payloads:
+        assert reassembler.check_for_completed_datagrams() == (payload, ADDR)
+    assert reassembler.check_for_completed_datagrams() == None
+
+
+def test_timeout_old_datagrams(monkeypatch):
+    class FakeTime:
+        now = 0.0
+
+        @staticmethod
+        def perf_counter():
+            return FakeTime.now
+
+    monkeypatch.setattr(fragmentation, "time", FakeTime)
+    monkeypatch.setattr(fragmentation.config, "fragment_timeout", 5)
+
+    fragmenter = fragmentation.Fragmenter()
+    reassembler = fragmentation.Reassembler()
+    payload = bytes(MAX_FRAG_PAYLOAD * 3)
+    frags_a = fragmenter.fragment(payload)
+    frags_b = fragmenter.fragment(payload)
+
+    reassembler.add_fragment_to_datagram(bytes(frags_a[0]), ADDR)
+    FakeTime.now = 3.0
+    reassembler.add_fragment_to_datagram(bytes(frags_b[0]), ADDR)
+    FakeTime.now = 4.0
+    reassembler.add_fragment_to_datagram(bytes(frags_a[1]), ADDR)
+
+    FakeTime.now = 7.9
+    reassembler.timeout_old_datagrams()
+    assert len(reassembler.datagrams) == 2
+
+    FakeTime.now = 8.0
+    reassembler.timeout_old_datagrams()
+    assert len(reassembler.datagrams) == 1
+
+    # NOTE: The remaining datagram is the one refreshed at t = 4
+    reassembler.add_fragment_to_datagram(bytes(frags_a[2]), ADDR)
+    assert reassembler.check_for_completed_datagrams() == (payload, ADDR)
+
+
+def test_fin_before_fragment_size_is_known():
+    fragmenter = fragmentation.Fragmenter()
+    reassembler = fragmentation.Reassembler()
+
+    data = random.randbytes(MAX_FRAG_PAYLOAD * 2 + 10)
+    first, second, fin = fragmenter.fragment(data)
+
+    # NOTE: The offset of the FIN fragment is unknown until a non-FIN fragment has arrived
+    assert reassembler.reserve_fragment(fin[:5], len(fin) - 5, ADDR) == None
+    assert not reassembler.add_fragment_to_datagram(fin, ADDR)
+    assert not reassembler.add_fragment_to_datagram(second, ADDR)
+    assert reassembler.add_fragment_to_datagram(first, ADDR)
+    assert reassembler.check_for_completed_datagrams() == (data, ADDR)
+
+
+def test_reserve_and_commit_fragment():
+    fragmenter = fragmentation.Fragmenter()
+    reassembler = fragmentation.Reassembler()
+
+    data = random.randbytes(MAX_FRAG_PAYLOAD * 4 + 3)
+    completed = False
+    for frag in reversed(fragmenter.fragment(data)):
+        header, payload = frag[:5], frag[5:]
+        placement = reassembler.reserve_fragment(header, len(payload), ADDR)
+        if placement == None:
+            completed = reassembler.add_fragment_to_datagram(frag, ADDR)
+            continue
+
+        buffer, offset = placement
+        buffer[offset : offset + len(payload)] = payload
+        completed = reassembler.commit_fragment(header, ADDR)
+
+    assert completed
+    completed_data, addr = reassembler.check_for_completed_datagrams()
+    assert isinstance(completed_data, bytearray)
+    assert completed_data == data
+
+
+def test_forged_offset_does_not_grow_buffer():
+    reassembler = fragmentation.Reassembler()
+    payload = bytes(60000)
+    header = fragmentation.pack_header(7, False, 2**fragmentation.FRAG_IDX_BITS - 1)
+
+    tracemalloc.start()
+    assert reassembler.reserve_fragment(header, len(payload), ADDR) == None
+    assert not reassembler.add_fragment_to_datagram(header + payload, ADDR)
+    # NOTE: A repair fragment announcing a datagram larger than any peer could send
+    fields = fragmentation.FEC_FIELDS.pack(
+        fragmentation.EXT_FLAG_FEC, 4, 1, 0, 0, 1000, 2**32 - 1
+    )
+    repair = fragmentation.pack_header(8, False, 0, extension=True) + fields
+    assert not reassembler.add_fragment_to_datagram(repair + bytes(1000), ADDR)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert peak < 1_000_000
+    assert all(
+        len(entry.buffer) <= reassembler.max_buffer_size
+        for entry in reassembler.datagrams.values()
+    )
+
+
+def test_fragment_size_follows_mtu():
+    data = random.randbytes(10000)
+    reassembler = fragmentation.Reassembler()
+
+    for mtu in [64, 512, 1500, 9000]:
+        fragmenter = fragmentation.Fragmenter(mtu)
+        fragments = fragmenter.fragment(data)
+
+        assert fragmenter.max_frag_payload == mtu - fragmentation.TOTAL_HEADER_SIZE
+        assert len(fragments) == -(-len(data) // fragmenter.max_frag_payload)
+        assert all(
+            len(frag) <= mtu - fragmentation.UDP_IP_HEADER_SIZE for frag in fragments
+        )
+        assert reassemble(reassembler, fragments) == (data, ADDR)
+
+
+def test_fragment_for_path_mtu():
+    data = random.randbytes(10000)
+    fragmenter = fragmentation.Fragmenter(1500)
+    reassembler = fragmentation.Reassembler()
+
+    for mtu in [576, 1280, 9000]:
+        frag_payload, dgram_payload = fragmenter.payload_limits(mtu)
+        assert frag_payload == mtu - fragmentation.TOTAL_HEADER_SIZE
+        for fragments in [
+            fragmenter.fragment(data, mtu),
+            fragmenter.fragment_iovecs(data, mtu),
+        ]:
+            fragments = [
+                b"".join(frag) if isinstance(frag, list) else frag for frag in fragments
+            ]
+            assert len(fragments) == -(-len(data) // frag_payload)
+            assert all(
+                len(frag) <= mtu - fragmentation.UDP_IP_HEADER_SIZE
+                for frag in fragments
+            )
+            assert reassemble(reassembler, fragments) == (data, ADDR)
+
+    with pytest.raises(ValueError):
+        fragmenter.payload_limits(fragmentation.MTU_MIN - 1)
+    with pytest.raises(ValueError):
+        fragmenter.fragment(bytes(fragmenter.payload_limits(576)[1] + 1), 576)
+
+
+@pytest.mark.parametrize("data_fragments, repair_fragments", [(1, 1), (4, 1), (8, 3)])
+def test_fec_recovers_lost_fragments(data_fragments, repair_fragments):
+    fragmenter = fragmentation.Fragmenter(
+        fec_data_fragments=data_fragments, fec_repair_fragments=repair_fragments
+    )
+    reassembler = fragmentation.Reassembler()
+    block_size = data_fragments + repair_fragments
+
+    for size in [1, fragmenter.max_frag_payload * 20 + 17]:
+        data = random.randbytes(size)
+        fragments = fragmenter.fragment(data)
+        frag_count = -(-size // fragmenter.max_frag_payload)
+        data_frags, repair_frags = fragments[:frag_count], fragments[frag_count:]
+
+        # NOTE: Drop repair_fragments fragments of every block, data or repair
+        kept = []
+        for block in range(-(-frag_count // data_fragments)):
+            block_frags = (
+                data_frags[block * data_fragments : (block + 1) * data_fragments]
+                + repair_frags[
+                    block * repair_fragments : (block + 1) * repair_fragments
+                ]
+            )
+            kept.extend(random.sample(block_frags, len(block_frags) - repair_fragments))
+        random.shuffle(kept)
+
+        assert reassemble(reassembler, kept) == (data, ADDR)
+        assert len(reassembler.datagrams) == 0
+
+
+def test_fec_unneeded_repair_fragments_are_ignored():
+    fragmenter = fragmentation.Fragmenter(fec_data_fragments=4, fec_repair_fragments=2)
+    reassembler = fragmentation.Reassembler()
+
+    data = random.randbytes(fragmenter.max_frag_payload * 6)
+    assert reassemble(reassembler, fragmenter.fragment(data)) == (data, ADDR)
+    assert reassembler.check_for_completed_datagrams() == None
+    assert len(reassembler.datagrams) == 0
+
+
+def test_fec_too_many_losses():
+    fragmenter = fragmentation.Fragmenter(fec_data_fragments=4, fec_repair_fragments=1)
+    reassembler = fragmentation.Reassembler()
+
+    fragments = fragmenter.fragment(bytes(fragmenter.max_frag_payload * 4))
+    assert reassemble(reassembler, fragments[2:]) == None
+
+
+def test_fec_invalid_configuration():
+    with pytest.raises(ValueError):
+        fragmentation.Fragmenter(fec_data_fragments=4, fec_repair_fragments=0)
+    with pytest.raises(ValueError):
+        fragmentation.Fragmenter(fec_data_fragments=250, fec_repair_fragments=10)
+
+
+def test_nack_roundtrip():
+    for missing, tail in [([], 7), ([0], 1), ([3, 4, 17, 2047], 2048), ([1, 9], 12)]:
+        nack = fragmentation.nack_fragment(42, 1, missing, tail)
+        header = nack[: fragmentation.MW_HEADER_SIZE]
+
+        assert fragmentation.has_extension(header)
+        assert fragmentation.parse_header(header)[0] == 42
+        assert fragmentation.parse_nack(nack[fragmentation.MW_HEADER_SIZE :]) == (
+            missing,
+            tail,
+        )
+
+
+def test_nack_repairs_lost_fragments():
+    sender_addr = ("127.0.0.1", 5001)
+    fragmenter = fragmentation.Fragmenter()
+    cache = fragmentation.RetransmitCache(max_rounds=2)
+    sender = fragmentation.Reassembler(nack_rounds=2)
+    receiver = fragmentation.Reassembler(nack_rounds=2, nack_interval=0)
+
+    data = random.randbytes(MAX_FRAG_PAYLOAD * 9 + 5)
+    fragments = fragmenter.fragment(data)
+    cache.add(fragments)
+
+    # NOTE: The FIN fragment is lost as well, so everything after the last received fragment must be requested
+    lost = [2, 5, 9]
+    for frag_idx, frag in enumerate(fragments):
+        if frag_idx not in lost:
+            receiver.add_fragment_to_datagram(bytes(frag), sender_addr)
+    assert receiver.check_for_completed_datagrams() == None
+
+    [(nack, addr)] = receiver.nacks_due()
+    assert addr == sender_addr
+    assert not sender.add_fragment_to_datagram(nack, ADDR)
+    [(addr, dgram_id, missing, tail)] = sender.nack_requests
+    assert (addr, missing, tail) == (ADDR, [2, 5], 9)
+
+    repairs = cache.repair(dgram_id, missing, tail)
+    assert repairs == [fragments[i] for i in lost]
+    assert reassemble(receiver, repairs, sender_addr) == (data, sender_addr)
+    assert receiver.nacks_due() == []
+    assert receiver.next_nack_time() == None
+
+
+def test_fragments_after_completion_are_dropped():
+    fragmenter = fragmentation.Fragmenter()
+    receiver = fragmentation.Reassembler(nack_rounds=3, nack_interval=0)
+
+    data = random.randbytes(MAX_FRAG_PAYLOAD * 3 + 5)
+    fragments = fragmenter.fragment(data)
+    assert reassemble(receiver, fragments) == (data, ADDR)
+
+    # NOTE: A duplicated fragment must neither start a new entry that is NACKed, nor deliver the datagram again
+    for frag in [fragments[1], fragments[0], fragments[-1]]:
+        assert not receiver.add_fragment_to_datagram(bytes(frag), ADDR)
+        header = frag[: fragmentation.MW_HEADER_SIZE]
+        assert receiver.reserve_fragment(header, len(frag) - len(header), ADDR) == None
+    assert len(receiver.datagrams) == 0
+    assert receiver.nacks_due() == []
+    assert receiver.check_for_completed_datagrams() == None
+
+
+def test_nack_rounds_are_bounded():
+    fragmenter = fragmentation.Fragmenter()
+    cache = fragmentation.RetransmitCache(max_rounds=1)
+    receiver = fragmentation.Reassembler(nack_rounds=2, nack_interval=0)
+
+    fragments = fragmenter.fragment(bytes(MAX_FRAG_PAYLOAD * 3))
+    cache.add(fragments)
+    receiver.add_fragment_to_datagram(bytes(fragments[0]), ADDR)
+
+    assert len(receiver.nacks_due()) == 1
+    assert len(receiver.nacks_due()) == 1
+    assert receiver.nacks_due() == []
+
+    dgram_id = fragmentation.parse_header(fragments[0])[0]
+    assert len(cache.repair(dgram_id, [1], 2)) == 2
+    assert cache.repair(dgram_id, [1], 2) == []
+
+
+def test_retransmit_cache_is_bounded():
+    fragmenter = fragmentation.Fragmenter()
+    datagrams = [fragmenter.fragment(bytes(MAX_FRAG_PAYLOAD * 4)) for _ in range(3)]
+    datagram_size = sum(len(frag) for frag in datagrams[0])
+    cache = fragmentation.RetransmitCache(max_bytes=datagram_size * 2)
+
+    for fragments in datagrams:
+        cache.add(fragments)
+
+    assert cache.size <= datagram_size * 2
+    first_id = fragmentation.parse_header(datagrams[0][0])[0]
+    last_id = fragmentation.parse_header(datagrams[2][0])[0]
+    assert cache.repair(first_id, [0], 4) == []
+    assert cache.repair(last_id, [0], 4) == [datagrams[2][0]]
+
+
+def partial_datagrams(fragmenter, count, frag_count=4):
+    """
+    Returns the fragments of count datagrams, without their FIN fragments
+    """
+    return [
+        fragmenter.fragment(bytes(MAX_FRAG_PAYLOAD * frag_count))[:-1]
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize("policy, evicted", [("lru", 1), ("oldest", 0)])
+def test_reassembler_evicts_per_peer_datagrams(policy, evicted):
+    fragmenter = fragmentation.Fragmenter()
+    reassembler = fragmentation.Reassembler(
+        max_peer_datagrams=2, eviction_policy=policy
+    )
+    datagrams = partial_datagrams(fragmenter, 3)
+
+    reassembler.add_fragment_to_datagram(bytes(datagrams[0][0]), ADDR)
+    reassembler.add_fragment_to_datagram(bytes(datagrams[1][0]), ADDR)
+    # NOTE: The first datagram is the oldest, but not the least recently used
+    reassembler.add_fragment_to_datagram(bytes(datagrams[0][1]), ADDR)
+    reassembler.add_fragment_to_datagram(bytes(datagrams[2][0]), ADDR)
+
+    dgram_ids = [fragmentation.parse_header(frags[0])[0] for frags in datagrams]
+    assert (ADDR, dgram_ids[evicted]) not in reassembler.datagrams
+    assert len(reassembler.datagrams) == 2
+    assert reassembler.evictions.peer_datagrams == 1
+    # NOTE: Other peers are not affected by the limit
+    reassembler.add_fragment_to_datagram(bytes(datagrams[2][1]), ("127.0.0.1", 5001))
+    assert len(reassembler.datagrams) == 3
+
+
+def test_reassembler_evicts_by_memory():
+    fragmenter = fragmentation.Fragmenter()
+    datagram_size = MAX_FRAG_PAYLOAD * 4
+    reassembler = fragmentation.Reassembler(
+        max_bytes=datagram_size * 3, max_peer_bytes=datagram_size * 2
+    )
+
+    for frags in partial_datagrams(fragmenter, 3):
+        for frag in frags:
+            reassembler.add_fragment_to_datagram(bytes(frag), ADDR)
+    assert reassembler.evictions.peer_bytes == 1
+    assert reassembler.peers[ADDR].size <= datagram_size * 2
+
+    for port in [5001, 5002]:
+        for frags in partial_datagrams(fragmenter, 1):
+            for frag in frags:
+                reassembler.add_fragment_to_datagram(bytes(frag), ("127.0.0.1", port))
+    assert reassembler.evictions.total_bytes == 1
+    assert reassembler.evictions.bytes > 0
+    assert reassembler.size <= datagram_size * 3
+    assert reassembler.size == sum(
+        entry.memory_size() for entry in reassembler.datagrams.values()
+    )
+
+    # NOTE: Completed datagrams are no longer accounted for
+    data = random.randbytes(MAX_FRAG_PAYLOAD * 2)
+    assert reassemble(reassembler, fragmenter.fragment(data)) == (data, ADDR)
+    assert reassembler.size == sum(
+        entry.memory_size() for entry in reassembler.datagrams.values()
+    )
+
+
+def test_reassembler_limits_checked_before_allocating():
+    reassembler = fragmentation.Reassembler(
+        max_bytes=2**26, max_peer_bytes=2**24, max_peer_datagrams=0
+    )
+    payload = bytes(60000)
+    header = fragmentation.pack_header(7, False, 2**fragmentation.FRAG_IDX_BITS - 1)
+
+    tracemalloc.start()
+    # NOTE: Given to add_fragment_to_datagram next, which evicts the datagram
+    assert reassembler.reserve_fragment(header, len(payload), ADDR) == None
+    assert reassembler.evictions.peer_bytes == 0
+    assert not reassembler.add_fragment_to_datagram(header + payload, ADDR)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 1_000_000
+    assert reassembler.evictions.peer_bytes == 1
+    assert len(reassembler.datagrams) == 0
+    assert reassembler.size == 0
+
+    # NOTE: A datagram that fits the peer limit but not the total limit
+    fragmenter = fragmentation.Fragmenter()
+    reassembler = fragmentation.Reassembler(
+        max_bytes=MAX_FRAG_PAYLOAD * 3, max_peer_bytes=0
+    )
+    fragments = fragmenter.fragment(bytes(MAX_FRAG_PAYLOAD * 5))
+    assert not reassembler.add_fragment_to_datagram(bytes(fragments[1]), ADDR)
+    assert not reassembler.add_fragment_to_datagram(bytes(fragments[-1]), ADDR)
+    assert reassembler.evictions.total_bytes == 1
+    assert len(reassembler.datagrams) == 0
+
+
+def test_reassembler_accounting_after_timeout(monkeypatch):
+    class FakeTime:
+        now = 0.0
+
+        @staticmethod
+        def perf_counter():
+            return FakeTime.now
+
+    monkeypatch.setattr(fragmentation, "time", FakeTime)
+    monkeypatch.setattr(fragmentation.config, "fragment_timeout", 5)
+
+    fragmenter = fragmentation.Fragmenter()
+    reassembler = fragmentation.Reassembler()
+    for frags in partial_datagrams(fragmenter, 5):
+        reassembler.add_fragment_to_datagram(bytes(frags[0]), ADDR)
+    assert reassembler.size > 0
+
+    FakeTime.now = 5.0
+    reassembler.timeout_old_datagrams()
+    assert reassembler.size == 0
+    assert reassembler.peers == {}
+
+
+def test_completed_keys_are_bounded():
+    fragmenter = fragmentation.Fragmenter(fec_data_fragments=4, fec_repair_fragments=1)
+    reassembler = fragmentation.Reassembler(max_peer_datagrams=16)
+
+    for _ in range(100):
+        fragment, repair = fragmenter.fragment(random.randbytes(100))
+        assert reassembler.add_fragment_to_datagram(bytes(fragment), ADDR)
+    assert len(reassembler.completed_keys) == 16
+    # NOTE: The most recent datagrams are still remembered
+    assert not reassembler.add_fragment_to_datagram(bytes(repair), ADDR)
+    assert len(reassembler.datagrams) == 0
+
+    unlimited = fragmentation.Reassembler(max_peer_datagrams=0)
+    assert unlimited.max_completed_keys == fragmentation.MAX_COMPLETED_KEYS
+
+
+def test_reassembler_invalid_eviction_policy():
+    with pytest.raises(ValueError):
+        fragmentation.Reassembler(eviction_policy="random")
+
+
+def test_store_entry_tracks_received_fragments():
+    fragmenter = fragmentation.Fragmenter()
+    reassembler = fragmentation.Reassembler()
+    fragments = fragmenter.fragment(bytes(MAX_FRAG_PAYLOAD * 5))
+    for frag in [fragments[0], fragments[3]]:
+        assert not reassembler.add_fragment_to_datagram(bytes(frag), ADDR)
+
+    (entry,) = reassembler.datagrams.values()
+    assert not hasattr(entry, "__dict__")
+    assert entry.received_frag_count == 2
+    assert [entry.has_fragment(i) for i in range(5)] == [
+        True,
+        False,
+        False,
+        True,
+        False,
+    ]
+    assert entry.missing_fragments() == ([1, 2], 4)
+
+
+def test_compact_header_roundtrip():
+    for dgram_id, is_fin, frag_idx, extension, size in [
+        (fragmentation.NO_DGRAM_ID, True, 0, False, 1),
+        (5, True, 0, False, 2),
+        (200, False, 0, True, 3),
+        (2**14 - 1, False, 127, False, 4),
+        (2**14 - 1, True, 2047, False, 5),
+    ]:
+        header = fragmentation.pack_header(
+            dgram_id, is_fin, frag_idx, extension, compact=True
+        )
+        assert len(header) == size
+        assert fragmentation.unpack_header(header + b"payload", compact=True) == (
+            dgram_id,
+            is_fin,
+            frag_idx,
+            extension,
+            size,
+        )
+
+    # NOTE: Reserved bits (a newer header version), truncated varints and an index without datagram id
+    for header in [b"\xa1", b"\x88", b"\x88\x80", b"\xb0\x01"]:
+        assert fragmentation.unpack_header(header, compact=True) == None
+
+
+@pytest.mark.parametrize("fec_data_fragments", [0, 4])
+def test_compact_headers_fragment_and_reassemble(fec_data_fragments):
+    fragmenter = fragmentation.Fragmenter(
+        fec_data_fragments=fec_data_fragments, compact_headers=True
+    )
+    reassembler = fragmentation.Reassembler(compact_headers=True)
+
+    (single,) = fragmentation.Fragmenter(compact_headers=True).fragment(b"x")
+    assert single == b"\xa0x"
+
+    for size in [1, MAX_FRAG_PAYLOAD, MAX_FRAG_PAYLOAD * 200 + 3]:
+        data = random.randbytes(size)
+        fragments = fragmenter.fragment(data)
+        assert all(len(frag) <= MAX_FRAG_PAYLOAD + 5 for frag in fragments)
+        assert reassemble(reassembler, fragments) == (data, ADDR)
+
+
+def test_compact_headers_drop_legacy_fragments():
+    reassembler = fragmentation.Reassembler(compact_headers=True)
+    fragments = fragmentation.Fragmenter().fragment(random.randbytes(100))
+    assert reassemble(reassembler, fragments) == None
+    assert len(reassembler.datagrams) == 0
+
+
+def test_bundle_roundtrip():
+    messages = [b"a", random.randbytes(100), b"", b"last"]
+    reassembler = fragmentation.Reassembler()
+    assert reassembler.add_fragment_to_datagram(
+        fragmentation.bundle_fragment(messages), ADDR
+    )
+    for message in messages:
+        assert reassembler.check_for_completed_datagrams() == (message, ADDR)
+    assert reassembler.check_for_completed_datagrams() == None
+
+    # NOTE: A truncated datagram is dropped, together with everything after it
+    bundle = fragmentation.bundle_fragment([b"abc", b"defg"], compact=True)
+    assert fragmentation.parse_bundle(bundle[2:-1]) == [b"abc"]
+
+
+def test_aggregator_holds_datagrams(monkeypatch):
+    class FakeTime:
+        now = 0.0
+
+        @staticmethod
+        def perf_counter():
+            return FakeTime.now
+
+    monkeypatch.setattr(fragmentation, "time", FakeTime)
+    aggregator = fragmentation.Aggregator(mtu=100, hold_time=1.0)
+    other = ("127.0.0.1", 5001)
+
+    assert aggregator.capacity == 100 - 28 - 5 - 1
+    assert aggregator.can_hold(aggregator.capacity - 2)
+    assert not aggregator.can_hold(aggregator.capacity - 1)
+
+    assert aggregator.add(b"x" * 20, ADDR) == []
+    assert aggregator.add(b"y" * 20, ADDR) == []
+    FakeTime.now = 0.5
+    assert aggregator.add(b"z", other) == []
+    assert aggregator.next_deadline() == 1.0
+    # NOTE: The datagram does not fit in the bundle for ADDR, and starts a new bundle
+    assert aggregator.add(b"w" * 30, ADDR) == [([b"x" * 20, b"y" * 20], ADDR)]
+    # NOTE: Nothing more fits in the bundle, so it is sent right away
+    assert aggregator.add(b"v" * 30, ADDR) == [([b"w" * 30, b"v" * 30], ADDR)]
+
+    FakeTime.now = 1.5
+    assert aggregator.add(b"u", ADDR) == []
+    assert aggregator.due() == [([b"z"], other)]
+    assert aggregator.flush() == [([b"u"], ADDR)]
+    assert aggregator.next_deadline() == None
+
+
+def compressible(size):
+    return (b'{"id": 7, "status": "ok", "text": "position report"}' * size)[:size]
+
+
+@pytest.mark.parametrize("codec", compression.available_codecs())
+@pytest.mark.parametrize("compact_headers", [False, True])
+def test_compression_fragment_and_reassemble(codec, compact_headers):
+    fragmenter = fragmentation.Fragmenter(
+        compact_headers=compact_headers, compression_codec=codec
+    )
+    reassembler = fragmentation.Reassembler(compact_headers=compact_headers)
+
+    for data in [compressible(200), compressible(MAX_DGRAM_PAYLOAD // 2)]:
+        fragments = fragmenter.fragment(data)
+        assert sum(len(frag) for frag in fragments) < len(data)
+        random.shuffle(fragments)
+        assert reassemble(reassembler, fragments) == (data, ADDR)
+
+    data = compressible(MAX_FRAG_PAYLOAD * 50)
+    fragments = [b"".join(iovec) for iovec in fragmenter.fragment_iovecs(data)]
+    assert reassemble(reassembler, fragments) == (data, ADDR)
+
+
+def test_compression_is_skipped():
+    fragmenter = fragmentation.Fragmenter(
+        compression_codec="zlib", compression_threshold=100
+    )
+
+    # NOTE: Below the threshold, and incompressible
+    for data in [compressible(99), random.randbytes(1000)]:
+        fragments = fragmenter.fragment(data)
+        assert not any(fragmentation.unpack_header(frag)[3] for frag in fragments)
+        assert reassemble(fragmentation.Reassembler(), fragments) == (data, ADDR)
+
+    with pytest.raises(ValueError):
+        fragmentation.Fragmenter(compression_codec="gzip")
+
+
+def test_compression_with_fec_and_nacks():
+    fragmenter = fragmentation.Fragmenter(
+        fec_data_fragments=2, fec_repair_fragments=2, compression_codec="zlib"
+    )
+    # NOTE: Hex digits compress to a bit more than half their size
+    data = random.randbytes(MAX_FRAG_PAYLOAD * 4).hex().encode()
+    fragments = fragmenter.fragment(data)
+    frag_count = sum(
+        1 for frag in fragments if frag[5] == fragmentation.EXT_FLAG_COMPRESSED
+    )
+    assert frag_count > 2
+
+    # NOTE: The first block is recovered from its repair fragments alone, which carry the codec as well
+    kept = fragments[2:frag_count] + fragments[frag_count:]
+    assert reassemble(fragmentation.Reassembler(), kept) == (data, ADDR)
+
+    cache = fragmentation.RetransmitCache()
+    cache.add(fragments)
+    dgram_id = fragmentation.parse_header(fragments[0])[0]
+    repairs = cache.repair(dgram_id, [1], frag_count)
+    assert repairs == [fragments[1]]
+
+
+def test_corrupt_compressed_datagram_is_dropped():
+    fragmenter = fragmentation.Fragmenter(compression_codec="zlib")
+    reassembler = fragmentation.Reassembler()
+
+    (fragment,) = fragmenter.fragment(compressible(500))
+    fragment[-4:] = b"\xff\xff\xff\xff"
+    assert not reassembler.add_fragment_to_datagram(bytes(fragment), ADDR)
+    assert reassembler.check_for_completed_datagrams() == None
+
+    assert compression.decompress(99, b"", 10) == None
+    zlib_id = compression.CODEC_IDS["zlib"]
+    compressed = compression.Compressor("zlib").compress(memoryview(bytes(1000)))
+    assert compression.decompress(zlib_id, compressed, 1000) == bytes(1000)
+    with pytest.raises(ValueError):
+        compression.decompress(zlib_id, compressed, 999)
+
+
+def test_decompression_is_bounded_by_reassembly_limits():
+    fragmenter = fragmentation.Fragmenter(compression_codec="zlib")
+    reassembler = fragmentation.Reassembler(max_peer_bytes=100000)
+
+    # NOTE: Single-fragment and reassembled compressed datagrams
+    for data in [bytes(200000), random.randbytes(5000) + bytes(200000)]:
+        assert reassemble(reassembler, fragmenter.fragment(data)) == None
+    assert reassembler.evictions.peer_bytes == 2
+
+    data = random.randbytes(5000) + bytes(50000)
+    assert reassemble(reassembler, fragmenter.fragment(data)) == (data, ADDR)
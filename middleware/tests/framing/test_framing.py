@@ -0,0 +1,101 @@
+import pytest
+import random
+import socket
+import middleware.framing.framing as framing
+from middleware.configuration.config import config
+
+
+def test_messages_roundtrip(tcp_connection):
+    sender, receiver = tcp_connection
+    reader = framing.MessageReader(buffer_size=16)
+    messages = [b"", b"a", random.randbytes(100), random.randbytes(100000), b"last"]
+
+    framing.send_buffers(sender, framing.frame_messages(messages))
+    sender.shutdown(socket.SHUT_WR)
+    for message in messages:
+        assert reader.read(receiver) == message
+    assert reader.pending() == 0
+    assert reader.read(receiver) == None
+
+
+def test_partial_message_is_resumed(tcp_connection):
+    sender, receiver = tcp_connection
+    receiver.settimeout(0.05)
+    reader = framing.MessageReader(buffer_size=4)
+    message = random.randbytes(1000)
+    data = b"".join(framing.frame_messages([message, b"next"]))
+
+    # NOTE: Stops in the middle of the length prefix, then in the middle of the message
+    for chunk in [data[:2], data[2:500]]:
+        sender.sendall(chunk)
+        with pytest.raises(TimeoutError):
+            reader.read(receiver)
+    sender.sendall(data[500:])
+    assert reader.read(receiver) == message
+    assert reader.read(receiver) == b"next"
+
+
+def test_connection_closed_in_message(tcp_connection):
+    sender, receiver = tcp_connection
+    reader = framing.MessageReader()
+
+    sender.sendall(b"".join(framing.frame_messages([bytes(10)]))[:-1])
+    sender.shutdown(socket.SHUT_WR)
+    with pytest.raises(ConnectionError):
+        reader.read(receiver)
+
+
+def test_message_size_limit(tcp_connection):
+    sender, receiver = tcp_connection
+    reader = framing.MessageReader()
+
+    framing.send_buffers(sender, framing.frame_messages([bytes(101)]))
+    with pytest.raises(ValueError):
+        reader.read(receiver, max_size=100)
+    assert reader.read(receiver, max_size=101) == bytes(101)
+
+
+def test_oversized_announced_length_is_rejected(tcp_connection):
+    sender, receiver = tcp_connection
+    reader = framing.MessageReader()
+
+    # NOTE: Only the header of a 4 GiB message is sent, the default limit rejects it before a buffer is allocated
+    sender.sendall(framing.MESSAGE_LENGTH.pack(framing.MAX_MESSAGE_SIZE))
+    with pytest.raises(ValueError):
+        reader.read(receiver)
+    assert len(reader.buffer) == framing.INITIAL_BUFFER_SIZE
+    assert config.max_message_size < framing.MAX_MESSAGE_SIZE
+
+
+def test_take_returns_bytes_after_message(tcp_connection):
+    sender, receiver = tcp_connection
+    reader = framing.MessageReader()
+
+    sender.sendall(b"".join(framing.frame_messages([b"header"])) + b"raw data")
+    assert reader.read(receiver) == b"header"
+    assert reader.take(3) == b"raw"
+    assert reader.take(100) == b" data"
+    assert reader.pending() == 0
+    assert reader.take(100) == b""
+
+
+def test_send_buffers_after_partial_sends():
+    class TrickleSocket:
+        def __init__(self):
+            self.calls = 0
+            self.data = bytearray()
+
+        def sendmsg(self, buffers):
+            assert len(buffers) <= framing.IOV_MAX
+            self.calls += 1
+            chunk = b"".join(buffers)[:7]
+            self.data += chunk
+            return len(chunk)
+
+    sock = TrickleSocket()
+    messages = [random.randbytes(size) for size in [0, 3, 20, 1]] * 500
+    buffers = framing.frame_messages(messages)
+
+    assert framing.send_buffers(sock, buffers) == len(sock.data)
+    assert sock.data == b"".join(buffers)
+    assert sock.calls == -(-len(sock.data) // 7)
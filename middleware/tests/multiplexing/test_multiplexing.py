@@ -0,0 +1,129 @@
+import pytest
+import random
+import threading
+import time
+import types
+import middleware.multiplexing.multiplexing as multiplexing
+
+
+@pytest.fixture
+def muxes(reliable_connection):
+    client, server = reliable_connection
+    client_mux = multiplexing.Multiplexer(client, chunk_size=4096)
+    server_mux = multiplexing.Multiplexer(server, chunk_size=4096)
+    yield client_mux, server_mux
+    client_mux.close()
+    server_mux.close()
+
+
+def recv_all(stream: multiplexing.Stream) -> bytes:
+    chunks = []
+    while True:
+        chunk = stream.recv(2**20)
+        if chunk == b"":
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def test_scheduler_priorities_and_weights():
+    scheduler = multiplexing.StreamScheduler()
+    urgent = types.SimpleNamespace(stream_id=1, priority=0, weight=1)
+    heavy = types.SimpleNamespace(stream_id=2, priority=1, weight=3)
+    light = types.SimpleNamespace(stream_id=3, priority=1, weight=1)
+
+    order = []
+    for ready in [[heavy, light, urgent]] + [[heavy, light]] * 8:
+        stream = scheduler.select(ready)
+        scheduler.charge(stream, 100)
+        order.append(stream.stream_id)
+    assert order[0] == 1
+    assert order[1:].count(2) == 6
+    assert order[1:].count(3) == 2
+    assert scheduler.select([]) == None
+
+
+def test_streams_in_both_directions(muxes):
+    client_mux, server_mux = muxes
+    data = {stream_id: random.randbytes(100000) for stream_id in [1, 2, 3]}
+
+    streams = [client_mux.open_stream(stream_id) for stream_id in data]
+    for stream in streams:
+        stream.sendall(data[stream.stream_id])
+        stream.close()
+
+    for _ in data:
+        stream = server_mux.accept_stream(timeout=5)
+        received = recv_all(stream)
+        assert received == data[stream.stream_id]
+        stream.sendall(received[::-1])
+        stream.close()
+    for stream in streams:
+        assert recv_all(stream) == data[stream.stream_id][::-1]
+
+
+def test_urgent_message_is_not_blocked_by_transfer(muxes):
+    client_mux, server_mux = muxes
+    bulk = client_mux.open_stream(1, priority=1)
+    control = client_mux.open_stream(2, priority=0)
+    bulk_data = random.randbytes(10 * 2**20)
+    received = bytearray()
+
+    def receive_bulk():
+        stream = server_mux.open_stream(1)
+        received.extend(recv_all(stream))
+
+    thread = threading.Thread(target=receive_bulk)
+    thread.start()
+    sender = threading.Thread(target=lambda: (bulk.sendall(bulk_data), bulk.close()))
+    sender.start()
+    while bulk._sent == 0:
+        time.sleep(0.001)
+    control.sendall(b"stop")
+    server_control = server_mux.open_stream(2)
+    server_control.settimeout(5)
+    assert server_control.recv(100) == b"stop"
+    # NOTE: The command overtook most of the transfer queued before it
+    assert bulk._sent < len(bulk_data)
+
+    sender.join()
+    thread.join()
+    assert received == bulk_data
+
+
+def test_slow_reader_does_not_block_other_streams(muxes):
+    client_mux, server_mux = muxes
+    slow = client_mux.open_stream(1)
+    fast = client_mux.open_stream(2)
+    slow_data = random.randbytes(4 * client_mux.window)
+    sender = threading.Thread(target=slow.sendall, args=(slow_data,))
+    sender.start()
+
+    server_fast = server_mux.open_stream(2)
+    server_fast.settimeout(5)
+    for i in range(10):
+        fast.sendall(b"ping %d" % i)
+        assert server_fast.recv(100) == b"ping %d" % i
+    # NOTE: The slow stream is held at its window until its reader catches up
+    assert sender.is_alive()
+    assert slow._sent <= client_mux.window
+
+    server_slow = server_mux.open_stream(1)
+    received = b""
+    while len(received) < len(slow_data):
+        received += server_slow.recv(2**20)
+    sender.join()
+    assert received == slow_data
+
+
+def test_closed_connection_fails_streams(muxes):
+    client_mux, server_mux = muxes
+    stream = server_mux.open_stream(1)
+    client_mux.open_stream(1).sendall(b"last")
+    client_mux.close()
+
+    stream.settimeout(5)
+    assert stream.recv(100) == b"last"
+    with pytest.raises(ConnectionError):
+        stream.recv(100)
+    with pytest.raises(ConnectionError):
+        stream.sendall(b"reply")
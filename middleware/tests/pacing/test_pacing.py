@@ -0,0 +1,83 @@
+import pytest
+import threading
+import middleware.pacing.pacing as pacing
+
+ADDR = ("127.0.0.1", 5000)
+OTHER_ADDR = ("127.0.0.1", 5001)
+
+
+class FakeTime:
+    now = 0.0
+
+    @staticmethod
+    def monotonic():
+        return FakeTime.now
+
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch):
+    FakeTime.now = 0.0
+    monkeypatch.setattr(pacing, "time", FakeTime)
+
+
+def test_token_bucket():
+    bucket = pacing.TokenBucket(rate=1000, burst=500)
+    assert bucket.delay(500, 0.0) == 0
+    bucket.take(500)
+    assert bucket.delay(100, 0.0) == pytest.approx(0.1)
+    assert bucket.delay(100, 0.1) == 0
+
+    # NOTE: Packets larger than the burst are allowed once the bucket is full, and leave it in debt
+    bucket.take(100)
+    assert bucket.delay(2000, 0.1) == pytest.approx(0.5)
+    bucket.take(2000)
+    assert bucket.delay(1, 0.6) == pytest.approx(1.501)
+
+    with pytest.raises(ValueError):
+        pacing.TokenBucket(rate=0, burst=500)
+
+
+def test_pacer_socket_and_destination_buckets():
+    pacer = pacing.Pacer()
+    assert not pacer.is_active(ADDR)
+    assert pacer.take(ADDR, [10**6]) == 1
+
+    pacer.set_rate(1000, 300)
+    pacer.set_rate(100, 200, ADDR)
+    assert pacer.is_active(OTHER_ADDR)
+
+    assert pacer.take(ADDR, [100, 100, 100]) == 2
+    assert pacer.delay(ADDR, 100) == pytest.approx(1.0)
+    # NOTE: Only 100 bytes are left in the socket bucket
+    assert pacer.take(OTHER_ADDR, [100, 100]) == 1
+
+    FakeTime.now = 1.0
+    assert pacer.take_all(ADDR, [200]) > 0
+    assert pacer.take_all(ADDR, [50, 50]) == 0
+
+    # NOTE: Several packets are never allowed past the burst at once, a single one is (see TokenBucket)
+    FakeTime.now = 10.0
+    with pytest.raises(ValueError):
+        pacer.take_all(ADDR, [150, 150])
+    assert pacer.take_all(ADDR, [300]) == 0
+
+    pacer.set_rate(0, 0, ADDR)
+    pacer.set_rate(0, 0)
+    assert not pacer.is_active(ADDR)
+
+
+def test_pacer_is_thread_safe():
+    pacer = pacing.Pacer()
+    pacer.set_rate(1, 1000)
+    allowed = []
+
+    def send():
+        allowed.append(sum(pacer.take(ADDR, [1]) for _ in range(1000)))
+
+    threads = [threading.Thread(target=send) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # NOTE: The time is frozen, so exactly one burst is allowed across all threads
+    assert sum(allowed) == 1000
@@ -0,0 +1,48 @@
+import pytest
+import time
+from socket import *
+import middleware.pmtu.pmtu as pmtu
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    pmtu.path_mtu_cache.clear()
+    yield
+    pmtu.path_mtu_cache.clear()
+
+
+def test_cache_entries_expire():
+    cache = pmtu.PathMtuCache(expiry=0.05)
+    cache.set("192.0.2.1", 1400)
+    assert cache.get("192.0.2.1") == 1400
+    assert cache.get("192.0.2.2") == None
+
+    time.sleep(0.1)
+    assert cache.get("192.0.2.1") == None
+
+    cache.set("192.0.2.1", 1400)
+    cache.invalidate("192.0.2.1")
+    assert cache.get("192.0.2.1") == None
+
+
+@pytest.mark.skipif(not pmtu.PMTU_AVAILABLE, reason="requires IP_MTU")
+def test_path_mtu_of_loopback():
+    mtu = pmtu.path_mtu(("127.0.0.1", 5000))
+    assert mtu >= 1500
+    assert pmtu.path_mtu_cache.get("127.0.0.1") == mtu
+
+    # NOTE: Cached path MTUs are used until they expire or are refreshed
+    pmtu.path_mtu_cache.set("127.0.0.1", 1200)
+    assert pmtu.path_mtu(("127.0.0.1", 5000)) == 1200
+    assert pmtu.path_mtu(("127.0.0.1", 5000), refresh=True) == mtu
+
+
+@pytest.mark.skipif(not pmtu.PMTU_AVAILABLE, reason="requires IP_MTU")
+def test_discovery_on_connected_socket():
+    sock = socket(AF_INET, SOCK_DGRAM)
+    assert pmtu.connected_path_mtu(sock) == None
+    assert pmtu.enable_discovery(sock)
+    assert sock.getsockopt(IPPROTO_IP, pmtu.IP_MTU_DISCOVER) == pmtu.IP_PMTUDISC_DO
+    sock.connect(("127.0.0.1", 5000))
+    assert pmtu.connected_path_mtu(sock) == pmtu.path_mtu(("127.0.0.1", 5000))
+    sock.close()
@@ -0,0 +1,116 @@
+import pytest
+import threading
+import time
+from socket import *
+from middleware.pool.pool import ConnectionPool
+
+
+@pytest.fixture
+def server():
+    """
+    Accepts connections in the background. Yields the address and the list of accepted sockets
+    """
+    listener = create_server(("127.0.0.1", 0))
+    accepted = []
+
+    def accept():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            accepted.append(conn)
+
+    thread = threading.Thread(target=accept, daemon=True)
+    thread.start()
+    yield listener.getsockname(), accepted
+    listener.close()
+    for conn in accepted:
+        conn.close()
+
+
+def test_connections_are_reused_per_key(server):
+    pool = ConnectionPool(max_size=4, max_idle=4, idle_timeout=60)
+    address, _ = server
+
+    conn = pool.checkout(address, tos=32, congestion_algorithm="reno")
+    assert conn.get_tos() == 32
+    assert conn.get_congestion_algorithm() == "reno"
+    assert conn._socko.getsockopt(IPPROTO_TCP, TCP_CONGESTION, 16).rstrip(b"\0") == (
+        b"reno"
+    )
+    pool.checkin(conn)
+    assert pool.checkout(address, tos=32, congestion_algorithm="reno") is conn
+
+    other = pool.checkout(address, tos=0, congestion_algorithm="reno")
+    assert other is not conn
+    assert pool.connections_opened == 2
+    assert pool.connections_reused == 1
+    pool.checkin(conn)
+    pool.checkin(other)
+    assert pool.idle_count() == 2
+    pool.close()
+    assert conn._socko.fileno() == -1
+
+
+def test_closed_connection_fails_health_check(server):
+    pool = ConnectionPool(max_size=1, max_idle=1, idle_timeout=60)
+    address, accepted = server
+
+    conn = pool.checkout(address)
+    pool.checkin(conn)
+    while len(accepted) == 0:
+        time.sleep(0.01)
+    accepted[0].close()
+    time.sleep(0.05)
+
+    replacement = pool.checkout(address, timeout=1)
+    assert replacement is not conn
+    assert conn._socko.fileno() == -1
+    assert pool.connections_opened == 2
+    pool.discard(replacement)
+
+
+def test_idle_timeout_and_max_idle(server):
+    pool = ConnectionPool(max_size=4, max_idle=2, idle_timeout=0.05)
+    address, _ = server
+
+    conns = [pool.checkout(address) for _ in range(3)]
+    for conn in conns:
+        pool.checkin(conn)
+    assert pool.idle_count() == 2
+    assert conns[2]._socko.fileno() == -1
+
+    time.sleep(0.1)
+    assert pool.evict_idle() == 2
+    assert pool.idle_count() == 0
+    assert all(conn._socko.fileno() == -1 for conn in conns)
+
+
+def test_checkout_waits_at_max_size(server):
+    pool = ConnectionPool(max_size=1, max_idle=1, idle_timeout=60)
+    address, _ = server
+
+    conn = pool.checkout(address)
+    with pytest.raises(TimeoutError):
+        pool.checkout(address, timeout=0.05)
+
+    threading.Timer(0.05, pool.checkin, args=(conn,)).start()
+    assert pool.checkout(address, timeout=1) is conn
+
+
+def test_connection_discarded_on_error(server):
+    pool = ConnectionPool(max_size=1, max_idle=1, idle_timeout=60)
+    address, _ = server
+
+    with pytest.raises(RuntimeError):
+        with pool.connection(address) as conn:
+            raise RuntimeError()
+    assert conn._socko.fileno() == -1
+    assert pool.idle_count() == 0
+
+    with pool.connection(address, timeout=1) as conn:
+        pass
+    assert pool.idle_count() == 1
+    with pytest.raises(ValueError):
+        pool.checkin(conn)
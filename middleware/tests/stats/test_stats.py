@@ -0,0 +1,76 @@
+import pytest
+import csv
+import io
+import time
+import middleware.stats.stats as stats
+
+
+def test_decode_tcp_info():
+    values = list(range(1, 55))
+    values[7] = 0b11  # delivery_rate_app_limited:1, fastopen_client_fail:2
+    info = stats.TcpInfo(stats._TCP_INFO.pack(*values), 1.5)
+
+    assert info.timestamp == 1.5
+    assert (info.state, info.ca_state, info.retransmits) == (1, 2, 3)
+    assert info.delivery_rate_app_limited
+    assert (info.rto, info.snd_mss, info.rcv_mss) == (9, 11, 12)
+    assert (info.lost, info.pmtu, info.rtt, info.rttvar) == (15, 22, 24, 25)
+    assert (info.snd_ssthresh, info.snd_cwnd, info.total_retrans) == (26, 27, 32)
+    assert (info.pacing_rate, info.bytes_acked) == (33, 35)
+    assert (info.delivery_rate, info.bytes_retrans) == (43, 50)
+
+    # NOTE: Older kernels return a shorter struct, the missing fields are 0
+    info = stats.TcpInfo(stats._TCP_INFO.pack(*values)[:104], 0)
+    assert info.total_retrans == 32
+    assert info.pacing_rate == 0 and info.delivery_rate == 0
+
+
+@pytest.mark.skipif(not stats.STATS_AVAILABLE, reason="requires TCP_INFO")
+def test_get_stats(reliable_connection):
+    client, server = reliable_connection
+    client.sendall(bytes(100000))
+    received = 0
+    while received < 100000:
+        received += len(server.recv(2**16))
+
+    info = client.get_stats()
+    assert isinstance(info, stats.TcpInfo)
+    assert info.state == 1
+    assert info.snd_cwnd > 0 and info.rtt > 0
+    assert info.bytes_acked >= 100000
+    assert server.get_stats().bytes_received == 100000
+
+
+@pytest.mark.skipif(not stats.STATS_AVAILABLE, reason="requires TCP_INFO")
+def test_sampler_ring_buffer_and_export(reliable_connection):
+    client, _ = reliable_connection
+    with stats.StatsSampler(client, interval=0.001, capacity=5) as sampler:
+        while len(sampler.samples()) < 5:
+            time.sleep(0.01)
+        time.sleep(0.02)
+    samples = sampler.samples()
+    assert len(samples) == 5
+    assert samples == sorted(samples, key=lambda sample: sample.timestamp)
+
+    file = io.StringIO()
+    assert sampler.export_csv(file) == 5
+    rows = list(csv.DictReader(io.StringIO(file.getvalue())))
+    assert len(rows) == 5
+    assert [float(row["timestamp"]) for row in rows] == [
+        sample.timestamp for sample in samples
+    ]
+    assert rows[-1]["snd_cwnd"] == str(samples[-1].snd_cwnd)
+
+    with pytest.raises(ValueError):
+        stats.StatsSampler(client, interval=0)
+
+
+@pytest.mark.skipif(not stats.STATS_AVAILABLE, reason="requires TCP_INFO")
+def test_sampler_stops_when_connection_is_closed(reliable_connection):
+    client, _ = reliable_connection
+    sampler = stats.StatsSampler(client, interval=0.01, capacity=100).start()
+    time.sleep(0.05)
+    client.close()
+    sampler._thread.join(timeout=1)
+    assert not sampler._thread.is_alive()
+    assert 0 < len(sampler.samples()) < 100
@@ -0,0 +1,67 @@
+import mmap
+import pytest
+import random
+import threading
+from socket import *
+import middleware.transfer.transfer as transfer
+
+
+def test_recv_into_file(tcp_connection, tmp_path):
+    sender, receiver = tcp_connection
+    data = random.randbytes(3 * mmap.ALLOCATIONGRANULARITY + 123)
+    path = tmp_path / "received"
+    path.write_bytes(b"header")
+
+    sender.sendall(data)
+    with open(path, "r+b") as file:
+        assert transfer.recv_into_file(receiver, file, len(data), offset=6) == len(data)
+    assert path.read_bytes() == b"header" + data
+
+
+def test_recv_into_file_windows(tcp_connection, tmp_path, monkeypatch):
+    sender, receiver = tcp_connection
+    monkeypatch.setattr(transfer, "RECV_FILE_WINDOW", mmap.ALLOCATIONGRANULARITY)
+    data = random.randbytes(5 * mmap.ALLOCATIONGRANULARITY)
+    path = tmp_path / "received"
+
+    thread = threading.Thread(target=sender.sendall, args=(data,))
+    thread.start()
+    with open(path, "w+b") as file:
+        assert transfer.recv_into_file(receiver, file, len(data), offset=100) == len(
+            data
+        )
+    thread.join()
+    assert path.read_bytes() == bytes(100) + data
+
+
+def test_recv_into_file_closed_early(tcp_connection, tmp_path):
+    sender, receiver = tcp_connection
+    path = tmp_path / "received"
+
+    sender.sendall(b"partial")
+    sender.shutdown(SHUT_WR)
+    with open(path, "w+b") as file:
+        assert transfer.recv_into_file(receiver, file, 1000) == 7
+    assert path.read_bytes() == b"partial"
+
+
+def test_zero_copy_sendall(tcp_connection):
+    sender, receiver = tcp_connection
+    zero_copy = transfer.ZeroCopySender(sender)
+    data = bytearray(random.randbytes(transfer.ZEROCOPY_MIN_SIZE * 64))
+    received = bytearray()
+
+    def receive():
+        while len(received) < len(data) + 5:
+            received.extend(receiver.recv(2**20))
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+    zero_copy.sendall(data)
+    zero_copy.sendall(b"small")
+    thread.join()
+
+    assert received == data + b"small"
+    if zero_copy.enabled:
+        assert zero_copy.sent_calls > 0
+        assert zero_copy.released_calls == zero_copy.sent_calls